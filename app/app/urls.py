@@ -19,6 +19,7 @@ from django.urls import path, include
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from rag.views import LivenessView, MetricsView, ReadinessView
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -37,5 +38,8 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('chats/', include('rag.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('healthz', LivenessView.as_view(), name='liveness'),
+    path('readyz', ReadinessView.as_view(), name='readiness'),
 ]
 
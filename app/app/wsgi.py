@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_wsgi_application()
+
+# Load the embedding model before the server forks workers so they share it copy-on-write.
+# Management commands never import this module and keep loading it lazily.
+if os.getenv('RAG_PRELOAD', 'true').lower() == 'true':
+    from rag.raglogic import preload
+
+    preload()
@@ -0,0 +1,55 @@
+import glob
+import os
+import sys
+
+# Production server: gunicorn managing uvicorn workers, started by `start.sh web`.
+# The app (and with RAG_PRELOAD the embedding model) is loaded once in the master and shared
+# copy-on-write by the forked workers. `kill -HUP <master pid>` starts fresh workers and stops
+# the old ones gracefully; with preload the new workers reuse the code loaded in the master,
+# so a code change still needs a restart.
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# Streaming answers can take a while; graceful_timeout bounds how long a stopping worker may
+# finish its requests and flush the write buffer before it is killed
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Recycle workers after this many requests (0 disables it), spread out so they do not restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+# Heartbeat files on tmpfs, so a slow container disk does not get workers killed
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+accesslog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# Must exist before the app, and with it prometheus_client, is loaded
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def on_starting(server):
+    # Samples left by an earlier run would be added to this one's
+    if PROMETHEUS_MULTIPROC_DIR:
+        for path in glob.glob(os.path.join(PROMETHEUS_MULTIPROC_DIR, "*.db")):
+            os.remove(path)
+
+
+def post_fork(server, worker):
+    # Clients are created per process anyway; drop any the master made while preloading
+    if "rag.raglogic" in sys.modules:
+        sys.modules["rag.raglogic"].reset_clients()
+
+
+def child_exit(server, worker):
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
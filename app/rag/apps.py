@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class RagConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .metrics import record_db_connection, register_stats
+        from .pools import database_pool_stats
+
+        connection_created.connect(record_db_connection, dispatch_uid="rag_db_connections")
+        register_stats("db_pool", database_pool_stats)
@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+from openai import AsyncOpenAI
+from typing import Any, Dict, List, Optional, Tuple
+from elasticsearch import AsyncElasticsearch
+
+from .history import CONDENSE_ENABLED, CONDENSE_MODEL, Turn, condense_prompt, condense_turns, parse_condensed
+from .metrics import StageTimer, record_answer, register_stats
+from .pools import client_pool_stats, es_client_options, openai_client_options
+from .raglogic import (
+    ELASTIC_URL,
+    INDEX_NAME,
+    NO_TOKENS,
+    OPENAI_API_KEY,
+    RRF_NUM_CANDIDATES,
+    RETRIEVAL_BACKEND,
+    answer_cache,
+    answer_usage,
+    assemble_prompt,
+    build_answer_result,
+    cache_hit_result,
+    cache_scope,
+    embedding_batcher,
+    encode_query,
+    hybrid_search_body,
+    knn_search_body,
+    needs_query_vector,
+    reciprocal_rank_fusion,
+    retrieve,
+    sample_relevance,
+    submit_query,
+    text_search_body,
+    use_answer_cache,
+)
+
+logger = logging.getLogger(__name__)
+
+# Async clients bind their connection pools to the event loop they first run on. An ASGI
+# worker keeps one loop for its lifetime, but under WSGI or runserver each async view runs
+# in a fresh loop, so the clients are kept per running loop. A loop that ends with its
+# request must close them with aclose_loop_clients(), or their HTTP sessions are left open.
+_loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+_loop_clients_lock = threading.Lock()
+
+def loop_client(name: str, factory):
+    """
+    Return the named client for the running event loop, creating it with `factory` on first use.
+    """
+    loop = asyncio.get_running_loop()
+    with _loop_clients_lock:
+        clients = _loop_clients.setdefault(loop, {})
+    client = clients.get(name)
+    if client is None:
+        client = clients[name] = factory()
+        logger.info(f"Initialized {name} client for event loop {id(loop):#x}.")
+    return client
+
+async def aclose_loop_clients() -> None:
+    """
+    Close and forget the clients of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _loop_clients_lock:
+        clients = _loop_clients.pop(loop, {})
+    for name, client in clients.items():
+        try:
+            await client.close()
+            logger.info(f"Closed {name} client for event loop {id(loop):#x}.")
+        except Exception as e:
+            logger.warning(f"Error closing {name} client: {e}")
+
+def loop_clients_pool_stats() -> Dict[str, int]:
+    """
+    Connection pool usage of the async clients, summed over the event loops that created them.
+    """
+    with _loop_clients_lock:
+        loops = [list(clients.items()) for clients in _loop_clients.values()]
+    stats: Dict[str, int] = {}
+    for clients in loops:
+        for name, value in client_pool_stats(clients).items():
+            stats[name] = stats.get(name, 0) + value
+    return stats
+
+register_stats("async_clients", loop_clients_pool_stats)
+
+# Async clients share the embedding model and answer cache with the sync pipeline
+def get_async_es_client() -> AsyncElasticsearch:
+    """
+    Return the async Elasticsearch client for the running event loop.
+    """
+    return loop_client("async_elasticsearch", lambda: AsyncElasticsearch(ELASTIC_URL, **es_client_options()))
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Return the async OpenAI client for the running event loop.
+    """
+    return loop_client("async_openai", lambda: AsyncOpenAI(api_key=OPENAI_API_KEY, **openai_client_options(use_async=True)))
+
+
+async def _search(search_query: Dict[str, Any], index_name: str, label: str) -> List[Dict[str, Any]]:
+    try:
+        response = await get_async_es_client().search(index=index_name, body=search_query)
+        results = [hit["_source"] for hit in response["hits"]["hits"]]
+        logger.info(f"Found {len(results)} results for {label} search.")
+        return results
+    except Exception as e:
+        logger.error(f"Error during {label} search: {e}")
+        return []
+
+async def aelastic_search_text(query: str, index_name: str = INDEX_NAME, size: int = 5) -> List[Dict[str, Any]]:
+    """
+    Perform a text-based search on Elasticsearch without blocking the event loop.
+    """
+    logger.info(f"Starting async text-based search for query: {query}")
+    return await _search(text_search_body(query, size), index_name, "text-based")
+
+async def aelastic_search_hybrid(
+    field: str, query: str,
+    query_vector: List[float],
+    index_name: str = INDEX_NAME
+) -> List[Dict[str, Any]]:
+    """
+    Perform a hybrid search (keyword and KNN) on Elasticsearch without blocking the event loop.
+    """
+    logger.info(f"Starting async hybrid search for query: {query} with vector.")
+    return await _search(hybrid_search_body(field, query, query_vector), index_name, "hybrid")
+
+async def aelastic_search_knn(
+    field: str, vector: List[float], index_name: str = INDEX_NAME,
+    k: int = 5, num_candidates: int = 10000
+) -> List[Dict[str, Any]]:
+    """
+    Perform a KNN search on Elasticsearch without blocking the event loop.
+    """
+    logger.info(f"Starting async KNN search on field: {field} with vector.")
+    return await _search(knn_search_body(field, vector, k, num_candidates), index_name, "KNN")
+
+async def _atimed(coroutine) -> Tuple[Any, float]:
+    start_time = time.perf_counter()
+    result = await coroutine
+    return result, time.perf_counter() - start_time
+
+async def ahybrid_search_rrf(
+    query: str,
+    vector: List[float],
+    field: str = "question_answer_vector",
+    k: int = 5,
+    num_candidates: int = RRF_NUM_CANDIDATES,
+    text_weight: float = 1.0,
+    vector_weight: float = 1.0,
+    index_name: str = INDEX_NAME,
+) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """
+    Async counterpart of hybrid_search_rrf, running both legs concurrently on the event loop.
+    """
+    logger.info(f"Starting async RRF hybrid search for query: {query} (k={k}, num_candidates={num_candidates})")
+
+    window = max(k, min(2 * k, num_candidates))
+    num_candidates = max(num_candidates, window)
+    (text_results, text_latency), (vector_results, vector_latency) = await asyncio.gather(
+        _atimed(aelastic_search_text(query, index_name, window)),
+        _atimed(aelastic_search_knn(field, vector, index_name, window, num_candidates)),
+    )
+
+    results = reciprocal_rank_fusion(
+        {"text": text_results, "vector": vector_results},
+        {"text": text_weight, "vector": vector_weight},
+        k,
+    )
+    return results, {"text": text_latency, "vector": vector_latency}
+
+async def allm(prompt: str, model_choice: str) -> Tuple[str, Dict[str, int], float]:
+    """
+    Call the language model asynchronously with the given prompt and model choice.
+    """
+    logger.info(f"Sending prompt to language model: {model_choice}")
+    start_time = time.time()
+
+    try:
+        if model_choice.startswith("openai/"):
+            model_name = model_choice.split("/")[-1]
+            response = await get_async_openai_client().chat.completions.create(
+                model=model_name,
+                messages=[{"role": "user", "content": prompt}]
+            )
+            answer = response.choices[0].message.content
+            tokens = {
+                'prompt_tokens': response.usage.prompt_tokens,
+                'completion_tokens': response.usage.completion_tokens,
+                'total_tokens': response.usage.total_tokens
+            }
+            response_time = time.time() - start_time
+            logger.info(f"LLM returned an answer in {response_time:.2f} seconds.")
+            return answer, tokens, response_time
+        else:
+            raise ValueError(f"Unknown model choice: {model_choice}")
+    except Exception as e:
+        logger.error(f"Error while calling LLM: {e}")
+        raise
+
+async def acondense_query(query: str, history: Optional[List[Turn]]) -> Tuple[str, Dict[str, int]]:
+    """
+    Async variant of raglogic.condense_query.
+    """
+    if not history or not CONDENSE_ENABLED:
+        return query, NO_TOKENS
+    try:
+        output, tokens, _ = await allm(condense_prompt(query, condense_turns(history)), CONDENSE_MODEL)
+    except Exception as e:
+        logger.warning(f"Could not condense follow-up question, searching with it as asked: {e}")
+        return query, NO_TOKENS
+    condensed = parse_condensed(query, output)
+    logger.info(f"Condensed follow-up question to: {condensed}")
+    return condensed, tokens
+
+async def aget_answer(
+    query: str,
+    model_choice: str,
+    search_type: str,
+    index_name: str = INDEX_NAME,
+    search_options: Optional[Dict[str, Any]] = None,
+    history: Optional[List[Turn]] = None,
+) -> Dict[str, Any]:
+    """
+    Get an answer to the query without blocking the event loop on network I/O.
+
+    Query embeddings go through the shared micro-batcher; cache lookups run in a worker thread.
+    """
+    logger.info(f"Fetching answer asynchronously for query: {query} with model: {model_choice} and search type: {search_type}")
+
+    try:
+        start_time = time.time()
+        timer = StageTimer()
+        with timer.stage("condense"):
+            search_query, condense_tokens = await acondense_query(query, history)
+        use_cache = use_answer_cache(history)
+        vector = None
+        if needs_query_vector(search_type):
+            with timer.stage("embed"):
+                if embedding_batcher is not None:
+                    vector = (await asyncio.wrap_future(submit_query(search_query))).tolist()
+                else:
+                    vector = await asyncio.to_thread(encode_query, search_query)
+
+        if use_cache:
+            with timer.stage("cache_lookup"):
+                cached = await asyncio.to_thread(
+                    answer_cache.lookup, search_query, model_choice, cache_scope(search_type, search_options), vector
+                )
+            if cached is not None:
+                result = {
+                    **cache_hit_result(cached, time.time() - start_time, condense_tokens),
+                    "search_query": search_query,
+                    "stage_latency": timer.as_dict(),
+                }
+                record_answer(result, search_type)
+                return result
+
+        with timer.stage("retrieve"):
+            retrieval_start = time.perf_counter()
+            if RETRIEVAL_BACKEND == "memory":
+                search_results, retrieval_latency = await asyncio.to_thread(
+                    retrieve, search_query, search_type, vector, index_name, search_options
+                )
+            elif search_type == "rrf":
+                search_results, retrieval_latency = await ahybrid_search_rrf(
+                    search_query, vector, index_name=index_name, **(search_options or {})
+                )
+            else:
+                if search_type == "vector":
+                    search_results = await aelastic_search_knn("question_vector", vector, index_name)
+                elif search_type == "text":
+                    search_results = await aelastic_search_text(search_query, index_name)
+                else:
+                    search_results = await aelastic_search_hybrid("question_answer_vector", search_query, vector, index_name)
+                retrieval_latency = {search_type: time.perf_counter() - retrieval_start}
+
+        with timer.stage("prompt"):
+            prompt, context_stats = assemble_prompt(query, search_results, history, model_choice)
+        with timer.stage("generate"):
+            answer, tokens, response_time = await allm(prompt, model_choice)
+        tokens, openai_cost = answer_usage(model_choice, tokens, condense_tokens)
+
+        logger.info(f"Answer generated for query: {query}")
+
+        result = build_answer_result(
+            answer, response_time, sample_relevance(), "", model_choice, tokens, NO_TOKENS, openai_cost
+        )
+        result["retrieval_latency"] = retrieval_latency
+        result["search_query"] = search_query
+        result["context_tokens_saved"] = context_stats["context_tokens_saved"]
+        result["stage_latency"] = timer.as_dict()
+        if use_cache and search_results:
+            answer_cache.store(search_query, model_choice, cache_scope(search_type, search_options), result, vector)
+        record_answer(result, search_type)
+        return result
+    except Exception as e:
+        logger.error(f"Error generating answer: {e}")
+        return {"error": "An error occurred while fetching the answer."}
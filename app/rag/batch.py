@@ -0,0 +1,275 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+import openai
+
+from .metrics import record_answer, record_error
+from .raglogic import (
+    INDEX_NAME,
+    NO_TOKENS,
+    RETRIEVAL_BACKEND,
+    RRF_NUM_CANDIDATES,
+    answer_usage,
+    assemble_prompt,
+    encode_texts,
+    get_es_client,
+    get_openai_client,
+    hybrid_search_body,
+    knn_search_body,
+    llm,
+    reciprocal_rank_fusion,
+    retrieve,
+    text_search_body,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "100"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "5000"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "6"))
+BATCH_BACKOFF_BASE = float(os.getenv("BATCH_BACKOFF_BASE", "1.0"))
+BATCH_BACKOFF_MAX = float(os.getenv("BATCH_BACKOFF_MAX", "60"))
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and server-side failures
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class RateLimitGate:
+    """
+    Shared pause for all batch workers after the API reports a rate limit.
+
+    When one call is rate limited, every worker waits out the same cool-down before its next
+    call instead of each hammering the API with its own retries.
+    """
+
+    def __init__(self):
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after-ms")
+    if value:
+        return float(value) / 1000
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def llm_with_backoff(prompt: str, model_choice: str, gate: RateLimitGate, max_retries: int = BATCH_MAX_RETRIES):
+    """
+    Call the LLM, retrying rate limits and transient errors with jittered exponential backoff.
+
+    A Retry-After header from the API takes precedence over the computed delay. The client's
+    own retries are turned off, so this loop is the only retry policy.
+    """
+    client = get_openai_client().with_options(max_retries=0)
+    for attempt in range(max_retries + 1):
+        gate.wait()
+        try:
+            return llm(prompt, model_choice, client=client)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = _retry_after(e) or min(BATCH_BACKOFF_MAX, BATCH_BACKOFF_BASE * 2 ** attempt)
+            delay *= random.uniform(1.0, 1.25)
+            if isinstance(e, openai.RateLimitError):
+                gate.pause(delay)
+            logger.warning(f"LLM call failed ({type(e).__name__}), retry {attempt + 1}/{max_retries} in {delay:.1f}s.")
+            time.sleep(delay)
+
+
+def _search_bodies(
+    query: str, vector: Optional[List[float]], search_type: str, search_options: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    if search_type == "rrf":
+        k = search_options.get("k", 5)
+        num_candidates = search_options.get("num_candidates", RRF_NUM_CANDIDATES)
+        window = max(k, min(2 * k, num_candidates))
+        return [
+            text_search_body(query, window),
+            knn_search_body("question_answer_vector", vector, window, max(num_candidates, window)),
+        ]
+    if search_type == "vector":
+        return [knn_search_body("question_vector", vector)]
+    if search_type == "text":
+        return [text_search_body(query)]
+    return [hybrid_search_body("question_answer_vector", query, vector)]
+
+
+def msearch(
+    queries: Sequence[str],
+    vectors: Optional[Sequence[List[float]]],
+    search_type: str,
+    index_name: str = INDEX_NAME,
+    search_options: Optional[Dict[str, Any]] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Retrieve context for many queries with one Elasticsearch multi-search request.
+
+    A query whose search fails gets an empty result list rather than failing the batch.
+    """
+    search_options = search_options or {}
+    bodies_per_query = []
+    searches: List[Dict[str, Any]] = []
+    for position, query in enumerate(queries):
+        bodies = _search_bodies(query, vectors[position] if vectors is not None else None, search_type, search_options)
+        bodies_per_query.append(len(bodies))
+        for body in bodies:
+            searches.extend([{"index": index_name}, body])
+
+    responses = get_es_client().msearch(searches=searches)["responses"]
+    results: List[List[Dict[str, Any]]] = []
+    offset = 0
+    for count in bodies_per_query:
+        legs = []
+        for response in responses[offset:offset + count]:
+            if "error" in response:
+                logger.error(f"Error in batch search: {response['error']}")
+                legs.append([])
+            else:
+                legs.append([hit["_source"] for hit in response["hits"]["hits"]])
+        offset += count
+        if search_type == "rrf":
+            legs = [reciprocal_rank_fusion(
+                {"text": legs[0], "vector": legs[1]},
+                {"text": search_options.get("text_weight", 1.0), "vector": search_options.get("vector_weight", 1.0)},
+                search_options.get("k", 5),
+            )]
+        results.append(legs[0])
+    return results
+
+
+def retrieve_many(
+    queries: Sequence[str],
+    search_type: str,
+    index_name: str = INDEX_NAME,
+    search_options: Optional[Dict[str, Any]] = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Embed a chunk of queries in one forward pass and retrieve context for all of them.
+    """
+    vectors = None
+    if search_type != "text":
+        vectors = [vector.tolist() for vector in encode_texts(list(queries))]
+    if RETRIEVAL_BACKEND == "memory":
+        return [
+            retrieve(query, search_type, vectors[position] if vectors is not None else None, index_name, search_options)[0]
+            for position, query in enumerate(queries)
+        ]
+    return msearch(queries, vectors, search_type, index_name, search_options)
+
+
+def _answer_one(
+    item: Dict[str, str],
+    search_results: List[Dict[str, Any]],
+    model_choice: str,
+    search_type: str,
+    gate: RateLimitGate,
+) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"id": item["id"], "question": item["question"], "model_used": model_choice}
+    try:
+        prompt, context_stats = assemble_prompt(item["question"], search_results, None, model_choice)
+        answer, tokens, response_time = llm_with_backoff(prompt, model_choice, gate)
+        tokens, openai_cost = answer_usage(model_choice, tokens, NO_TOKENS)
+        result.update({
+            "answer": answer,
+            "sources": [faq.get("id") for faq in search_results],
+            "response_time": response_time,
+            **tokens,
+            "openai_cost": openai_cost,
+            "context_tokens_saved": context_stats["context_tokens_saved"],
+        })
+        record_answer(result, search_type)
+    except Exception as e:
+        record_error("batch")
+        logger.error(f"Error answering batch question {item['id']}: {e}")
+        result["error"] = str(e)
+    return result
+
+
+def answer_batch(
+    items: Iterable[Dict[str, str]],
+    model_choice: str,
+    search_type: str,
+    index_name: str = INDEX_NAME,
+    search_options: Optional[Dict[str, Any]] = None,
+    concurrency: int = BATCH_CONCURRENCY,
+    chunk_size: int = BATCH_CHUNK_SIZE,
+    skip_ids: Optional[Set[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Answer many questions, yielding one result per question as soon as it is ready.
+
+    `items` are {"id", "question"} dicts. Questions are embedded and retrieved `chunk_size`
+    at a time (one forward pass and one multi-search per chunk) while earlier chunks are
+    still being answered, and at most `concurrency` LLM calls run at once. Ids in
+    `skip_ids` are skipped, so a run can resume from its checkpoint. Results come back in
+    completion order; a failed question yields a result with an `error` field.
+    """
+    gate = RateLimitGate()
+    skip_ids = skip_ids or set()
+    pending: Set[Future] = set()
+
+    def chunks() -> Iterator[List[Dict[str, str]]]:
+        chunk: List[Dict[str, str]] = []
+        for item in items:
+            if item["id"] in skip_ids:
+                continue
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch-llm")
+    try:
+        for chunk in chunks():
+            questions = [item["question"] for item in chunk]
+            try:
+                all_results = retrieve_many(questions, search_type, index_name, search_options)
+            except Exception as e:
+                record_error("batch")
+                logger.error(f"Error retrieving context for a batch of {len(chunk)} questions: {e}")
+                for item in chunk:
+                    yield {"id": item["id"], "question": item["question"], "model_used": model_choice, "error": str(e)}
+                continue
+
+            for item, search_results in zip(chunk, all_results):
+                pending.add(executor.submit(_answer_one, item, search_results, model_choice, search_type, gate))
+
+            # Hand back finished answers, blocking while too many LLM calls are queued
+            while pending:
+                backlog = len(pending) > 2 * concurrency
+                done, pending = wait(pending, timeout=None if backlog else 0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                if not backlog:
+                    break
+
+        for future in as_completed(pending):
+            yield future.result()
+    finally:
+        # A client that stops reading should not leave queued LLM calls running
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,179 @@
+import collections
+import logging
+import queue
+import threading
+import time
+
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """
+    Groups concurrent embedding requests into micro-batches encoded in one forward pass.
+
+    Callers get a Future per text. A single worker thread takes the first waiting text,
+    then keeps collecting until `max_batch_size` texts are queued or `max_wait` seconds
+    have passed, and encodes the unique texts of the batch with one `encode_fn` call.
+    Running inference on one thread also stops request threads from contending for the model.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+        stats_window: int = 1000,
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Tuple[str, Future, float]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._batch_sizes: Deque[int] = collections.deque(maxlen=stats_window)
+        self._queue_waits: Deque[float] = collections.deque(maxlen=stats_window)
+        self._encode_times: Deque[float] = collections.deque(maxlen=stats_window)
+
+    def submit(self, text: str) -> Future:
+        """
+        Queue a text for encoding and return a Future resolving to its vector.
+        """
+        future: Future = Future()
+        if self._stopping.is_set():
+            future.set_exception(RuntimeError("Embedding batcher is shut down."))
+            return future
+        self._ensure_started()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """
+        Encode a single text through the batcher, blocking until its batch completes.
+        """
+        return self.submit(text).result(timeout)
+
+    def pending(self) -> int:
+        """
+        Return the number of texts waiting to be batched.
+        """
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Batch size and queue wait metrics over the most recent batches and requests.
+        """
+        with self._stats_lock:
+            sizes = np.array(self._batch_sizes, dtype=np.float64)
+            waits = np.array(self._queue_waits, dtype=np.float64)
+            encode_times = np.array(self._encode_times, dtype=np.float64)
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "pending": self.pending(),
+                "batch_size_mean": float(sizes.mean()) if sizes.size else 0.0,
+                "batch_size_max": int(sizes.max()) if sizes.size else 0,
+                "queue_wait_p50": _percentile(waits, 50),
+                "queue_wait_p95": _percentile(waits, 95),
+                "queue_wait_max": float(waits.max()) if waits.size else 0.0,
+                "encode_time_p50": _percentile(encode_times, 50),
+                "encode_time_p95": _percentile(encode_times, 95),
+            }
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """
+        Stop accepting work and finish the texts already queued, up to `timeout` seconds.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self) -> List[Tuple[str, Future, float]]:
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._encode(batch)
+            except Exception as e:
+                # Keep the only worker thread alive; fail whatever this batch left unresolved
+                logger.exception(f"Embedding batcher failed on a batch of {len(batch)} texts: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        _resolve(future, exception=e)
+
+    def _encode(self, batch: List[Tuple[str, Future, float]]) -> None:
+        # Drop texts whose callers gave up, e.g. a cancelled async request; the rest can no longer be cancelled
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        try:
+            vectors = dict(zip(texts, self.encode_fn(texts)))
+        except Exception as e:
+            logger.exception(f"Error encoding batch of {len(texts)} texts: {e}")
+            with self._stats_lock:
+                self._errors += 1
+            for _, future, _ in batch:
+                _resolve(future, exception=e)
+            return
+
+        for text, future, _ in batch:
+            _resolve(future, result=vectors[text])
+
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_sizes.append(len(batch))
+            self._encode_times.append(time.perf_counter() - started)
+            self._queue_waits.extend(started - queued_at for _, _, queued_at in batch)
+
+
+def _resolve(future: Future, result: Any = None, exception: Optional[BaseException] = None) -> None:
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        logger.debug("Embedding future was already resolved or cancelled.")
+
+
+def _percentile(values: np.ndarray, q: float) -> float:
+    return float(np.percentile(values, q)) if values.size else 0.0
@@ -0,0 +1,256 @@
+import logging
+import re
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?!.,;: "
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query so trivially different phrasings share a cache key.
+    """
+    return _WHITESPACE_RE.sub(" ", query).strip().lower().rstrip(_TRAILING_PUNCTUATION)
+
+
+class SemanticCache:
+    """
+    In-memory answer cache keyed on the normalized query, model choice and search type.
+
+    Exact hits are served from a dict lookup. Near-duplicate queries are served when the
+    cosine similarity of their embedding to a cached embedding reaches `similarity_threshold`.
+    Embeddings live in one preallocated matrix, updated on store and eviction, so a semantic
+    lookup is a single matrix-vector product. Entries expire after `ttl` seconds: an expired
+    entry is dropped when a lookup hits it, and all expired entries are swept every
+    `sweep_interval` seconds. The least recently used entry is evicted once `max_entries` is
+    reached. The whole cache is dropped when `version_fn` reports that the underlying search
+    index has changed.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        similarity_threshold: float = 0.95,
+        version_fn: Optional[Callable[[], Optional[str]]] = None,
+        version_check_interval: float = 60.0,
+        sweep_interval: Optional[float] = None,
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.version_fn = version_fn
+        self.version_check_interval = version_check_interval
+        self.sweep_interval = sweep_interval if sweep_interval is not None else min(ttl, 60.0)
+
+        self._entries: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._index_version: Optional[str] = None
+        self._version_checked_at = 0.0
+        self._swept_at = time.time()
+
+        # Row i of _vectors holds the embedding of _row_keys[i]; _row_scopes[i] is the id of its
+        # (model choice, search type), or -1 for a free row. Rows are reused after eviction.
+        self._vectors: Optional[np.ndarray] = None
+        self._row_scopes = np.full(0, -1, dtype=np.int32)
+        self._row_keys: List[Optional[Tuple[str, str, str]]] = []
+        self._free_rows: List[int] = []
+        self._scope_ids: Dict[Tuple[str, str], int] = {}
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(
+        self,
+        query: str,
+        model_choice: str,
+        search_type: str,
+        vector: Optional[List[float]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached result for the query, or None on a miss.
+        """
+        self._check_index_version()
+        key = (normalize_query(query), model_choice, search_type)
+        now = time.time()
+
+        with self._lock:
+            if now - self._swept_at >= self.sweep_interval:
+                self._sweep(now)
+
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                logger.info(f"Answer cache hit for query: {query}")
+                return entry["result"]
+
+            if vector is not None and self.similarity_threshold < 1.0:
+                match = self._nearest(key, np.asarray(vector, dtype=np.float32), now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.semantic_hits += 1
+                    logger.info(f"Answer cache semantic hit for query: {query} (matched: {match[0]})")
+                    return self._entries[match]["result"]
+
+            self.misses += 1
+            return None
+
+    def store(
+        self,
+        query: str,
+        model_choice: str,
+        search_type: str,
+        result: Dict[str, Any],
+        vector: Optional[List[float]] = None,
+    ) -> None:
+        """
+        Store a result for the query, evicting the least recently used entry if full.
+        """
+        key = (normalize_query(query), model_choice, search_type)
+        embedding = None
+        if vector is not None:
+            embedding = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(embedding)
+            embedding = embedding / norm if norm > 0 else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._release(evicted["row"])
+                self.evictions += 1
+            self._entries[key] = {
+                "result": result,
+                "row": self._add_row(key, embedding) if embedding is not None else None,
+                "expires_at": time.time() + self.ttl,
+            }
+
+    def invalidate(self, reason: str = "") -> None:
+        """
+        Drop every cached entry.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._row_scopes[:] = -1
+            self._row_keys = [None] * len(self._row_keys)
+            self._free_rows = list(range(len(self._row_keys) - 1, -1, -1))
+            self.invalidations += 1
+        logger.info(f"Answer cache invalidated. {reason}".strip())
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return hit/miss counters and the current size of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_ratio": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "index_version": self._index_version,
+            }
+
+    def _sweep(self, now: float) -> None:
+        self._swept_at = now
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            self._remove(key)
+
+    def _remove(self, key: Tuple[str, str, str]) -> None:
+        self._release(self._entries.pop(key)["row"])
+
+    def _release(self, row: Optional[int]) -> None:
+        if row is None:
+            return
+        self._row_scopes[row] = -1
+        self._row_keys[row] = None
+        self._free_rows.append(row)
+
+    def _add_row(self, key: Tuple[str, str, str], embedding: np.ndarray) -> Optional[int]:
+        if self._vectors is None:
+            capacity = min(self.max_entries, 64)
+            self._vectors = np.zeros((capacity, embedding.shape[0]), dtype=np.float32)
+        elif embedding.shape[0] != self._vectors.shape[1]:
+            return None
+        if not self._free_rows:
+            self._grow()
+        row = self._free_rows.pop()
+        self._vectors[row] = embedding
+        self._row_scopes[row] = self._scope_ids.setdefault(key[1:], len(self._scope_ids))
+        self._row_keys[row] = key
+        return row
+
+    def _grow(self) -> None:
+        # Double the matrix up to max_entries; the first call sizes the bookkeeping to it
+        used = len(self._row_keys)
+        capacity = self._vectors.shape[0]
+        if used == capacity:
+            capacity = min(self.max_entries, capacity * 2)
+            grown = np.zeros((capacity, self._vectors.shape[1]), dtype=np.float32)
+            grown[:used] = self._vectors[:used]
+            self._vectors = grown
+        self._row_scopes = np.concatenate([self._row_scopes, np.full(capacity - used, -1, dtype=np.int32)])
+        self._row_keys.extend([None] * (capacity - used))
+        self._free_rows.extend(range(capacity - 1, used - 1, -1))
+
+    def _nearest(self, key: Tuple[str, str, str], vector: np.ndarray, now: float) -> Optional[Tuple[str, str, str]]:
+        scope = self._scope_ids.get(key[1:])
+        if scope is None or self._vectors is None or vector.shape[0] != self._vectors.shape[1]:
+            return None
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+
+        rows = len(self._row_keys)
+        scores = self._vectors[:rows] @ (vector / norm)
+        scores[self._row_scopes != scope] = -np.inf
+        while True:
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            match = self._row_keys[best]
+            if self._entries[match]["expires_at"] > now:
+                return match
+            self._remove(match)
+            scores[best] = -np.inf
+
+    def _check_index_version(self) -> None:
+        if self.version_fn is None:
+            return
+
+        now = time.time()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = now
+
+        try:
+            version = self.version_fn()
+        except Exception as e:
+            logger.warning(f"Could not determine search index version: {e}")
+            return
+
+        if version is None:
+            return
+        if self._index_version is not None and version != self._index_version:
+            self.invalidate(f"Search index changed from {self._index_version} to {version}.")
+        self._index_version = version
@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import re
+
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from .tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Token budget for the FAQ context in the answer prompt, per model; other models use the default
+PROMPT_CONTEXT_BUDGET = int(os.getenv("PROMPT_CONTEXT_BUDGET", "1500"))
+PROMPT_CONTEXT_BUDGETS: Dict[str, int] = {
+    "openai/gpt-3.5-turbo": 1500,
+    "openai/gpt-4o": 2500,
+    "openai/gpt-4o-mini": 2500,
+    **json.loads(os.getenv("PROMPT_CONTEXT_BUDGETS", "{}")),
+}
+PROMPT_PASSAGE_MAX_TOKENS = int(os.getenv("PROMPT_PASSAGE_MAX_TOKENS", "400"))
+# A truncated passage must keep at least this many tokens to be worth including
+PROMPT_PASSAGE_MIN_TOKENS = int(os.getenv("PROMPT_PASSAGE_MIN_TOKENS", "60"))
+CONTEXT_DEDUP_SIMILARITY = float(os.getenv("CONTEXT_DEDUP_SIMILARITY", "0.85"))
+
+_WORD = re.compile(r"\w+")
+
+
+def context_budget(model_choice: Optional[str]) -> int:
+    """
+    Context token budget for a model.
+    """
+    return PROMPT_CONTEXT_BUDGETS.get(model_choice, PROMPT_CONTEXT_BUDGET)
+
+
+def format_passage(faq: Dict[str, Any]) -> str:
+    return f"section: {faq['section']}\nquestion: {faq['question']}\nanswer: {faq['answer']}"
+
+
+def shingles(text: str, size: int = 3) -> FrozenSet[Tuple[str, ...]]:
+    """
+    Word n-grams of a text, lower-cased, for near-duplicate detection.
+    """
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return frozenset([tuple(words)]) if words else frozenset()
+    return frozenset(tuple(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def jaccard(a: FrozenSet, b: FrozenSet) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def deduplicate(search_results: List[Dict[str, Any]], threshold: float = CONTEXT_DEDUP_SIMILARITY) -> List[Dict[str, Any]]:
+    """
+    Drop hits whose question and answer nearly repeat a higher-ranked hit.
+
+    The same FAQ is often published under several sections with the same or lightly edited
+    wording; only the best-ranked copy is kept.
+    """
+    kept: List[Dict[str, Any]] = []
+    kept_shingles: List[FrozenSet] = []
+    for faq in search_results:
+        faq_shingles = shingles(f"{faq.get('question', '')} {faq.get('answer', '')}")
+        if any(jaccard(faq_shingles, other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(faq)
+        kept_shingles.append(faq_shingles)
+    return kept
+
+
+def assemble_context(
+    search_results: List[Dict[str, Any]],
+    model_choice: Optional[str] = None,
+    budget: Optional[int] = None,
+) -> Tuple[str, Dict[str, int]]:
+    """
+    Build the prompt's FAQ context within the model's token budget.
+
+    Near-duplicate hits are dropped, each answer is cut to PROMPT_PASSAGE_MAX_TOKENS, and
+    passages are added in rank order until the budget is spent; the last one is truncated
+    to fit if enough room is left. Returns the context and token statistics, including the
+    tokens saved against concatenating every hit in full.
+    """
+    budget = context_budget(model_choice) if budget is None else budget
+    full_tokens = count_tokens("\n\n".join(format_passage(faq) for faq in search_results), model_choice)
+
+    unique = deduplicate(search_results)
+    passages: List[str] = []
+    used = 0
+    truncated = 0
+    for faq in unique:
+        separator = 2 if passages else 0
+        header = format_passage({**faq, "answer": ""})
+        header_tokens = count_tokens(header, model_choice)
+        room = budget - used - separator - header_tokens
+        if room < min(PROMPT_PASSAGE_MIN_TOKENS, count_tokens(faq["answer"], model_choice)):
+            break
+        answer = truncate_tokens(faq["answer"], min(room, PROMPT_PASSAGE_MAX_TOKENS), model_choice)
+        if answer != faq["answer"]:
+            truncated += 1
+        passage = header + answer
+        passages.append(passage)
+        used += separator + count_tokens(passage, model_choice)
+
+    context = "\n\n".join(passages)
+    context_tokens = count_tokens(context, model_choice)
+    stats = {
+        "context_tokens": context_tokens,
+        "context_tokens_saved": max(0, full_tokens - context_tokens),
+        "passages": len(passages),
+        "duplicates_dropped": len(search_results) - len(unique),
+        "passages_truncated": truncated,
+    }
+    if stats["context_tokens_saved"]:
+        logger.info(
+            f"Prompt context trimmed from {full_tokens} to {context_tokens} tokens "
+            f"({stats['duplicates_dropped']} duplicates dropped, {truncated} passages truncated)."
+        )
+    return context, stats
@@ -0,0 +1,159 @@
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import threading
+
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 16
+
+
+def text_key(model_name: str, text: str) -> bytes:
+    """
+    Fixed-width key for a (model name, text) pair.
+    """
+    return hashlib.blake2b(f"{model_name}\0{text}".encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+
+class EmbeddingStore:
+    """
+    Append-only on-disk embedding cache for a single model.
+
+    Meant for corpus texts, which are encoded again on every index build and retriever load;
+    user queries are looked up but not stored, so the store only grows with the corpus.
+
+    Vectors live in `vectors.f32`, a raw row-major float32 matrix that is memory-mapped
+    read-only, so cached vectors are returned as views without copying. `keys.bin` holds
+    one 16-byte key per row in the same order. Keys are written after their vectors, so a
+    row only becomes visible once it is complete. Appends are serialized across processes
+    with an advisory file lock.
+    """
+
+    def __init__(self, directory: str, model_name: str, dim: int = 384):
+        self.model_name = model_name
+        self.dim = dim
+        self.directory = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.keys_path = os.path.join(self.directory, "keys.bin")
+        self.lock_path = os.path.join(self.directory, ".lock")
+
+        self._lock = threading.Lock()
+        self._index: Dict[bytes, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._rows = 0
+        self._keys_size = -1
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._reload()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """
+        Return the cached vector for the text, or None if it has not been stored.
+        """
+        return self.get_many([text])[0]
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        Return cached vectors for the texts, with None for each text not yet stored.
+        """
+        keys = [text_key(self.model_name, text) for text in texts]
+        with self._lock:
+            if any(key not in self._index for key in keys):
+                self._reload()
+            return [self._row(key) for key in keys]
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray) -> None:
+        """
+        Append vectors for the texts, skipping any that are already stored.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        with self._lock, open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._reload()
+                new_keys, new_rows, seen = [], [], set()
+                for text, vector in zip(texts, vectors):
+                    key = text_key(self.model_name, text)
+                    if key in self._index or key in seen:
+                        continue
+                    seen.add(key)
+                    new_keys.append(key)
+                    new_rows.append(vector)
+                if not new_keys:
+                    return
+
+                with open(self.vectors_path, "ab") as vectors_file:
+                    # Drop any vectors left behind by an interrupted append before writing
+                    vectors_file.truncate(self._rows * self.dim * 4)
+                    vectors_file.write(np.stack(new_rows).astype(np.float32).tobytes())
+                    vectors_file.flush()
+                    os.fsync(vectors_file.fileno())
+                with open(self.keys_path, "ab") as keys_file:
+                    keys_file.write(b"".join(new_keys))
+                self._reload()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def encode(
+        self,
+        texts: Sequence[str],
+        encode_fn: Callable[[List[str]], np.ndarray],
+        persist: bool = True,
+    ) -> np.ndarray:
+        """
+        Return vectors for the texts, calling `encode_fn` only for texts not already stored.
+
+        With `persist` off the newly encoded vectors are returned without being stored, so
+        one-off texts such as user queries do not grow the store.
+        """
+        cached = self.get_many(texts)
+        missing = sorted({text for text, vector in zip(texts, cached) if vector is None})
+        if missing:
+            logger.info(f"Embedding store miss for {len(missing)} of {len(texts)} texts; encoding.")
+            encoded = np.asarray(encode_fn(missing), dtype=np.float32).reshape(len(missing), self.dim)
+            if persist:
+                self.put_many(missing, encoded)
+            fresh = dict(zip(missing, encoded))
+            cached = [vector if vector is not None else fresh[text] for text, vector in zip(texts, cached)]
+
+        if not cached:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack(cached)
+
+    def _row(self, key: bytes) -> Optional[np.ndarray]:
+        row = self._index.get(key)
+        return None if row is None else self._vectors[row]
+
+    def _reload(self) -> None:
+        # Only rows appended since the last reload are read; the files only ever grow
+        keys_size = os.path.getsize(self.keys_path) if os.path.exists(self.keys_path) else 0
+        if keys_size == self._keys_size:
+            return
+
+        vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        rows = min(keys_size // KEY_BYTES, vectors_size // (self.dim * 4))
+        if rows < self._rows:
+            # The store was replaced or cleared underneath us; start over
+            self._index, self._rows = {}, 0
+        if rows == 0:
+            self._index, self._vectors = {}, None
+        elif rows > self._rows:
+            keys = np.fromfile(
+                self.keys_path, dtype=f"S{KEY_BYTES}", count=rows - self._rows, offset=self._rows * KEY_BYTES
+            )
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            # Fixed-width bytes drop trailing NULs, so pad keys back to their full width
+            self._index.update(
+                (key.ljust(KEY_BYTES, b"\0"), row) for row, key in enumerate(keys.tolist(), start=self._rows)
+            )
+        self._rows = rows
+        self._keys_size = keys_size
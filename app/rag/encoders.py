@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import re
+
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKEND_SENTENCE_TRANSFORMERS = "sentence-transformers"
+BACKEND_ONNX = "onnx"
+
+CONFIG_FILE = "encoder_config.json"
+TOKENIZER_FILE = "tokenizer.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_int8.onnx"
+
+
+def default_onnx_dir(base_dir: str, model_name: str) -> str:
+    """
+    Directory holding the exported ONNX encoder for a model.
+    """
+    return os.path.join(base_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+
+
+def encoder_id(model_name: str, backend: str, quantized: bool = True) -> str:
+    """
+    Identifier for the vectors an encoder produces, used to keep embedding caches and indices apart.
+    """
+    if backend == BACKEND_ONNX:
+        return f"{model_name}+onnx-{'int8' if quantized else 'fp32'}"
+    return model_name
+
+
+class OnnxEncoder:
+    """
+    SentenceTransformer-compatible encoder running an exported transformer on ONNX Runtime.
+
+    The exported graph maps token ids to token embeddings; pooling and normalization are
+    applied here with NumPy, following the settings recorded at export time. Only
+    `onnxruntime` and `tokenizers` are needed at runtime, not torch.
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = True, intra_op_threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), "r") as f:
+            self.config: Dict[str, Any] = json.load(f)
+
+        self.quantized = quantized
+        self.model_path = os.path.join(model_dir, QUANTIZED_MODEL_FILE if quantized else MODEL_FILE)
+        self.dimension = int(self.config["dimension"])
+        self.pooling = self.config.get("pooling", "mean")
+        self.normalize = bool(self.config.get("normalize", False))
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(int(self.config.get("max_seq_length", 256)))
+        self.tokenizer.enable_padding(
+            pad_id=int(self.config.get("pad_token_id", 0)),
+            pad_token=self.config.get("pad_token", "[PAD]"),
+        )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        logger.info(f"Loaded ONNX encoder from {self.model_path}.")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(
+        self,
+        sentences: Union[str, Sequence[str]],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        **kwargs,
+    ) -> np.ndarray:
+        """
+        Embed one text or a list of texts, mirroring SentenceTransformer.encode.
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        # Sorting by length keeps padding within each batch small
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            vectors[batch] = self._encode_batch([texts[i] for i in batch])
+
+        if normalize_embeddings and not self.normalize:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[0] if single else vectors
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        token_embeddings = self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+
+        if self.pooling == "cls":
+            pooled = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+        if self.normalize:
+            pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32)
+
+
+def load_encoder(
+    model_name: str,
+    backend: str = BACKEND_SENTENCE_TRANSFORMERS,
+    onnx_dir: Optional[str] = None,
+    quantized: bool = True,
+):
+    """
+    Load the embedding model with the configured backend.
+    """
+    if backend == BACKEND_ONNX:
+        return OnnxEncoder(onnx_dir, quantized=quantized)
+    if backend != BACKEND_SENTENCE_TRANSFORMERS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name)
+
+
+def export_onnx(model_name: str, output_dir: str, quantize: bool = True, opset: int = 14) -> Dict[str, Any]:
+    """
+    Export a SentenceTransformer's transformer to ONNX and, optionally, an int8 dynamically quantized copy.
+
+    Needs torch and sentence-transformers, so it runs at build time rather than in the API.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    pooling = next((module for module in model if isinstance(module, Pooling)), None)
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, TOKENIZER_FILE))
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(model_path, os.path.join(output_dir, QUANTIZED_MODEL_FILE), weight_type=QuantType.QInt8)
+
+    config = {
+        "model_name": model_name,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.max_seq_length,
+        "pooling": "cls" if pooling is not None and pooling.pooling_mode_cls_token else "mean",
+        "normalize": any(isinstance(module, Normalize) for module in model),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "quantized": quantize,
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), "w") as f:
+        json.dump(config, f, indent=2)
+
+    logger.info(f"Exported {model_name} to {output_dir} (quantized={quantize}).")
+    return config
@@ -0,0 +1,216 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+from django.db import close_old_connections
+
+from .metrics import STAGE_SECONDS, TOKENS, record_error, register_stats
+from .persistence import update_stored_conversation
+from .raglogic import (
+    EVAL_MODEL,
+    RELEVANCE_NOT_EVALUATED,
+    RELEVANCE_PENDING,
+    RELEVANCE_UNKNOWN,
+    evaluate_relevance_batch,
+)
+
+logger = logging.getLogger(__name__)
+
+EVAL_BATCH_SIZE = int(os.getenv("EVAL_BATCH_SIZE", "5"))
+EVAL_BATCH_WAIT = float(os.getenv("EVAL_BATCH_WAIT", "2.0"))
+EVAL_QUEUE_SIZE = int(os.getenv("EVAL_QUEUE_SIZE", "1000"))
+EVAL_SHUTDOWN_TIMEOUT = float(os.getenv("EVAL_SHUTDOWN_TIMEOUT", "10"))
+# Attempts per answer before it is marked UNKNOWN, and the pause after a failed batch
+EVAL_MAX_ATTEMPTS = int(os.getenv("EVAL_MAX_ATTEMPTS", "3"))
+EVAL_RETRY_DELAY = float(os.getenv("EVAL_RETRY_DELAY", "5.0"))
+
+# (conversation id, question, answer, failed attempts so far)
+Item = Tuple[str, str, str, int]
+
+
+class EvaluationQueue:
+    """
+    Background worker that evaluates answer relevance off the request path.
+
+    Items are grouped into batches of up to `batch_size`, waiting at most `batch_wait`
+    seconds for a batch to fill, and each batch is judged with a single LLM call. The
+    results are written back to the matching Conversation rows. When a batch fails, its
+    items are queued again after `retry_delay` seconds; an item that has failed
+    `max_attempts` times is marked UNKNOWN so it does not stay PENDING.
+    """
+
+    def __init__(
+        self, batch_size: int = 5, batch_wait: float = 2.0, max_queue_size: int = 1000,
+        max_attempts: int = 3, retry_delay: float = 5.0,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self._queue: "queue.Queue[Item]" = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._evaluated = 0
+        self._dropped = 0
+        self._failures = 0
+        self._abandoned = 0
+
+    def submit(self, conversation_id: str, question: str, answer: str) -> bool:
+        """
+        Queue an answer for evaluation. Returns False if the queue is full.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((conversation_id, question, answer, 0))
+            return True
+        except queue.Full:
+            self._dropped += 1
+            logger.warning(f"Evaluation queue is full; skipping evaluation of conversation {conversation_id}")
+            return False
+
+    def pending(self) -> int:
+        """
+        Return the number of answers waiting to be evaluated.
+        """
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Answers waiting, evaluated, dropped because the queue was full and marked UNKNOWN after
+        failing every attempt, and failed batches since start.
+        """
+        return {
+            "pending": self.pending(),
+            "evaluated": self._evaluated,
+            "dropped": self._dropped,
+            "abandoned": self._abandoned,
+            "failures": self._failures,
+        }
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """
+        Stop accepting work and drain what is already queued, up to `timeout` seconds.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="relevance-evaluation", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self) -> List[Item]:
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            start_time = time.perf_counter()
+            try:
+                self._evaluate(batch)
+                self._evaluated += len(batch)
+            except Exception as e:
+                self._failures += 1
+                record_error("evaluate")
+                logger.exception(f"Error evaluating batch of {len(batch)} conversations: {e}")
+                self._retry(batch, e)
+                # Give a failing LLM or database a moment before the next attempt
+                self._stopping.wait(self.retry_delay)
+            finally:
+                STAGE_SECONDS.labels(stage="evaluate").observe(time.perf_counter() - start_time)
+                close_old_connections()
+
+    def _retry(self, batch: List[Item], error: Exception) -> None:
+        for conversation_id, question, answer, attempts in batch:
+            if attempts + 1 < self.max_attempts:
+                try:
+                    self._queue.put_nowait((conversation_id, question, answer, attempts + 1))
+                    continue
+                except queue.Full:
+                    pass
+            self._abandon(conversation_id, error)
+
+    def _abandon(self, conversation_id: str, error: Exception) -> None:
+        self._abandoned += 1
+        logger.error(f"Giving up evaluating conversation {conversation_id}; marking it {RELEVANCE_UNKNOWN}.")
+        try:
+            update_stored_conversation(
+                conversation_id, relevance=RELEVANCE_UNKNOWN, relevance_explanation=f"Evaluation failed: {error}"
+            )
+        except Exception as e:
+            logger.exception(f"Error marking conversation {conversation_id} as {RELEVANCE_UNKNOWN}: {e}")
+
+    def _evaluate(self, batch: List[Item]) -> None:
+        results, tokens = evaluate_relevance_batch([(question, answer) for _, question, answer, _ in batch])
+        TOKENS.labels(model=EVAL_MODEL, kind="eval_prompt_tokens").inc(tokens["prompt_tokens"])
+        TOKENS.labels(model=EVAL_MODEL, kind="eval_completion_tokens").inc(tokens["completion_tokens"])
+
+        shares = [_split_tokens(tokens, len(batch), index) for index in range(len(batch))]
+        for (conversation_id, *_), (relevance, explanation), share in zip(batch, results, shares):
+            update_stored_conversation(
+                conversation_id,
+                relevance=relevance,
+                relevance_explanation=explanation,
+                eval_prompt_tokens=share["prompt_tokens"],
+                eval_completion_tokens=share["completion_tokens"],
+                eval_total_tokens=share["total_tokens"],
+            )
+            logger.info(f"Conversation {conversation_id} evaluated as {relevance}")
+
+
+def _split_tokens(tokens: Dict[str, int], count: int, index: int) -> Dict[str, int]:
+    # Spread the batch's token usage evenly, giving any remainder to the first items
+    return {
+        key: value // count + (1 if index < value % count else 0)
+        for key, value in tokens.items()
+    }
+
+
+evaluation_queue = EvaluationQueue(
+    batch_size=EVAL_BATCH_SIZE,
+    batch_wait=EVAL_BATCH_WAIT,
+    max_queue_size=EVAL_QUEUE_SIZE,
+    max_attempts=EVAL_MAX_ATTEMPTS,
+    retry_delay=EVAL_RETRY_DELAY,
+)
+atexit.register(evaluation_queue.shutdown, EVAL_SHUTDOWN_TIMEOUT)
+register_stats("evaluation_queue", evaluation_queue.stats)
+
+
+def schedule_evaluation(conversation_id: str, question: str, answer_data: dict) -> bool:
+    """
+    Queue a saved conversation for relevance evaluation if it was sampled for it.
+    """
+    if answer_data.get("relevance") != RELEVANCE_PENDING:
+        return False
+    if evaluation_queue.submit(conversation_id, question, answer_data["answer"]):
+        return True
+
+    update_stored_conversation(conversation_id, relevance=RELEVANCE_NOT_EVALUATED)
+    return False
@@ -0,0 +1,51 @@
+import logging
+import time
+
+from typing import Callable, Dict, Tuple
+
+from django.db import connection
+
+from .raglogic import INDEX_NAME, RETRIEVAL_BACKEND, get_es_client, get_memory_retriever, get_model
+
+logger = logging.getLogger(__name__)
+
+
+def _check_database() -> None:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+def _check_search() -> None:
+    if RETRIEVAL_BACKEND == "memory":
+        get_memory_retriever()
+    # No retries and a short timeout, so the probe answers before its own timeout
+    elif not get_es_client().options(request_timeout=2, max_retries=0).indices.exists(index=INDEX_NAME):
+        raise RuntimeError(f"index {INDEX_NAME} does not exist")
+
+
+def _check_model() -> None:
+    # Already loaded in the master process when RAG_PRELOAD is on; otherwise loads it now
+    get_model()
+
+
+READINESS_CHECKS: Dict[str, Callable[[], None]] = {
+    "database": _check_database,
+    "search": _check_search,
+    "model": _check_model,
+}
+
+
+def readiness() -> Tuple[bool, Dict[str, str]]:
+    """
+    Run every readiness check. Returns whether all passed and each check's outcome.
+    """
+    results = {}
+    for name, check in READINESS_CHECKS.items():
+        start_time = time.perf_counter()
+        try:
+            check()
+            results[name] = f"ok ({(time.perf_counter() - start_time) * 1000:.0f} ms)"
+        except Exception as e:
+            logger.warning(f"Readiness check {name} failed: {e}")
+            results[name] = f"failed: {e}"
+    return all(result.startswith("ok") for result in results.values()), results
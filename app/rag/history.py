@@ -0,0 +1,89 @@
+import logging
+import os
+
+from typing import Dict, List, Sequence, Tuple
+
+from .tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "10"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "800"))
+HISTORY_TURN_MAX_TOKENS = int(os.getenv("HISTORY_TURN_MAX_TOKENS", "200"))
+CONDENSE_ENABLED = os.getenv("CONDENSE_ENABLED", "true").lower() == "true"
+CONDENSE_MODEL = os.getenv("CONDENSE_MODEL", "openai/gpt-4o-mini")
+CONDENSE_TURNS = int(os.getenv("CONDENSE_TURNS", "3"))
+
+# A prior turn: (question, answer)
+Turn = Tuple[str, str]
+
+
+def format_turn(question: str, answer: str) -> str:
+    return f"User: {question}\nAssistant: {answer}"
+
+
+def select_history(turns: Sequence[Turn], budget: int = HISTORY_TOKEN_BUDGET) -> List[Turn]:
+    """
+    Sliding window over prior turns: the most recent turns that fit in `budget` tokens, oldest first.
+
+    Each answer is first cut to HISTORY_TURN_MAX_TOKENS, so one long answer cannot push every
+    other turn out of the window. However long the session, the history never exceeds the budget.
+    """
+    selected: List[Turn] = []
+    used = 0
+    for question, answer in reversed(list(turns)[-HISTORY_MAX_TURNS:]):
+        turn = (truncate_tokens(question, HISTORY_TURN_MAX_TOKENS), truncate_tokens(answer, HISTORY_TURN_MAX_TOKENS))
+        cost = count_tokens(format_turn(*turn))
+        if used + cost > budget:
+            break
+        selected.append(turn)
+        used += cost
+    selected.reverse()
+    return selected
+
+
+def format_history(turns: Sequence[Turn]) -> str:
+    return "\n\n".join(format_turn(question, answer) for question, answer in turns)
+
+
+def condense_prompt(query: str, turns: Sequence[Turn]) -> str:
+    """
+    Build the prompt that rewrites a follow-up question into a standalone search query.
+    """
+    prompt_template = (
+        "Given the CONVERSATION between a user and a Uganda Revenue Authority (URA) assistant and a FOLLOW-UP QUESTION,\n"
+        "rewrite the follow-up as a single standalone question that can be understood without the conversation.\n"
+        "Keep the user's wording where possible and resolve references such as \"it\" or \"that\" to what they refer to.\n"
+        "If the follow-up is already standalone, return it unchanged. Reply with the question only.\n\n"
+        "CONVERSATION:\n{history}\n\n"
+        "FOLLOW-UP QUESTION: {question}"
+    )
+    return prompt_template.format(history=format_history(turns), question=query)
+
+
+def condense_turns(turns: Sequence[Turn]) -> List[Turn]:
+    """
+    The recent turns given to the condensing model.
+    """
+    return select_history(list(turns)[-CONDENSE_TURNS:]) if CONDENSE_TURNS > 0 else []
+
+
+def parse_condensed(query: str, output: str) -> str:
+    """
+    Clean up the condensing model's answer, keeping the original query if it is unusable.
+    """
+    condensed = (output or "").strip().strip('"').strip()
+    if condensed.lower().startswith("standalone question:"):
+        # The question after the prefix may be quoted on its own
+        condensed = condensed.split(":", 1)[1].strip().strip('"').strip()
+    return condensed or query
+
+
+def add_tokens(*usages: Dict[str, int]) -> Dict[str, int]:
+    """
+    Sum token usage dicts.
+    """
+    return {
+        key: sum(usage.get(key, 0) for usage in usages)
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens")
+    }
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from rag.retention import (
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_DIR,
+    RETENTION_DAYS,
+    archive_old_conversations,
+    vacuum_conversation_tables,
+)
+
+
+class Command(BaseCommand):
+    help = "Move whole months of conversations and feedback older than the retention period to gzip JSONL archives."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=RETENTION_DAYS,
+                            help=f"Retention period in days (default: RETENTION_DAYS, {RETENTION_DAYS}).")
+        parser.add_argument("--archive-dir", default=ARCHIVE_DIR,
+                            help=f"Directory the archive files are written to (default: {ARCHIVE_DIR}).")
+        parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE,
+                            help="Rows read and deleted per batch.")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Report what would be archived without writing or deleting anything.")
+        parser.add_argument("--vacuum", action="store_true",
+                            help="Run VACUUM (ANALYZE) on the conversation tables afterwards.")
+
+    def handle(self, *args, **options):
+        results = archive_old_conversations(
+            retention_days=options["days"],
+            archive_dir=options["archive_dir"],
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+        if not results:
+            self.stdout.write(f"Nothing older than {options['days']} days to archive.")
+            return
+
+        verb = "Would archive" if options["dry_run"] else "Archived"
+        for result in results:
+            self.stdout.write(
+                f"{verb} {result['conversations']} conversations and {result['feedback']} feedback rows "
+                f"for {result['month']}" + (f" to {', '.join(result['files'])}" if result["files"] else "")
+            )
+
+        if options["vacuum"] and not options["dry_run"]:
+            vacuum_conversation_tables()
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {sum(result['conversations'] for result in results)} conversations from {len(results)} months."
+        ))
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rag.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the hourly conversation and feedback rollups from the raw tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=None,
+            help="Only rebuild buckets from the last N hours. Rebuilds every bucket from the oldest stored conversation when omitted.",
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["hours"] is not None:
+            since = timezone.now() - timedelta(hours=options["hours"])
+        conversations, feedback = rebuild_rollups(since)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {conversations} conversation buckets and {feedback} feedback buckets."
+        ))
@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+
+logger = logging.getLogger(__name__)
+
+# Set when several server worker processes share one /metrics endpoint
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Hot-path stages take milliseconds (embedding, cache lookup) to tens of seconds (generation)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Time spent in each stage of answering a question.", ["stage"], buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "rag_request_seconds", "End-to-end chat request time by endpoint.", ["endpoint"], buckets=LATENCY_BUCKETS
+)
+ANSWERS = Counter("rag_answers", "Answers returned, by model, search type and cache outcome.", ["model", "search_type", "cached"])
+TOKENS = Counter("rag_tokens", "OpenAI tokens used, by model and kind.", ["model", "kind"])
+OPENAI_COST = Counter("rag_openai_cost_dollars", "Estimated OpenAI spend in dollars, by model.", ["model"])
+ERRORS = Counter("rag_errors", "Errors by stage.", ["stage"])
+DB_CONNECTIONS = Counter("rag_db_connections_created", "New database connections opened.")
+
+
+class StageTimer:
+    """
+    Times the stages of one request.
+
+    Each stage is observed in the rag_stage_seconds histogram as it finishes and kept in
+    `stages`, so the breakdown can be returned with the answer and saved on the
+    conversation. An exception raised inside a stage is counted in rag_errors.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            ERRORS.labels(stage=name).inc()
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        STAGE_SECONDS.labels(stage=name).observe(seconds)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {name: round(seconds, 6) for name, seconds in self.stages.items()}
+
+
+def record_answer(result: Dict[str, Any], search_type: str) -> None:
+    """
+    Count an answer and the tokens and cost it used.
+    """
+    model = result.get("model_used", "unknown")
+    ANSWERS.labels(model=model, search_type=search_type, cached=str(bool(result.get("cached"))).lower()).inc()
+    for kind in ("prompt_tokens", "completion_tokens"):
+        TOKENS.labels(model=model, kind=kind).inc(result.get(kind, 0))
+    OPENAI_COST.labels(model=model).inc(result.get("openai_cost", 0.0))
+
+
+def record_error(stage: str) -> None:
+    ERRORS.labels(stage=stage).inc()
+
+
+def record_db_connection(sender, connection, **kwargs) -> None:
+    """
+    connection_created receiver; a steady rise means connections are not being reused.
+    """
+    DB_CONNECTIONS.inc()
+
+
+class ComponentStatsCollector:
+    """
+    Exposes the stats() of in-process components (answer cache, embedding batcher, write
+    buffer, ...) as gauges named rag_<component>_<stat>, read at scrape time.
+    """
+
+    def __init__(self):
+        self._sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, component: str, stats_fn: Callable[[], Dict[str, Any]]) -> None:
+        with self._lock:
+            self._sources[component] = stats_fn
+
+    def collect(self):
+        with self._lock:
+            sources = list(self._sources.items())
+        for component, stats_fn in sources:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logger.error(f"Error reading {component} stats for metrics: {e}")
+                continue
+            for name, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                yield GaugeMetricFamily(f"rag_{component}_{name}", f"{component} {name.replace('_', ' ')}.", value=value)
+
+
+component_stats = ComponentStatsCollector()
+REGISTRY.register(component_stats)
+
+
+def register_stats(component: str, stats_fn: Callable[[], Dict[str, Any]]) -> None:
+    """
+    Publish a component's stats() dict on /metrics.
+    """
+    component_stats.register(component, stats_fn)
+
+
+def render_metrics() -> bytes:
+    """
+    Metrics in the Prometheus text format.
+
+    With PROMETHEUS_MULTIPROC_DIR set, histograms and counters are aggregated over every
+    worker process, while component stats are those of the worker serving the scrape.
+    """
+    registry: Optional[CollectorRegistry] = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+        registry.register(component_stats)
+    return generate_latest(registry)
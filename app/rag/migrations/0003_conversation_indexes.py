@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0002_alter_feedback_conversation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['-timestamp', '-id'], name='conversation_ts_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['relevance', '-timestamp', '-id'], name='conversation_rel_ts_id_idx'),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:48
+
+from datetime import timezone
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+
+
+def backfill_rollups(apps, schema_editor):
+    Conversation = apps.get_model('rag', 'Conversation')
+    Feedback = apps.get_model('rag', 'Feedback')
+    ConversationRollup = apps.get_model('rag', 'ConversationRollup')
+    FeedbackRollup = apps.get_model('rag', 'FeedbackRollup')
+
+    conversation_buckets = (
+        Conversation.objects.annotate(bucket=TruncHour('timestamp', tzinfo=timezone.utc))
+        .values('bucket', 'model_used', 'relevance')
+        .annotate(
+            conversations=Count('id'),
+            response_time_sum=Sum('response_time'),
+            openai_cost_sum=Sum('openai_cost'),
+            total_tokens_sum=Sum('total_tokens'),
+        )
+        .order_by()
+    )
+    ConversationRollup.objects.bulk_create(
+        [
+            ConversationRollup(
+                bucket=row['bucket'],
+                model_used=row['model_used'],
+                relevance=row['relevance'],
+                conversations=row['conversations'],
+                response_time_sum=row['response_time_sum'] or 0.0,
+                openai_cost_sum=row['openai_cost_sum'] or 0.0,
+                total_tokens_sum=row['total_tokens_sum'] or 0,
+            )
+            for row in conversation_buckets
+        ],
+        batch_size=1000,
+    )
+
+    feedback_buckets = (
+        Feedback.objects.annotate(bucket=TruncHour('timestamp', tzinfo=timezone.utc))
+        .values('bucket', 'feedback')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    FeedbackRollup.objects.bulk_create(
+        [FeedbackRollup(bucket=row['bucket'], feedback=row['feedback'], count=row['count']) for row in feedback_buckets],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0003_conversation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('model_used', models.CharField(max_length=255)),
+                ('relevance', models.CharField(max_length=50)),
+                ('conversations', models.IntegerField(default=0)),
+                ('response_time_sum', models.FloatField(default=0.0)),
+                ('openai_cost_sum', models.FloatField(default=0.0)),
+                ('total_tokens_sum', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'model_used', 'relevance'), name='conversation_rollup_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FeedbackRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('feedback', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'feedback'), name='feedback_rollup_key')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0004_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='session_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['session_id', '-timestamp', '-id'], name='conversation_session_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0005_conversation_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='context_tokens_saved',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0006_conversation_context_tokens_saved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='stage_latency',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -7,6 +7,8 @@ from django.utils import timezone
 
 class Conversation(models.Model):
     id = models.CharField(max_length=255, primary_key=True)
+    # Chat session the turn belongs to; a session's turns share it and are ordered by timestamp
+    session_id = models.CharField(max_length=255, blank=True, default='')
     question = models.TextField()
     answer = models.TextField()
     section = models.CharField(max_length=255)
@@ -21,8 +23,20 @@ class Conversation(models.Model):
     eval_completion_tokens = models.IntegerField()
     eval_total_tokens = models.IntegerField()
     openai_cost = models.FloatField()
+    # Prompt tokens saved by deduplicating and budgeting the FAQ context
+    context_tokens_saved = models.IntegerField(default=0)
+    # Seconds spent in each stage of answering, e.g. {"embed": 0.01, "retrieve": 0.05, "generate": 1.2}
+    stage_latency = models.JSONField(default=dict, blank=True)
     timestamp = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # Back keyset pagination on (timestamp, id), newest first, with and without the relevance filter
+        indexes = [
+            models.Index(fields=['-timestamp', '-id'], name='conversation_ts_id_idx'),
+            models.Index(fields=['relevance', '-timestamp', '-id'], name='conversation_rel_ts_id_idx'),
+            models.Index(fields=['session_id', '-timestamp', '-id'], name='conversation_session_ts_idx'),
+        ]
+
     def __str__(self):
         return self.id
 
@@ -34,3 +48,41 @@ class Feedback(models.Model):
 
     def __str__(self):
         return f"Feedback for {self.conversation.id} - {self.feedback}"
+
+
+class ConversationRollup(models.Model):
+    """
+    Hourly conversation totals per model and relevance label, kept up to date as conversations are written.
+    """
+    bucket = models.DateTimeField()
+    model_used = models.CharField(max_length=255)
+    relevance = models.CharField(max_length=50)
+    conversations = models.IntegerField(default=0)
+    response_time_sum = models.FloatField(default=0.0)
+    openai_cost_sum = models.FloatField(default=0.0)
+    total_tokens_sum = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'model_used', 'relevance'], name='conversation_rollup_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:00} {self.model_used} {self.relevance}: {self.conversations}"
+
+
+class FeedbackRollup(models.Model):
+    """
+    Hourly feedback counts per score, kept up to date as feedback is written.
+    """
+    bucket = models.DateTimeField()
+    feedback = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'feedback'], name='feedback_rollup_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:00} {self.feedback}: {self.count}"
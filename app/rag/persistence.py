@@ -0,0 +1,221 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from typing import Dict, List, Optional
+
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from .metrics import STAGE_SECONDS, record_error, register_stats
+from .models import Conversation, Feedback
+from .rollups import move_relevance, record_rows
+
+logger = logging.getLogger(__name__)
+
+WRITE_BUFFER_ENABLED = os.getenv("WRITE_BUFFER_ENABLED", "true").lower() == "true"
+WRITE_BUFFER_MAX_SIZE = int(os.getenv("WRITE_BUFFER_MAX_SIZE", "100"))
+WRITE_BUFFER_FLUSH_INTERVAL = float(os.getenv("WRITE_BUFFER_FLUSH_INTERVAL", "1.0"))
+WRITE_BUFFER_SHUTDOWN_TIMEOUT = float(os.getenv("WRITE_BUFFER_SHUTDOWN_TIMEOUT", "30"))
+
+
+class WriteBehindBuffer:
+    """
+    Buffers new Feedback rows and writes them with bulk_create off the request path.
+
+    A background thread flushes whenever `max_size` records are waiting or `flush_interval`
+    seconds have passed. Rows that fail to insert are kept and retried on the next flush,
+    except rows the database rejects outright (such as feedback for a conversation cleared
+    in the meantime), which are logged and dropped. Anything still buffered at exit is
+    flushed before the process ends.
+
+    Conversations are not buffered: the buffer belongs to one worker process, and a turn
+    must be readable from every worker (history, lookups by id, feedback) as soon as the
+    response is sent. `flush_conversation` writes a conversation's buffered feedback before
+    it is read from this process.
+    """
+
+    def __init__(self, max_size: int = 100, flush_interval: float = 1.0):
+        self.max_size = max(1, max_size)
+        self.flush_interval = flush_interval
+        self._feedback: List[Feedback] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._flushed = 0
+        self._failures = 0
+
+    def add_feedback(self, feedback: Feedback) -> None:
+        """
+        Buffer a new feedback row.
+        """
+        with self._lock:
+            self._feedback.append(feedback)
+            size = len(self._feedback)
+        self._after_add(size)
+
+    def pending(self) -> int:
+        """
+        Return the number of rows waiting to be written.
+        """
+        with self._lock:
+            return len(self._feedback)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Rows waiting, rows written and failed flushes since start.
+        """
+        return {"pending": self.pending(), "flushed": self._flushed, "failures": self._failures}
+
+    def flush_conversation(self, conversation_id: str) -> None:
+        """
+        Write the conversation's buffered feedback, if any, and wait for any flush already in progress.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = any(feedback.conversation_id == conversation_id for feedback in self._feedback)
+            if pending:
+                self._flush_locked()
+
+    def discard(self, conversation_id: str) -> bool:
+        """
+        Drop a conversation's buffered feedback without writing it. Returns True if any was dropped.
+        """
+        with self._flush_lock, self._lock:
+            remaining = [feedback for feedback in self._feedback if feedback.conversation_id != conversation_id]
+            removed = len(remaining) != len(self._feedback)
+            self._feedback = remaining
+        return removed
+
+    def flush(self) -> int:
+        """
+        Write everything buffered now. Returns the number of rows written.
+        """
+        with self._flush_lock:
+            return self._flush_locked()
+
+    def shutdown(self, timeout: float = 30.0) -> None:
+        """
+        Stop the background thread and flush what is left, retrying until `timeout` seconds pass.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            if not self.flush():
+                time.sleep(min(1.0, self.flush_interval))
+        if self.pending():
+            logger.error(f"Write buffer shut down with {self.pending()} rows unwritten.")
+
+    def _after_add(self, size: int) -> None:
+        self._ensure_started()
+        if size >= self.max_size:
+            self._wakeup.set()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(f"Error flushing write buffer: {e}")
+            finally:
+                close_old_connections()
+
+    def _flush_locked(self) -> int:
+        with self._lock:
+            feedback = self._feedback
+            self._feedback = []
+        if not feedback:
+            return 0
+
+        start_time = time.perf_counter()
+        written = 0
+        try:
+            written += self._bulk_create(Feedback, feedback)
+        except DatabaseError as e:
+            # The database is unavailable; keep the unwritten rows for the next flush
+            logger.error(f"Error flushing write buffer, will retry {len(feedback)} rows: {e}")
+            self._failures += 1
+            record_error("db_flush")
+            with self._lock:
+                self._feedback = feedback + self._feedback
+
+        STAGE_SECONDS.labels(stage="db_flush").observe(time.perf_counter() - start_time)
+        self._flushed += written
+        if written:
+            logger.info(f"Write buffer flushed {written} rows.")
+        return written
+
+    def _bulk_create(self, model, rows: list) -> int:
+        try:
+            insert_rows(model, rows)
+            return len(rows)
+        except IntegrityError as e:
+            logger.warning(f"Bulk insert of {len(rows)} {model.__name__} rows failed ({e}); inserting one by one.")
+
+        # Isolate the rows the database rejects so the rest of the batch is still written
+        written = 0
+        for row in rows:
+            try:
+                insert_rows(model, [row])
+                written += 1
+            except IntegrityError as e:
+                logger.error(f"Dropping {model.__name__} row for conversation {row.conversation_id}: {e}")
+        return written
+
+
+def insert_rows(model, rows: list) -> None:
+    """
+    Insert Conversation or Feedback rows and add them to the hourly rollups in one transaction.
+    """
+    with transaction.atomic():
+        model.objects.bulk_create(rows)
+        record_rows(model, rows)
+
+
+def update_stored_conversation(conversation_id: str, **fields) -> int:
+    """
+    Update a conversation in the database, moving it between rollup buckets if its relevance changes.
+    """
+    with transaction.atomic():
+        if "relevance" in fields:
+            conversation = (
+                Conversation.objects.select_for_update()
+                .only("timestamp", "model_used", "relevance", "response_time", "openai_cost", "total_tokens")
+                .filter(id=conversation_id)
+                .first()
+            )
+            if conversation is None:
+                return 0
+            move_relevance(conversation, fields["relevance"])
+        return Conversation.objects.filter(id=conversation_id).update(**fields)
+
+
+write_buffer = WriteBehindBuffer(max_size=WRITE_BUFFER_MAX_SIZE, flush_interval=WRITE_BUFFER_FLUSH_INTERVAL)
+register_stats("write_buffer", write_buffer.stats)
+atexit.register(write_buffer.shutdown, WRITE_BUFFER_SHUTDOWN_TIMEOUT)
+
+
+def new_feedback(conversation_id: str, feedback_score: int) -> Feedback:
+    """
+    Build an unsaved Feedback row for a conversation, without loading the conversation.
+    """
+    return Feedback(conversation_id=conversation_id, feedback=feedback_score, timestamp=timezone.now())
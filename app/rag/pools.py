@@ -0,0 +1,118 @@
+import logging
+import os
+
+from typing import Any, Dict, Iterable, Tuple
+
+import httpx
+
+from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+
+logger = logging.getLogger(__name__)
+
+# Elasticsearch: connections kept per node, per-request timeout and retries of failed or timed-out requests
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", "25"))
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", "10"))
+ES_MAX_RETRIES = int(os.getenv("ES_MAX_RETRIES", "2"))
+ES_RETRY_ON_TIMEOUT = os.getenv("ES_RETRY_ON_TIMEOUT", "true").lower() == "true"
+
+# OpenAI: open and idle keep-alive connections, how long idle ones are kept, timeouts and retries
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+
+def es_client_options() -> Dict[str, Any]:
+    """
+    Pool, timeout and retry options for Elasticsearch and AsyncElasticsearch clients.
+    """
+    return {
+        "connections_per_node": ES_CONNECTIONS_PER_NODE,
+        "request_timeout": ES_REQUEST_TIMEOUT,
+        "max_retries": ES_MAX_RETRIES,
+        "retry_on_timeout": ES_RETRY_ON_TIMEOUT,
+    }
+
+
+def openai_client_options(use_async: bool = False) -> Dict[str, Any]:
+    """
+    HTTP client, timeout and retry options for OpenAI and AsyncOpenAI clients.
+    """
+    limits = httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    http_client_class = DefaultAsyncHttpxClient if use_async else DefaultHttpxClient
+    return {
+        "http_client": http_client_class(limits=limits, timeout=timeout),
+        "timeout": timeout,
+        "max_retries": OPENAI_MAX_RETRIES,
+    }
+
+
+def _es_pool_stats(client) -> Tuple[int, int, int]:
+    # (size, open, in use) summed over the client's nodes
+    size = opened = in_use = 0
+    for node in client.transport.node_pool.all():
+        pool = getattr(node, "pool", None)
+        if pool is not None:
+            # urllib3 keeps a queue of `maxsize` slots holding idle connections or None
+            slots = pool.pool
+            idle = sum(1 for connection in list(slots.queue) if connection is not None)
+            taken = slots.maxsize - slots.qsize()
+            size += slots.maxsize
+            in_use += taken
+            opened += idle + taken
+            continue
+        connector = getattr(getattr(node, "session", None), "connector", None)
+        if connector is not None:
+            # aiohttp, used by AsyncElasticsearch
+            taken = len(getattr(connector, "_acquired", ()))
+            size += connector.limit_per_host or connector.limit or 0
+            in_use += taken
+            opened += taken + sum(len(idle) for idle in getattr(connector, "_conns", {}).values())
+    return size, opened, in_use
+
+
+def _httpx_pool_stats(client) -> Tuple[int, int, int]:
+    pool = getattr(getattr(client._client, "_transport", None), "_pool", None)
+    if pool is None:
+        return OPENAI_MAX_CONNECTIONS, 0, 0
+    connections = list(pool.connections)
+    return OPENAI_MAX_CONNECTIONS, len(connections), sum(1 for connection in connections if not connection.is_idle())
+
+
+def client_pool_stats(clients: Iterable[Tuple[str, Any]]) -> Dict[str, int]:
+    """
+    Size, open and in-use connections of each HTTP client pool, e.g. elasticsearch_pool_in_use.
+    """
+    stats: Dict[str, int] = {}
+    for name, client in clients:
+        try:
+            if "elasticsearch" in name:
+                size, opened, in_use = _es_pool_stats(client)
+            elif "openai" in name:
+                size, opened, in_use = _httpx_pool_stats(client)
+            else:
+                continue
+        except Exception as e:
+            logger.warning(f"Could not read {name} connection pool stats: {e}")
+            continue
+        stats.update({f"{name}_pool_size": size, f"{name}_pool_open": opened, f"{name}_pool_in_use": in_use})
+    return stats
+
+
+def database_pool_stats() -> Dict[str, int]:
+    """
+    psycopg pool statistics for the default database, when DB_POOL_ENABLED is set.
+    """
+    from django.db import connection
+
+    pool = getattr(connection, "pool", None)
+    if pool is None:
+        return {}
+    return {name: value for name, value in pool.get_stats().items() if isinstance(value, int)}
@@ -1,13 +1,37 @@
+import atexit
+import gc
 import json
 import logging
 import os
+import random
+import threading
 import time
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from openai import OpenAI
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from elasticsearch import Elasticsearch
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
+
+from .batching import EmbeddingBatcher
+from .cache import SemanticCache
+from .embedding_store import EmbeddingStore
+from .encoders import BACKEND_SENTENCE_TRANSFORMERS, default_onnx_dir, encoder_id, load_encoder
+from .context import assemble_context
+from .metrics import StageTimer, record_answer, register_stats
+from .pools import client_pool_stats, es_client_options, openai_client_options
+from .history import (
+    CONDENSE_ENABLED,
+    CONDENSE_MODEL,
+    Turn,
+    add_tokens,
+    condense_prompt,
+    condense_turns,
+    format_history,
+    parse_condensed,
+    select_history,
+)
+from .retrieval import InMemoryRetriever
 
 load_dotenv()
 
@@ -18,25 +42,265 @@ logger = logging.getLogger(__name__)
 ELASTIC_URL = os.getenv("ELASTIC_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 INDEX_NAME = os.getenv("INDEX_NAME")
+MODEL_NAME = os.getenv("MODEL_NAME", "multi-qa-MiniLM-L6-cos-v1")
+
+# "sentence-transformers", or "onnx" for the exported model under ONNX_MODEL_DIR
+# (see scripts/onnx_encoder.py), int8-quantized unless ONNX_QUANTIZED=false
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", BACKEND_SENTENCE_TRANSFORMERS)
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "data/onnx")
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "true").lower() == "true"
+ENCODER_ID = encoder_id(MODEL_NAME, EMBEDDING_BACKEND, ONNX_QUANTIZED)
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "data/embeddings")
+
+# Concurrent query embeddings are grouped into micro-batches of up to EMBEDDING_BATCH_SIZE,
+# waiting at most EMBEDDING_BATCH_WAIT_MS for a batch to fill
+EMBEDDING_BATCHING_ENABLED = os.getenv("EMBEDDING_BATCHING_ENABLED", "true").lower() == "true"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+
+# "elasticsearch" or "memory" (in-process search over FAQS_PATH, no Elasticsearch needed)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "elasticsearch")
+RETRIEVAL_HNSW = os.getenv("RETRIEVAL_HNSW", "false").lower() == "true"
+FAQS_PATH = os.getenv("FAQS_PATH", "data/faqs-with-ids.json")
+
+RRF_RANK_CONSTANT = int(os.getenv("RRF_RANK_CONSTANT", "60"))
+RRF_NUM_CANDIDATES = int(os.getenv("RRF_NUM_CANDIDATES", "100"))
+SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", "8"))
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_VERSION_CHECK = float(os.getenv("ANSWER_CACHE_VERSION_CHECK", "60"))
+
+EVAL_SAMPLE_RATE = float(os.getenv("EVAL_SAMPLE_RATE", "1.0"))
+EVAL_MODEL = os.getenv("EVAL_MODEL", "openai/gpt-4o-mini")
+
+RELEVANCE_PENDING = "PENDING"
+RELEVANCE_NOT_EVALUATED = "NOT_EVALUATED"
+RELEVANCE_UNKNOWN = "UNKNOWN"
+NO_TOKENS = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+# Clients and the embedding model are created on first use rather than at import time, so
+# management commands such as migrate stay fast. Call preload() before forking server
+# workers to load the model once and share its memory copy-on-write.
+_model = None
+_model_lock = threading.Lock()
+
+_embedding_store = None
+_embedding_store_lock = threading.Lock()
+
+_clients: Dict[str, Any] = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+def get_model():
+    """
+    Return the process-wide embedding model for EMBEDDING_BACKEND, loading it on first use.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                start_time = time.perf_counter()
+                _model = load_encoder(
+                    MODEL_NAME, EMBEDDING_BACKEND, default_onnx_dir(ONNX_MODEL_DIR, MODEL_NAME), ONNX_QUANTIZED
+                )
+                logger.info(f"Loaded embedding model {ENCODER_ID} in {time.perf_counter() - start_time:.2f} seconds.")
+    return _model
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    """
+    Return the process-wide embedding store, or None when the embedding cache is disabled.
+    """
+    global _embedding_store
+    if _embedding_store is None and EMBEDDING_CACHE_ENABLED:
+        with _embedding_store_lock:
+            if _embedding_store is None:
+                _embedding_store = EmbeddingStore(EMBEDDING_CACHE_DIR, ENCODER_ID)
+    return _embedding_store
+
+def shared_client(name: str, factory):
+    """
+    Return the named client for this process, creating it with `factory` on first use.
+
+    Clients are keyed by process id, so a worker forked from a process that already
+    created them opens its own connection pools instead of sharing the parent's sockets.
+    """
+    global _clients_pid
+    client = _clients.get(name) if _clients_pid == os.getpid() else None
+    if client is None:
+        with _clients_lock:
+            if _clients_pid != os.getpid():
+                _clients.clear()
+                _clients_pid = os.getpid()
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+                logger.info(f"Initialized {name} client.")
+    return client
+
+def reset_clients() -> None:
+    """
+    Drop this process's clients so the next call creates fresh ones.
+    """
+    with _clients_lock:
+        _clients.clear()
+
+def clients_pool_stats() -> Dict[str, int]:
+    """
+    Connection pool usage of the clients this process has created.
+    """
+    with _clients_lock:
+        clients = list(_clients.items()) if _clients_pid == os.getpid() else []
+    return client_pool_stats(clients)
+
+register_stats("clients", clients_pool_stats)
 
-# Initialize Elasticsearch and OpenAI
-es_client = Elasticsearch(ELASTIC_URL)
+def get_es_client() -> Elasticsearch:
+    """
+    Return the Elasticsearch client for this process.
+    """
+    return shared_client("elasticsearch", lambda: Elasticsearch(ELASTIC_URL, **es_client_options()))
 
-model = SentenceTransformer("multi-qa-MiniLM-L6-cos-v1")
+def get_openai_client() -> OpenAI:
+    """
+    Return the OpenAI client for this process.
+    """
+    return shared_client("openai", lambda: OpenAI(api_key=OPENAI_API_KEY, **openai_client_options()))
+
+embedding_batcher = None
+if EMBEDDING_BATCHING_ENABLED:
+    embedding_batcher = EmbeddingBatcher(
+        lambda texts: encode_texts(texts),
+        max_batch_size=EMBEDDING_BATCH_SIZE,
+        max_wait=EMBEDDING_BATCH_WAIT_MS / 1000,
+    )
+    atexit.register(embedding_batcher.shutdown)
+    register_stats("embedding_batcher", embedding_batcher.stats)
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Runs the keyword and vector legs of RRF searches concurrently
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="search")
 
 
-logger.info("Initialized Elasticsearch client and OpenAI API.")
+def preload() -> None:
+    """
+    Load the embedding model, embedding store and in-memory retriever ahead of the first request.
 
-def elastic_search_text(query: str, index_name: str = INDEX_NAME) -> List[Dict[str, Any]]:
+    Intended to run in the server's master process before it forks workers. Network clients
+    are left for each worker to create. Loaded objects are moved out of the garbage
+    collector's reach so collections in the workers do not touch, and copy, their pages.
     """
-    Perform a text-based search on Elasticsearch.
+    start_time = time.perf_counter()
+    get_model().encode(["warmup"])
+    get_embedding_store()
+    if RETRIEVAL_BACKEND == "memory":
+        get_memory_retriever()
+    gc.freeze()
+    logger.info(f"Preloaded RAG resources in {time.perf_counter() - start_time:.2f} seconds.")
+
+
+def get_index_version(index_name: str = INDEX_NAME) -> str:
     """
-    logger.info(f"Starting text-based search for query: {query}")
-    
-    search_query = {
-        "size": 5,
+    Return an identifier that changes whenever the index is rebuilt or its content is updated in place.
+    """
+    if RETRIEVAL_BACKEND == "memory":
+        return get_memory_retriever().version
+
+    settings = get_es_client().indices.get_settings(index=index_name, name="index.uuid")
+    mappings = get_es_client().indices.get_mapping(index=index_name, filter_path="*.mappings._meta")
+    return ",".join(
+        sorted(
+            f'{value["settings"]["index"]["uuid"]}:'
+            f'{mappings.get(concrete, {}).get("mappings", {}).get("_meta", {}).get("content_version", "")}'
+            for concrete, value in settings.items()
+        )
+    )
+
+
+answer_cache = SemanticCache(
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    ttl=ANSWER_CACHE_TTL,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    version_fn=get_index_version,
+    version_check_interval=ANSWER_CACHE_VERSION_CHECK,
+)
+register_stats("answer_cache", answer_cache.stats)
+
+def submit_query(query: str) -> Future:
+    """
+    Start embedding the query and return a Future resolving to its vector.
+
+    Queries already in the embedding store resolve immediately; the rest are encoded in
+    micro-batches with other concurrent queries.
+    """
+    embedding_store = get_embedding_store()
+    if embedding_store is not None:
+        cached = embedding_store.get(query)
+        if cached is not None:
+            future: Future = Future()
+            future.set_result(cached)
+            return future
+    if embedding_batcher is not None:
+        return embedding_batcher.submit(query)
+
+    future = Future()
+    future.set_result(encode_texts([query])[0])
+    return future
+
+def encode_query(query: str) -> List[float]:
+    """
+    Embed the query, reusing the on-disk embedding store when it holds the text, e.g. an FAQ question.
+    """
+    return submit_query(query).result().tolist()
+
+
+def encode_texts(texts: List[str]):
+    """
+    Embed a batch of query texts, reusing stored vectors but without adding new ones to the store.
+    """
+    model = get_model()
+    embedding_store = get_embedding_store()
+    if embedding_store is None:
+        return model.encode(texts)
+    return embedding_store.encode(texts, model.encode, persist=False)
+
+
+def encode_corpus(texts: List[str]):
+    """
+    Embed FAQ texts, storing new vectors so later loads of the same corpus skip the model.
+    """
+    model = get_model()
+    embedding_store = get_embedding_store()
+    if embedding_store is None:
+        return model.encode(texts)
+    return embedding_store.encode(texts, model.encode)
+
+
+_memory_retriever = None
+_memory_retriever_lock = threading.Lock()
+
+def get_memory_retriever() -> InMemoryRetriever:
+    """
+    Return the process-wide in-memory retriever, loading it from FAQS_PATH on first use.
+    """
+    global _memory_retriever
+    if _memory_retriever is None:
+        with _memory_retriever_lock:
+            if _memory_retriever is None:
+                _memory_retriever = InMemoryRetriever.from_file(FAQS_PATH, encode_corpus, use_hnsw=RETRIEVAL_HNSW)
+    return _memory_retriever
+
+
+def text_search_body(query: str, size: int = 5) -> Dict[str, Any]:
+    """
+    Build the request body for a text-based search.
+    """
+    return {
+        "size": size,
+        "_source": ["answer", "section", "question", "id"],
         "query": {
             "bool": {
                 "must": {
@@ -50,8 +314,16 @@ def elastic_search_text(query: str, index_name: str = INDEX_NAME) -> List[Dict[s
         },
     }
 
+def elastic_search_text(query: str, index_name: str = INDEX_NAME, size: int = 5) -> List[Dict[str, Any]]:
+    """
+    Perform a text-based search on Elasticsearch.
+    """
+    logger.info(f"Starting text-based search for query: {query}")
+    
+    search_query = text_search_body(query, size)
+
     try:
-        response = es_client.search(index=index_name, body=search_query)
+        response = get_es_client().search(index=index_name, body=search_query)
         results = [hit["_source"] for hit in response["hits"]["hits"]]
         logger.info(f"Found {len(results)} results for text-based search.")
         return results
@@ -59,16 +331,10 @@ def elastic_search_text(query: str, index_name: str = INDEX_NAME) -> List[Dict[s
         logger.error(f"Error in text-based search: {e}")
         return []
 
-def elastic_search_hybrid(
-    field: str, query: str, 
-    query_vector: List[float], 
-    index_name: str = INDEX_NAME
-) -> List[Dict[str, Any]]:
+def hybrid_search_body(field: str, query: str, query_vector: List[float]) -> Dict[str, Any]:
     """
-    Perform a hybrid search (keyword and KNN) on Elasticsearch.
+    Build the request body for a hybrid (keyword and KNN) search.
     """
-    logger.info(f"Starting hybrid search for query: {query} with vector.")
-
     knn_query = {
         "field": field,
         "query_vector": query_vector,
@@ -90,15 +356,27 @@ def elastic_search_hybrid(
         }
     }
 
-    search_query = {
+    return {
         "knn": knn_query,
         "query": keyword_query,
         "size": 5,
         "_source": ["answer", "section", "question","id"],
     }
 
+def elastic_search_hybrid(
+    field: str, query: str, 
+    query_vector: List[float], 
+    index_name: str = INDEX_NAME
+) -> List[Dict[str, Any]]:
+    """
+    Perform a hybrid search (keyword and KNN) on Elasticsearch.
+    """
+    logger.info(f"Starting hybrid search for query: {query} with vector.")
+
+    search_query = hybrid_search_body(field, query, query_vector)
+
     try:
-        es_results = es_client.search(index=index_name, body=search_query)
+        es_results = get_es_client().search(index=index_name, body=search_query)
         results = [hit["_source"] for hit in es_results["hits"]["hits"]]
         logger.info(f"Found {len(results)} results for hybrid search.")
         return results
@@ -106,28 +384,36 @@ def elastic_search_hybrid(
         logger.error(f"Error during hybrid search: {e}")
         return []
 
-def elastic_search_knn(
-    field: str, vector: List[float], index_name: str = INDEX_NAME
-) -> List[Dict[str, Any]]:
+def knn_search_body(field: str, vector: List[float], k: int = 5, num_candidates: int = 10000) -> Dict[str, Any]:
     """
-    Perform a KNN search on Elasticsearch.
+    Build the request body for a KNN search.
     """
-    logger.info(f"Starting KNN search on field: {field} with vector.")
-
     knn = {
         "field": field,
         "query_vector": vector,
-        "k": 5,
-        "num_candidates": 10000,
+        "k": k,
+        "num_candidates": num_candidates,
     }
 
-    search_query = {
+    return {
         "knn": knn,
+        "size": k,
         "_source": ["answer", "section", "question", "id"],
     }
 
+def elastic_search_knn(
+    field: str, vector: List[float], index_name: str = INDEX_NAME,
+    k: int = 5, num_candidates: int = 10000,
+) -> List[Dict[str, Any]]:
+    """
+    Perform a KNN search on Elasticsearch.
+    """
+    logger.info(f"Starting KNN search on field: {field} with vector.")
+
+    search_query = knn_search_body(field, vector, k, num_candidates)
+
     try:
-        es_results = es_client.search(index=index_name, body=search_query)
+        es_results = get_es_client().search(index=index_name, body=search_query)
         results = [hit["_source"] for hit in es_results["hits"]["hits"]]
         logger.info(f"Found {len(results)} results for KNN search.")
         return results
@@ -135,33 +421,135 @@ def elastic_search_knn(
         logger.error(f"Error during KNN search: {e}")
         return []
 
-def build_prompt(query: str, search_results: List[Dict[str, Any]]) -> str:
+def reciprocal_rank_fusion(
+    rankings: Dict[str, List[Dict[str, Any]]],
+    weights: Dict[str, float],
+    k: int = 5,
+    rank_constant: int = RRF_RANK_CONSTANT,
+) -> List[Dict[str, Any]]:
     """
-    Build a prompt for the language model based on the query and search results.
+    Fuse several ranked result lists with weighted reciprocal rank fusion.
+
+    Each document scores sum(weight / (rank_constant + rank)) over the lists it appears in.
     """
-    logger.info(f"Building prompt for query: {query}")
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Dict[str, Any]] = {}
+    for leg, results in rankings.items():
+        weight = weights.get(leg, 1.0)
+        for rank, doc in enumerate(results, start=1):
+            key = doc.get("id") or doc.get("question")
+            scores[key] = scores.get(key, 0.0) + weight / (rank_constant + rank)
+            documents.setdefault(key, doc)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in ranked]
+
+def _timed(fn, *args, **kwargs) -> Tuple[Any, float]:
+    start_time = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+def hybrid_search_rrf(
+    query: str,
+    vector: List[float],
+    field: str = "question_answer_vector",
+    k: int = 5,
+    num_candidates: int = RRF_NUM_CANDIDATES,
+    text_weight: float = 1.0,
+    vector_weight: float = 1.0,
+    index_name: str = INDEX_NAME,
+) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """
+    Hybrid search that runs the keyword and KNN legs concurrently and fuses them with RRF.
 
-    context = "\n\n".join(
-        [
-            f"section: {faq['section']}\nquestion: {faq['question']}\nanswer: {faq['answer']}"
-            for faq in search_results
-        ]
+    Each leg returns up to 2 * k candidates. `num_candidates` bounds the KNN candidate pool
+    per shard, trading recall for latency. Returns the fused results and per-leg latency
+    in seconds.
+    """
+    logger.info(f"Starting RRF hybrid search for query: {query} (k={k}, num_candidates={num_candidates})")
+
+    window = max(k, min(2 * k, num_candidates))
+    num_candidates = max(num_candidates, window)
+
+    if RETRIEVAL_BACKEND == "memory":
+        retriever = get_memory_retriever()
+        text_leg = search_executor.submit(
+            _timed, lambda: [retriever.sources[doc] for doc, _ in retriever.text_ranking(query, window)]
+        )
+        vector_leg = search_executor.submit(
+            _timed, lambda: [retriever.sources[doc] for doc, _ in retriever.knn_ranking(field, vector, window)]
+        )
+    else:
+        text_leg = search_executor.submit(_timed, elastic_search_text, query, index_name, window)
+        vector_leg = search_executor.submit(
+            _timed, elastic_search_knn, field, vector, index_name, window, num_candidates
+        )
+
+    text_results, text_latency = text_leg.result()
+    vector_results, vector_latency = vector_leg.result()
+    latency = {"text": text_latency, "vector": vector_latency}
+    logger.info(f"RRF legs took text={text_latency:.3f}s vector={vector_latency:.3f}s")
+
+    results = reciprocal_rank_fusion(
+        {"text": text_results, "vector": vector_results},
+        {"text": text_weight, "vector": vector_weight},
+        k,
     )
+    return results, latency
+
+def assemble_prompt(
+    query: str,
+    search_results: List[Dict[str, Any]],
+    history: Optional[List[Turn]] = None,
+    model_choice: Optional[str] = None,
+) -> Tuple[str, Dict[str, int]]:
+    """
+    Build a prompt for the language model from the query, search results and prior turns.
+
+    The FAQ context is deduplicated and fitted to the model's token budget, and prior turns
+    go through a token-budgeted sliding window, so the prompt stays bounded however long the
+    answers or the session get. Returns the prompt and the context statistics.
+    """
+    logger.info(f"Building prompt for query: {query}")
+
+    context, context_stats = assemble_context(search_results, model_choice)
     
     prompt_template = (
         "You're a Uganda Revenue Authority (URA) Expert. Answer the QUESTION based on the CONTEXT from the FAQ database.\n"
         "Use only the facts from the CONTEXT when answering the QUESTION.\n\n"
+        "{history}"
         "QUESTION: {question}\n\n"
         "CONTEXT:\n{context}"
     )
-    
-    prompt = prompt_template.format(question=query, context=context).strip()
+
+    window = select_history(history) if history else []
+    history_section = ""
+    if window:
+        history_section = (
+            "Use the CONVERSATION HISTORY only to understand what the QUESTION refers to.\n\n"
+            f"CONVERSATION HISTORY:\n{format_history(window)}\n\n"
+        )
+
+    prompt = prompt_template.format(history=history_section, question=query, context=context).strip()
     logger.debug(f"Built prompt: {prompt}")
-    return prompt
+    return prompt, context_stats
 
-def llm(prompt: str, model_choice: str) -> Tuple[str, Dict[str, int], float]:
+def build_prompt(
+    query: str,
+    search_results: List[Dict[str, Any]],
+    history: Optional[List[Turn]] = None,
+    model_choice: Optional[str] = None,
+) -> str:
+    """
+    Build a prompt for the language model based on the query and search results.
+    """
+    return assemble_prompt(query, search_results, history, model_choice)[0]
+
+def llm(prompt: str, model_choice: str, client: Optional[OpenAI] = None) -> Tuple[str, Dict[str, int], float]:
     """
     Call the language model with the given prompt and model choice.
+
+    `client` overrides the process's OpenAI client, e.g. one with its own retry policy.
     """
     logger.info(f"Sending prompt to language model: {model_choice}")
     start_time = time.time()
@@ -169,7 +557,7 @@ def llm(prompt: str, model_choice: str) -> Tuple[str, Dict[str, int], float]:
     try:
         if model_choice.startswith("openai/"):
             model_name = model_choice.split("/")[-1]
-            response = client.chat.completions.create(
+            response = (client or get_openai_client()).chat.completions.create(
                 model=model_name, 
                 messages=[{"role": "user", "content": prompt}]
             )
@@ -188,12 +576,53 @@ def llm(prompt: str, model_choice: str) -> Tuple[str, Dict[str, int], float]:
         logger.error(f"Error while calling LLM: {e}")
         raise
 
-def evaluate_relevance(question: str, answer: str) -> Tuple[str, str, Dict[str, int]]:
+def llm_stream(prompt: str, model_choice: str) -> Iterator[Tuple[str, Any]]:
     """
-    Evaluate the relevance of the generated answer to the question.
+    Stream the language model's answer for the given prompt and model choice.
+
+    Yields ("token", text) for each delta as it arrives, then a final
+    ("done", (answer, tokens, response_time)) once the completion has finished.
     """
-    logger.info(f"Evaluating relevance of answer for question: {question}")
+    logger.info(f"Streaming prompt to language model: {model_choice}")
+    start_time = time.time()
+
+    if not model_choice.startswith("openai/"):
+        raise ValueError(f"Unknown model choice: {model_choice}")
+
+    try:
+        model_name = model_choice.split("/")[-1]
+        stream = get_openai_client().chat.completions.create(
+            model=model_name,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        parts = []
+        tokens = dict(NO_TOKENS)
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                delta = chunk.choices[0].delta.content
+                parts.append(delta)
+                yield "token", delta
+            if chunk.usage is not None:
+                tokens = {
+                    'prompt_tokens': chunk.usage.prompt_tokens,
+                    'completion_tokens': chunk.usage.completion_tokens,
+                    'total_tokens': chunk.usage.total_tokens
+                }
 
+        response_time = time.time() - start_time
+        logger.info(f"LLM finished streaming an answer in {response_time:.2f} seconds.")
+        yield "done", ("".join(parts), tokens, response_time)
+    except Exception as e:
+        logger.error(f"Error while streaming from LLM: {e}")
+        raise
+
+def evaluation_prompt(question: str, answer: str) -> str:
+    """
+    Build the LLM-as-a-judge prompt used to evaluate an answer.
+    """
     prompt_template = (
         'You are an expert evaluator for a Retrieval-Augmented Generation (RAG) system.\n'
         'Your task is to analyze the relevance of the generated answer to the given question.\n'
@@ -208,16 +637,102 @@ def evaluate_relevance(question: str, answer: str) -> Tuple[str, str, Dict[str,
         '"Explanation": "[Provide a brief explanation for your evaluation]"\n}}'
     )
 
-    prompt = prompt_template.format(question=question, answer=answer)
-    evaluation, tokens, _ = llm(prompt, "openai/gpt-4o-mini")
+    return prompt_template.format(question=question, answer=answer)
 
+def parse_evaluation(evaluation: str) -> Tuple[str, str]:
+    """
+    Parse the evaluator's JSON output into a relevance label and explanation.
+    """
     try:
         json_eval = json.loads(evaluation)
         logger.info(f"Evaluation returned relevance: {json_eval['Relevance']}")
-        return json_eval["Relevance"], json_eval["Explanation"], tokens
+        return json_eval["Relevance"], json_eval["Explanation"]
     except json.JSONDecodeError as e:
         logger.error(f"Error decoding JSON evaluation: {e}")
-        return "UNKNOWN", "Failed to parse evaluation", tokens
+        return RELEVANCE_UNKNOWN, "Failed to parse evaluation"
+
+def evaluate_relevance(question: str, answer: str) -> Tuple[str, str, Dict[str, int]]:
+    """
+    Evaluate the relevance of the generated answer to the question.
+    """
+    logger.info(f"Evaluating relevance of answer for question: {question}")
+
+    prompt = evaluation_prompt(question, answer)
+    evaluation, tokens, _ = llm(prompt, EVAL_MODEL)
+
+    relevance, explanation = parse_evaluation(evaluation)
+    return relevance, explanation, tokens
+
+def batch_evaluation_prompt(items: List[Tuple[str, str]]) -> str:
+    """
+    Build a single LLM-as-a-judge prompt that evaluates several question/answer pairs.
+    """
+    records = "\n\n".join(
+        f"Item {number}:\nQuestion: {question}\nGenerated Answer: {answer}"
+        for number, (question, answer) in enumerate(items, start=1)
+    )
+
+    prompt_template = (
+        'You are an expert evaluator for a Retrieval-Augmented Generation (RAG) system.\n'
+        'Your task is to analyze the relevance of each generated answer to its question.\n'
+        'Based on the relevance of each generated answer, you will classify it\n'
+        'as "NON_RELEVANT", "PARTLY_RELEVANT", or "RELEVANT".\n\n'
+        "Here are the {count} items for evaluation:\n\n"
+        "{records}\n\n"
+        "Please analyze each item independently and provide your evaluations, in the same order\n"
+        "as the items, as a parsable JSON array without using code blocks:\n\n"
+        '[\n  {{"Relevance": "NON_RELEVANT" | "PARTLY_RELEVANT" | "RELEVANT",\n  '
+        '"Explanation": "[Provide a brief explanation for your evaluation]"}}\n]'
+    )
+
+    return prompt_template.format(count=len(items), records=records)
+
+def evaluate_relevance_batch(items: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], Dict[str, int]]:
+    """
+    Evaluate several question/answer pairs with one judge call.
+
+    Returns one (relevance, explanation) pair per item and the token usage of the whole batch.
+    """
+    if len(items) == 1:
+        relevance, explanation, tokens = evaluate_relevance(*items[0])
+        return [(relevance, explanation)], tokens
+
+    logger.info(f"Evaluating relevance of {len(items)} answers in one batch")
+
+    evaluation, tokens, _ = llm(batch_evaluation_prompt(items), EVAL_MODEL)
+
+    try:
+        json_evals = json.loads(evaluation)
+        if not isinstance(json_evals, list) or len(json_evals) != len(items):
+            raise ValueError(f"expected {len(items)} evaluations")
+        return [(item["Relevance"], item["Explanation"]) for item in json_evals], tokens
+    except (json.JSONDecodeError, ValueError, KeyError, TypeError) as e:
+        logger.error(f"Error decoding batch JSON evaluation: {e}")
+        return [(RELEVANCE_UNKNOWN, "Failed to parse evaluation")] * len(items), tokens
+
+def sample_relevance() -> str:
+    """
+    Decide whether an answer will be evaluated, according to EVAL_SAMPLE_RATE.
+    """
+    return RELEVANCE_PENDING if random.random() < EVAL_SAMPLE_RATE else RELEVANCE_NOT_EVALUATED
+
+def condense_query(query: str, history: Optional[List[Turn]]) -> Tuple[str, Dict[str, int]]:
+    """
+    Rewrite a follow-up question into a standalone query for retrieval and caching.
+
+    Returns the query unchanged, with no token usage, for the first turn of a session or
+    when condensing is disabled or fails.
+    """
+    if not history or not CONDENSE_ENABLED:
+        return query, NO_TOKENS
+    try:
+        output, tokens, _ = llm(condense_prompt(query, condense_turns(history)), CONDENSE_MODEL)
+    except Exception as e:
+        logger.warning(f"Could not condense follow-up question, searching with it as asked: {e}")
+        return query, NO_TOKENS
+    condensed = parse_condensed(query, output)
+    logger.info(f"Condensed follow-up question to: {condensed}")
+    return condensed, tokens
 
 def calculate_openai_cost(model_choice: str, tokens: Dict[str, int]) -> float:
     """
@@ -239,47 +754,260 @@ def calculate_openai_cost(model_choice: str, tokens: Dict[str, int]) -> float:
     logger.info(f"OpenAI cost: ${openai_cost:.4f}")
     return openai_cost
 
+def answer_usage(
+    model_choice: str, tokens: Dict[str, int], condense_tokens: Dict[str, int]
+) -> Tuple[Dict[str, int], float]:
+    """
+    Token usage and cost of an answer, including the call that condensed a follow-up question.
+    """
+    openai_cost = calculate_openai_cost(model_choice, tokens)
+    if condense_tokens["total_tokens"]:
+        openai_cost += calculate_openai_cost(CONDENSE_MODEL, condense_tokens)
+        tokens = add_tokens(tokens, condense_tokens)
+    return tokens, openai_cost
+
+def use_answer_cache(history: Optional[List[Turn]]) -> bool:
+    """
+    Whether the answer cache applies. A follow-up is only cacheable once condensed into a standalone query.
+    """
+    return ANSWER_CACHE_ENABLED and (not history or CONDENSE_ENABLED)
+
+def build_answer_result(
+    answer: str,
+    response_time: float,
+    relevance: str,
+    explanation: str,
+    model_choice: str,
+    tokens: Dict[str, int],
+    eval_tokens: Dict[str, int],
+    openai_cost: float,
+) -> Dict[str, Any]:
+    """
+    Assemble the answer payload returned by get_answer.
+    """
+    return {
+        "answer": answer,
+        "response_time": response_time,
+        "relevance": relevance,
+        "relevance_explanation": explanation,
+        "model_used": model_choice,
+        "prompt_tokens": tokens["prompt_tokens"],
+        "completion_tokens": tokens["completion_tokens"],
+        "total_tokens": tokens["total_tokens"],
+        "eval_prompt_tokens": eval_tokens["prompt_tokens"],
+        "eval_completion_tokens": eval_tokens["completion_tokens"],
+        "eval_total_tokens": eval_tokens["total_tokens"],
+        "openai_cost": openai_cost,
+        "cached": False,
+    }
+
+def cache_hit_result(
+    cached: Dict[str, Any], response_time: float, condense_tokens: Dict[str, int] = NO_TOKENS
+) -> Dict[str, Any]:
+    """
+    Turn a cached answer into a result that records no answer token usage or cost.
+
+    Only the tokens spent condensing a follow-up question, if any, are recorded.
+    """
+    tokens, openai_cost = answer_usage(CONDENSE_MODEL, NO_TOKENS, condense_tokens)
+    return {
+        **cached,
+        "response_time": response_time,
+        "relevance": sample_relevance(),
+        "relevance_explanation": "",
+        "prompt_tokens": tokens["prompt_tokens"],
+        "completion_tokens": tokens["completion_tokens"],
+        "total_tokens": tokens["total_tokens"],
+        "eval_prompt_tokens": 0,
+        "eval_completion_tokens": 0,
+        "eval_total_tokens": 0,
+        "openai_cost": openai_cost,
+        "retrieval_latency": {},
+        "context_tokens_saved": 0,
+        "cached": True,
+    }
+
+def needs_query_vector(search_type: str) -> bool:
+    """
+    Whether the query must be embedded, either for retrieval or for a semantic cache lookup.
+    """
+    return search_type != "text" or (ANSWER_CACHE_ENABLED and ANSWER_CACHE_SIMILARITY < 1.0)
+
+def retrieve(
+    query: str,
+    search_type: str,
+    vector: Optional[List[float]],
+    index_name: str = INDEX_NAME,
+    search_options: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """
+    Retrieve FAQ context for the query with the requested search type.
+
+    Returns the results and the retrieval latency in seconds, per leg for RRF searches.
+    `search_options` (k, num_candidates, text_weight, vector_weight) apply to the rrf search type.
+    """
+    if search_type == "rrf":
+        return hybrid_search_rrf(query, vector, index_name=index_name, **(search_options or {}))
+
+    start_time = time.perf_counter()
+    if RETRIEVAL_BACKEND == "memory":
+        retriever = get_memory_retriever()
+        if search_type == "vector":
+            results = retriever.search_knn("question_vector", vector)
+        elif search_type == "text":
+            results = retriever.search_text(query)
+        else:
+            results = retriever.search_hybrid("question_answer_vector", query, vector)
+    elif search_type == "vector":
+        results = elastic_search_knn("question_vector",vector, index_name)
+    elif search_type == "text":
+        results = elastic_search_text(query, index_name)
+    else:
+        results = elastic_search_hybrid("question_answer_vector", query, vector, index_name)
+    return results, {search_type: time.perf_counter() - start_time}
+
+def cache_scope(search_type: str, search_options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Answer cache partition for a search type and its options.
+    """
+    if not search_options:
+        return search_type
+    return search_type + json.dumps(search_options, sort_keys=True)
+
 def get_answer(
     query: str,
     model_choice: str,
     search_type: str,
     index_name: str = INDEX_NAME,
+    search_options: Optional[Dict[str, Any]] = None,
+    history: Optional[List[Turn]] = None,
 ) -> Dict[str, Any]:
     """
     Get an answer to the query using the specified model and search type.
+
+    `history` holds the session's prior (question, answer) turns, oldest first. A follow-up
+    question is condensed into a standalone query for retrieval and caching, and the prior
+    turns are added to the prompt within the history token budget. The time spent in each
+    stage is returned in `stage_latency`.
     """
     logger.info(f"Fetching answer for query: {query} with model: {model_choice} and search type: {search_type}")
     
     try:
-        if search_type == "vector":
-            vector = model.encode(query).tolist()
-            search_results = elastic_search_knn("question_text_vector",vector, index_name)
-        elif search_type == "text":
-            search_results = elastic_search_text(query, index_name)
-        else:
-            search_results = elastic_search_hybrid("question_answer_vector", query, index_name)
+        start_time = time.time()
+        timer = StageTimer()
+        with timer.stage("condense"):
+            search_query, condense_tokens = condense_query(query, history)
+        use_cache = use_answer_cache(history)
+        vector = None
+        if needs_query_vector(search_type):
+            with timer.stage("embed"):
+                vector = encode_query(search_query)
+
+        if use_cache:
+            with timer.stage("cache_lookup"):
+                cached = answer_cache.lookup(search_query, model_choice, cache_scope(search_type, search_options), vector)
+            if cached is not None:
+                result = {
+                    **cache_hit_result(cached, time.time() - start_time, condense_tokens),
+                    "search_query": search_query,
+                    "stage_latency": timer.as_dict(),
+                }
+                record_answer(result, search_type)
+                return result
 
-        prompt = build_prompt(query, search_results)
-        answer, tokens, response_time = llm(prompt, model_choice)
-        relevance, explanation, eval_tokens = evaluate_relevance(query, answer)
-        openai_cost = calculate_openai_cost(model_choice, tokens)
+        with timer.stage("retrieve"):
+            search_results, retrieval_latency = retrieve(search_query, search_type, vector, index_name, search_options)
+
+        with timer.stage("prompt"):
+            prompt, context_stats = assemble_prompt(query, search_results, history, model_choice)
+        with timer.stage("generate"):
+            answer, tokens, response_time = llm(prompt, model_choice)
+        tokens, openai_cost = answer_usage(model_choice, tokens, condense_tokens)
 
         logger.info(f"Answer generated for query: {query}")
 
-        return {
-            "answer": answer,
-            "response_time": response_time,
-            "relevance": relevance,
-            "relevance_explanation": explanation,
-            "model_used": model_choice,
-            "prompt_tokens": tokens["prompt_tokens"],
-            "completion_tokens": tokens["completion_tokens"],
-            "total_tokens": tokens["total_tokens"],
-            "eval_prompt_tokens": eval_tokens["prompt_tokens"],
-            "eval_completion_tokens": eval_tokens["completion_tokens"],
-            "eval_total_tokens": eval_tokens["total_tokens"],
-            "openai_cost": openai_cost,
-        }
+        # Relevance is filled in later by the background evaluation queue
+        result = build_answer_result(
+            answer, response_time, sample_relevance(), "", model_choice, tokens, NO_TOKENS, openai_cost
+        )
+        result["retrieval_latency"] = retrieval_latency
+        result["search_query"] = search_query
+        result["context_tokens_saved"] = context_stats["context_tokens_saved"]
+        result["stage_latency"] = timer.as_dict()
+        if use_cache and search_results:
+            answer_cache.store(search_query, model_choice, cache_scope(search_type, search_options), result, vector)
+        record_answer(result, search_type)
+        return result
     except Exception as e:
         logger.error(f"Error generating answer: {e}")
-        return {"error": "An error occurred while fetching the answer."}
\ No newline at end of file
+        return {"error": "An error occurred while fetching the answer."}
+
+def stream_answer(
+    query: str,
+    model_choice: str,
+    search_type: str,
+    index_name: str = INDEX_NAME,
+    search_options: Optional[Dict[str, Any]] = None,
+    history: Optional[List[Turn]] = None,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Stream an answer to the query using the specified model and search type.
+
+    Yields ("retrieval", hits) once the context has been retrieved, ("token", text) for each
+    piece of the answer, and finally ("done", result) with the same payload get_answer returns.
+    """
+    logger.info(f"Streaming answer for query: {query} with model: {model_choice} and search type: {search_type}")
+
+    start_time = time.time()
+    timer = StageTimer()
+    with timer.stage("condense"):
+        search_query, condense_tokens = condense_query(query, history)
+    use_cache = use_answer_cache(history)
+    vector = None
+    if needs_query_vector(search_type):
+        with timer.stage("embed"):
+            vector = encode_query(search_query)
+
+    if use_cache:
+        with timer.stage("cache_lookup"):
+            cached = answer_cache.lookup(search_query, model_choice, cache_scope(search_type, search_options), vector)
+        if cached is not None:
+            result = {
+                **cache_hit_result(cached, time.time() - start_time, condense_tokens),
+                "search_query": search_query,
+                "stage_latency": timer.as_dict(),
+            }
+            record_answer(result, search_type)
+            yield "retrieval", []
+            yield "token", cached["answer"]
+            yield "done", result
+            return
+
+    with timer.stage("retrieve"):
+        search_results, retrieval_latency = retrieve(search_query, search_type, vector, index_name, search_options)
+    yield "retrieval", [
+        {"id": faq.get("id"), "section": faq.get("section"), "question": faq.get("question")}
+        for faq in search_results
+    ]
+
+    with timer.stage("prompt"):
+        prompt, context_stats = assemble_prompt(query, search_results, history, model_choice)
+    for event, payload in llm_stream(prompt, model_choice):
+        if event == "token":
+            yield event, payload
+            continue
+
+        answer, tokens, response_time = payload
+        timer.record("generate", response_time)
+        tokens, openai_cost = answer_usage(model_choice, tokens, condense_tokens)
+        result = build_answer_result(
+            answer, response_time, sample_relevance(), "", model_choice, tokens, NO_TOKENS, openai_cost
+        )
+        result["retrieval_latency"] = retrieval_latency
+        result["search_query"] = search_query
+        result["context_tokens_saved"] = context_stats["context_tokens_saved"]
+        result["stage_latency"] = timer.as_dict()
+        if use_cache and search_results:
+            answer_cache.store(search_query, model_choice, cache_scope(search_type, search_options), result, vector)
+        record_answer(result, search_type)
+        yield "done", result
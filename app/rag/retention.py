@@ -0,0 +1,171 @@
+import gzip
+import json
+import logging
+import os
+
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Conversation, Feedback
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "180"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/archive")
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+
+def month_start(timestamp: datetime) -> datetime:
+    """
+    Start of the UTC month containing the timestamp.
+    """
+    return timestamp.astimezone(dt_timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(start: datetime) -> datetime:
+    """
+    Start of the month after `start`.
+    """
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def archivable_months(cutoff: datetime) -> List[datetime]:
+    """
+    Months whose conversations all fall before `cutoff`, oldest first.
+
+    Only whole months are archived, so each archive file covers exactly one month and a
+    month is never split between the database and the archive.
+    """
+    oldest = Conversation.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+    if oldest is None:
+        return []
+    months = []
+    start = month_start(oldest)
+    while next_month(start) <= cutoff:
+        if Conversation.objects.filter(timestamp__gte=start, timestamp__lt=next_month(start)).exists():
+            months.append(start)
+        start = next_month(start)
+    return months
+
+
+def _serialize(row: Dict[str, object]) -> str:
+    return json.dumps(
+        {name: value.isoformat() if isinstance(value, (datetime, date)) else value for name, value in row.items()},
+        ensure_ascii=False,
+    )
+
+
+def _month_rows(start: datetime, end: datetime, batch_size: int) -> Iterator[Tuple[List[dict], List[dict]]]:
+    """
+    Yield a month's conversations in (timestamp, id) order, batch by batch, with the feedback on each batch.
+    """
+    conversations = Conversation.objects.filter(timestamp__gte=start, timestamp__lt=end).order_by("timestamp", "id")
+    last = None
+    while True:
+        batch = conversations
+        if last is not None:
+            batch = batch.filter(timestamp__gte=last[0]).exclude(timestamp=last[0], id__lte=last[1])
+        rows = list(batch.values()[:batch_size])
+        if not rows:
+            return
+        feedback = list(Feedback.objects.filter(conversation_id__in=[row["id"] for row in rows]).order_by("id").values())
+        yield rows, feedback
+        last = (rows[-1]["timestamp"], rows[-1]["id"])
+
+
+def archive_month(start: datetime, archive_dir: str, batch_size: int = 1000, dry_run: bool = False) -> Dict[str, object]:
+    """
+    Move one month of conversations and their feedback to gzip JSONL files, then delete them.
+
+    The files are written under a temporary name and renamed once complete, and rows are only
+    deleted after that, so an interrupted run leaves the database untouched. Each run writes
+    new files stamped with the run time, so re-running a month never overwrites an archive.
+    The hourly rollups are left as they are, keeping stats and dashboards complete for
+    archived months.
+    """
+    end = next_month(start)
+    label = f"{start:%Y-%m}"
+    stamp = timezone.now().strftime("%Y%m%dT%H%M%S")
+    month_dir = os.path.join(archive_dir, f"{start:%Y}", f"{start:%m}")
+    paths = {
+        "conversations": os.path.join(month_dir, f"conversations-{label}-{stamp}.jsonl.gz"),
+        "feedback": os.path.join(month_dir, f"feedback-{label}-{stamp}.jsonl.gz"),
+    }
+    result = {"month": label, "conversations": 0, "feedback": 0, "files": []}
+
+    if dry_run:
+        conversations = Conversation.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        result["conversations"] = conversations.count()
+        result["feedback"] = Feedback.objects.filter(conversation__in=conversations).count()
+        return result
+
+    os.makedirs(month_dir, exist_ok=True)
+    archived_ids: List[str] = []
+    with gzip.open(paths["conversations"] + ".tmp", "wt", encoding="utf-8") as conversations_file, \
+            gzip.open(paths["feedback"] + ".tmp", "wt", encoding="utf-8") as feedback_file:
+        for rows, feedback in _month_rows(start, end, batch_size):
+            conversations_file.writelines(_serialize(row) + "\n" for row in rows)
+            feedback_file.writelines(_serialize(row) + "\n" for row in feedback)
+            archived_ids.extend(row["id"] for row in rows)
+            result["feedback"] += len(feedback)
+
+    if not archived_ids:
+        for path in paths.values():
+            os.remove(path + ".tmp")
+        return result
+
+    for path in paths.values():
+        os.replace(path + ".tmp", path)
+    result["files"] = list(paths.values())
+    result["conversations"] = len(archived_ids)
+
+    # Delete in small transactions to keep locks short; feedback goes with its conversation
+    for offset in range(0, len(archived_ids), batch_size):
+        ids = archived_ids[offset:offset + batch_size]
+        with transaction.atomic():
+            Feedback.objects.filter(conversation_id__in=ids).delete()
+            Conversation.objects.filter(id__in=ids).delete()
+
+    logger.info(f"Archived {result['conversations']} conversations and {result['feedback']} feedback rows for {label}.")
+    return result
+
+
+def archive_old_conversations(
+    retention_days: int = RETENTION_DAYS,
+    archive_dir: str = ARCHIVE_DIR,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    dry_run: bool = False,
+    now: Optional[datetime] = None,
+) -> List[Dict[str, object]]:
+    """
+    Archive every whole month older than `retention_days`, oldest month first.
+    """
+    cutoff = (now or timezone.now()) - timedelta(days=retention_days)
+    return [
+        archive_month(start, archive_dir, batch_size=batch_size, dry_run=dry_run)
+        for start in archivable_months(cutoff)
+    ]
+
+
+def vacuum_conversation_tables() -> None:
+    """
+    Reclaim the space freed by archiving and refresh planner statistics (PostgreSQL only).
+    """
+    if connection.vendor != "postgresql":
+        return
+    tables = ", ".join(connection.ops.quote_name(model._meta.db_table) for model in (Conversation, Feedback))
+    with connection.cursor() as cursor:
+        cursor.execute(f"VACUUM (ANALYZE) {tables}")
+
+
+def read_archive(path: str) -> Iterator[dict]:
+    """
+    Iterate over the rows of an archive file.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import math
+import re
+
+from collections import Counter
+from typing import Any, Callable, Dict, List, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TEXT_FIELDS = ("question", "answer", "section")
+VECTOR_FIELDS = ("question_vector", "answer_vector", "question_answer_vector")
+SOURCE_FIELDS = ("answer", "section", "question", "id")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokenizer, close to Elasticsearch's standard analyzer.
+    """
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Field:
+    """
+    BM25 scoring over one text field, using an inverted index of term postings.
+    """
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(texts)
+
+        postings: Dict[str, List[tuple]] = {}
+        lengths = np.zeros(self.size, dtype=np.float32)
+        for doc, text in enumerate(texts):
+            terms = Counter(tokenize(text or ""))
+            lengths[doc] = sum(terms.values())
+            for term, freq in terms.items():
+                postings.setdefault(term, []).append((doc, freq))
+
+        avg_length = float(lengths.mean()) if self.size and lengths.mean() > 0 else 1.0
+        self._norms = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+        self._postings = {
+            term: (
+                np.array([doc for doc, _ in docs], dtype=np.int64),
+                np.array([freq for _, freq in docs], dtype=np.float32),
+            )
+            for term, docs in postings.items()
+        }
+
+    def scores(self, query_terms: Sequence[str]) -> np.ndarray:
+        """
+        BM25 score of every document for the query terms.
+        """
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in query_terms:
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            docs, freqs = posting
+            idf = math.log(1 + (self.size - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + self._norms[docs])
+        return scores
+
+
+class InMemoryRetriever:
+    """
+    In-process replacement for the Elasticsearch index.
+
+    Each vector field is held as a contiguous (n_docs, dim) float32 matrix of unit vectors,
+    so KNN is a single matrix-vector product. Keyword search is BM25 over question, answer
+    and section, combined like a `best_fields` multi_match. Results have the same shape as
+    the `_source` dicts returned by the Elasticsearch searches in raglogic.
+    """
+
+    def __init__(
+        self,
+        faqs: List[Dict[str, Any]],
+        encode_fn: Callable[[List[str]], np.ndarray],
+        use_hnsw: bool = False,
+    ):
+        self.faqs = faqs
+        self.sources = [{field: faq.get(field) for field in SOURCE_FIELDS} for faq in faqs]
+        self.version = hashlib.sha256(
+            json.dumps([[faq.get(field) for field in TEXT_FIELDS] for faq in faqs]).encode("utf-8")
+        ).hexdigest()[:16]
+
+        # A record may carry only a question or only an answer; treat the missing one as empty
+        questions = [faq.get("question") or "" for faq in faqs]
+        answers = [faq.get("answer") or "" for faq in faqs]
+        texts = {
+            "question_vector": questions,
+            "answer_vector": answers,
+            "question_answer_vector": [q + " " + a for q, a in zip(questions, answers)],
+        }
+        self.vectors = {field: _normalize(encode_fn(texts[field])) for field in VECTOR_FIELDS}
+        self.text_fields = {field: BM25Field([faq.get(field) for faq in faqs]) for field in TEXT_FIELDS}
+
+        self.hnsw = {}
+        if use_hnsw:
+            self._build_hnsw()
+
+        logger.info(f"Loaded {len(faqs)} FAQs into the in-memory retriever (hnsw={bool(self.hnsw)}).")
+
+    @classmethod
+    def from_file(
+        cls,
+        path: str,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        use_hnsw: bool = False,
+    ) -> "InMemoryRetriever":
+        """
+        Build a retriever from the FAQs JSON file used to build the Elasticsearch index.
+        """
+        with open(path, "r") as f:
+            faqs = [faq for faq in json.load(f) if faq.get("question") or faq.get("answer")]
+        return cls(faqs, encode_fn, use_hnsw=use_hnsw)
+
+    def knn_scores(self, field: str, vector: Sequence[float]) -> np.ndarray:
+        """
+        Cosine similarity of the query vector to every document's vector in the field.
+        """
+        query = _normalize(np.asarray(vector, dtype=np.float32)[None, :])[0]
+        return self.vectors[field] @ query
+
+    def text_scores(self, query: str) -> np.ndarray:
+        """
+        BM25 score of every document, taking the best field per document.
+        """
+        terms = tokenize(query)
+        return np.max(np.stack([field.scores(terms) for field in self.text_fields.values()]), axis=0)
+
+    def knn_ranking(self, field: str, vector: Sequence[float], k: int) -> List[tuple]:
+        """
+        Top-k (doc, cosine) pairs for the query vector, best first.
+        """
+        if field in self.hnsw:
+            labels, distances = self.hnsw[field].knn_query(np.asarray(vector, dtype=np.float32), k=min(k, len(self.faqs)))
+            return [(int(doc), 1.0 - float(distance)) for doc, distance in zip(labels[0], distances[0])]
+
+        scores = self.knn_scores(field, vector)
+        top = _top_k(scores, k)
+        return [(int(doc), float(scores[doc])) for doc in top]
+
+    def text_ranking(self, query: str, k: int) -> List[tuple]:
+        """
+        Top-k (doc, bm25) pairs for the query, best first, excluding non-matching documents.
+        """
+        scores = self.text_scores(query)
+        top = _top_k(scores, k)
+        return [(int(doc), float(scores[doc])) for doc in top if scores[doc] > 0]
+
+    def search_text(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Keyword search, equivalent to elastic_search_text.
+        """
+        return [self.sources[doc] for doc, _ in self.text_ranking(query, k)]
+
+    def search_knn(self, field: str, vector: Sequence[float], k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Vector search, equivalent to elastic_search_knn.
+        """
+        return [self.sources[doc] for doc, _ in self.knn_ranking(field, vector, k)]
+
+    def search_hybrid(
+        self,
+        field: str,
+        query: str,
+        vector: Sequence[float],
+        k: int = 5,
+        knn_boost: float = 0.5,
+        text_boost: float = 0.5,
+    ) -> List[Dict[str, Any]]:
+        """
+        Hybrid search, equivalent to elastic_search_hybrid.
+
+        Like Elasticsearch, the KNN leg only contributes its top-k hits, scored as (1 + cosine) / 2,
+        and is summed with the boosted BM25 score of every matching document.
+        """
+        scores = text_boost * self.text_scores(query)
+        for doc, cosine in self.knn_ranking(field, vector, k):
+            scores[doc] += knn_boost * (1 + cosine) / 2
+        top = _top_k(scores, k)
+        return [self.sources[doc] for doc in top if scores[doc] > 0]
+
+    def _build_hnsw(self) -> None:
+        try:
+            import hnswlib
+        except ImportError:
+            logger.warning("hnswlib is not installed; falling back to exact matrix search.")
+            return
+
+        for field, matrix in self.vectors.items():
+            index = hnswlib.Index(space="cosine", dim=matrix.shape[1])
+            index.init_index(max_elements=max(1, len(matrix)), ef_construction=200, M=16)
+            index.add_items(matrix, np.arange(len(matrix)))
+            index.set_ef(64)
+            self.hnsw[field] = index
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
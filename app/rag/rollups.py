@@ -0,0 +1,149 @@
+import logging
+
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncHour
+
+from .models import Conversation, ConversationRollup, Feedback, FeedbackRollup
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_TOTALS = ("conversations", "response_time_sum", "openai_cost_sum", "total_tokens_sum")
+
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    """
+    Start of the UTC hour containing the timestamp.
+    """
+    return timestamp.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _conversation_totals(conversation, sign: int = 1) -> Dict[str, float]:
+    return {
+        "conversations": sign,
+        "response_time_sum": sign * (conversation.response_time or 0.0),
+        "openai_cost_sum": sign * (conversation.openai_cost or 0.0),
+        "total_tokens_sum": sign * (conversation.total_tokens or 0),
+    }
+
+
+def _increment(model, key: Dict[str, object], deltas: Dict[str, float]) -> None:
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**key).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Another writer created the bucket first
+        model.objects.filter(**key).update(**updates)
+
+
+def _apply(model, changes: Dict[Tuple, Dict[str, float]], key_fields: Tuple[str, ...]) -> None:
+    for key, deltas in changes.items():
+        if any(deltas.values()):
+            _increment(model, dict(zip(key_fields, key)), deltas)
+
+
+def record_conversations(conversations: Iterable[Conversation], sign: int = 1) -> None:
+    """
+    Add new conversations to their hourly buckets, or remove them with sign=-1.
+
+    Call inside the transaction that writes or deletes the rows so the rollup never drifts from them.
+    """
+    changes: Dict[Tuple, Dict[str, float]] = defaultdict(lambda: dict.fromkeys(CONVERSATION_TOTALS, 0))
+    for conversation in conversations:
+        totals = changes[(hour_bucket(conversation.timestamp), conversation.model_used, conversation.relevance)]
+        for field, value in _conversation_totals(conversation, sign).items():
+            totals[field] += value
+    _apply(ConversationRollup, changes, ("bucket", "model_used", "relevance"))
+
+
+def record_feedback(feedback: Iterable[Feedback], sign: int = 1) -> None:
+    """
+    Add new feedback to its hourly buckets, or remove it with sign=-1.
+    """
+    changes: Dict[Tuple, Dict[str, float]] = defaultdict(lambda: {"count": 0})
+    for row in feedback:
+        changes[(hour_bucket(row.timestamp), row.feedback)]["count"] += sign
+    _apply(FeedbackRollup, changes, ("bucket", "feedback"))
+
+
+def record_rows(model, rows: Iterable, sign: int = 1) -> None:
+    """
+    Record inserted (or, with sign=-1, deleted) Conversation or Feedback rows in the rollups.
+    """
+    if model is Conversation:
+        record_conversations(rows, sign)
+    elif model is Feedback:
+        record_feedback(rows, sign)
+
+
+def move_relevance(conversation, relevance: str) -> None:
+    """
+    Move a stored conversation from its current relevance bucket to a new one.
+    """
+    if conversation.relevance == relevance:
+        return
+    record_conversations([conversation], sign=-1)
+    conversation.relevance = relevance
+    record_conversations([conversation])
+
+
+def rebuild_rollups(since: Optional[datetime] = None) -> Tuple[int, int]:
+    """
+    Recompute the rollups from the raw tables, for every bucket from `since` onwards.
+
+    Repairs drift from writes that bypassed the services, such as manual SQL. Without `since`
+    it starts at the oldest conversation still stored, so buckets for archived months (see
+    retention.py) are kept. Returns the number of conversation and feedback buckets written.
+    """
+    if since is None:
+        oldest = Conversation.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+        since = oldest or datetime.now(dt_timezone.utc)
+    since = hour_bucket(since)
+    conversations = Conversation.objects.filter(timestamp__gte=since)
+    feedback = Feedback.objects.filter(timestamp__gte=since)
+    conversation_buckets = ConversationRollup.objects.filter(bucket__gte=since)
+    feedback_buckets = FeedbackRollup.objects.filter(bucket__gte=since)
+
+    with transaction.atomic():
+        conversation_buckets.delete()
+        feedback_buckets.delete()
+
+        conversation_rows = [
+            ConversationRollup(
+                bucket=row["bucket"],
+                model_used=row["model_used"],
+                relevance=row["relevance"],
+                conversations=row["conversations"],
+                response_time_sum=row["response_time_sum"] or 0.0,
+                openai_cost_sum=row["openai_cost_sum"] or 0.0,
+                total_tokens_sum=row["total_tokens_sum"] or 0,
+            )
+            for row in conversations.annotate(bucket=TruncHour("timestamp", tzinfo=dt_timezone.utc))
+            .values("bucket", "model_used", "relevance")
+            .annotate(
+                conversations=Count("id"),
+                response_time_sum=Sum("response_time"),
+                openai_cost_sum=Sum("openai_cost"),
+                total_tokens_sum=Sum("total_tokens"),
+            )
+            .order_by()
+        ]
+        feedback_rows = [
+            FeedbackRollup(bucket=row["bucket"], feedback=row["feedback"], count=row["count"])
+            for row in feedback.annotate(bucket=TruncHour("timestamp", tzinfo=dt_timezone.utc))
+            .values("bucket", "feedback")
+            .annotate(count=Count("id"))
+            .order_by()
+        ]
+        ConversationRollup.objects.bulk_create(conversation_rows, batch_size=1000)
+        FeedbackRollup.objects.bulk_create(feedback_rows, batch_size=1000)
+
+    logger.info(f"Rebuilt {len(conversation_rows)} conversation and {len(feedback_rows)} feedback buckets.")
+    return len(conversation_rows), len(feedback_rows)
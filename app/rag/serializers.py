@@ -1,10 +1,42 @@
 from rest_framework import serializers
+from .batch import BATCH_MAX_QUESTIONS
 from .models import Conversation,Feedback
 
 class ChatbotSerializer(serializers.Serializer):
     message = serializers.CharField(required=True)
     model_choice = serializers.CharField(default="openai/gpt-3.5-turbo")
     search_type = serializers.CharField(default="Text")
+    # Continue an existing chat session; defaults to the one stored in the client's session cookie
+    session_id = serializers.CharField(required=False, max_length=255)
+    # Tuning for the "rrf" search type; omitted fields fall back to the server defaults
+    k = serializers.IntegerField(required=False, min_value=1, max_value=50)
+    num_candidates = serializers.IntegerField(required=False, min_value=1, max_value=10000)
+    text_weight = serializers.FloatField(required=False, min_value=0.0)
+    vector_weight = serializers.FloatField(required=False, min_value=0.0)
+
+SEARCH_OPTION_FIELDS = ("k", "num_candidates", "text_weight", "vector_weight")
+
+class BatchChatSerializer(ChatbotSerializer):
+    # Same model and search options as a single chat, without the single message and session
+    message = None
+    session_id = None
+    # Strings, or {"id": ..., "question": ...} objects; ids default to the question's position
+    questions = serializers.ListField(child=serializers.JSONField(), min_length=1, max_length=BATCH_MAX_QUESTIONS)
+    concurrency = serializers.IntegerField(required=False, min_value=1, max_value=32)
+    # Ids answered by an earlier, interrupted request; they are skipped
+    skip_ids = serializers.ListField(child=serializers.CharField(), required=False)
+
+    def validate_questions(self, value):
+        items = []
+        for position, entry in enumerate(value):
+            if isinstance(entry, str):
+                entry = {"question": entry}
+            if not isinstance(entry, dict) or not isinstance(entry.get("question"), str) or not entry["question"].strip():
+                raise serializers.ValidationError(f"Item {position} must be a question string or an object with a question.")
+            items.append({"id": str(entry.get("id", position)), "question": entry["question"]})
+        if len({item["id"] for item in items}) != len(items):
+            raise serializers.ValidationError("Question ids must be unique.")
+        return items
 
 class FeedbackSerializer(serializers.ModelSerializer):
     class Meta:
@@ -17,15 +49,41 @@ class FeedbackSubmissionSerializer(serializers.Serializer):
 
 class ConversationSerializer(serializers.ModelSerializer):
     feedback = FeedbackSerializer(many=True, read_only=True)
+
+    def __init__(self, *args, **kwargs):
+        # Optional projection: only serialize the named fields
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     class Meta:
         model = Conversation
         fields = [
-            'id', 'question', 'answer', 'section', 'model_used', 'response_time',
+            'id', 'session_id', 'question', 'answer', 'section', 'model_used', 'response_time',
             'relevance', 'relevance_explanation', 'prompt_tokens', 'completion_tokens',
             'total_tokens', 'eval_prompt_tokens', 'eval_completion_tokens', 'eval_total_tokens',
-            'openai_cost', 'timestamp','feedback'
+            'openai_cost', 'context_tokens_saved', 'stage_latency', 'timestamp','feedback'
         ]
 
+class ConversationPageQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(default=20, min_value=1, max_value=100)
+    cursor = serializers.CharField(required=False)
+    relevance = serializers.CharField(required=False)
+    session_id = serializers.CharField(required=False)
+    fields = serializers.CharField(required=False)
+
+    def validate_fields(self, value):
+        fields = [field.strip() for field in value.split(',') if field.strip()]
+        unknown = set(fields) - set(ConversationSerializer.Meta.fields)
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown fields: {', '.join(sorted(unknown))}. "
+                f"Choose from: {', '.join(ConversationSerializer.Meta.fields)}."
+            )
+        return fields
+
 class FeedbackStatsSerializer(serializers.Serializer):
     thumbs_up = serializers.IntegerField()
     thumbs_down = serializers.IntegerField()
\ No newline at end of file
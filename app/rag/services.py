@@ -1,36 +1,75 @@
+import base64
+import json
 import logging
-from .models import Conversation, Feedback
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+from .history import HISTORY_MAX_TURNS, Turn
+from .models import Conversation, Feedback, FeedbackRollup
+from .persistence import WRITE_BUFFER_ENABLED, insert_rows, new_feedback, write_buffer
+from .rollups import record_conversations, record_feedback
+from asgiref.sync import sync_to_async
 from django.utils import timezone
-from django.db import DatabaseError
+from django.db import DatabaseError, transaction
+from django.db.models import Sum
 
 # Logger configuration
 logger = logging.getLogger(__name__)
 
-def save_conversation(conversation_id: str, question: str, answer_data: dict, section: str) -> None:
+def _conversation_fields(
+    conversation_id: str, question: str, answer_data: dict, section: str, session_id: str = ""
+) -> dict:
+    return dict(
+        id=conversation_id,
+        session_id=session_id,
+        question=question,
+        answer=answer_data["answer"],
+        section=section,
+        model_used=answer_data["model_used"],
+        response_time=answer_data["response_time"],
+        relevance=answer_data["relevance"],
+        relevance_explanation=answer_data["relevance_explanation"],
+        prompt_tokens=answer_data["prompt_tokens"],
+        completion_tokens=answer_data["completion_tokens"],
+        total_tokens=answer_data["total_tokens"],
+        eval_prompt_tokens=answer_data["eval_prompt_tokens"],
+        eval_completion_tokens=answer_data["eval_completion_tokens"],
+        eval_total_tokens=answer_data["eval_total_tokens"],
+        openai_cost=answer_data["openai_cost"],
+        context_tokens_saved=answer_data.get("context_tokens_saved", 0),
+        stage_latency=answer_data.get("stage_latency", {}),
+        timestamp=timezone.now(),
+    )
+
+
+def save_conversation(
+    conversation_id: str, question: str, answer_data: dict, section: str, session_id: str = ""
+) -> None:
     """
-    Save a conversation to the database.
+    Save a conversation before the response is sent, so every worker can read it.
     """
     try:
         logger.info(f"Saving conversation {conversation_id}")
-        conversation = Conversation.objects.create(
-            id=conversation_id,
-            question=question,
-            answer=answer_data["answer"],
-            section=section,
-            model_used=answer_data["model_used"],
-            response_time=answer_data["response_time"],
-            relevance=answer_data["relevance"],
-            relevance_explanation=answer_data["relevance_explanation"],
-            prompt_tokens=answer_data["prompt_tokens"],
-            completion_tokens=answer_data["completion_tokens"],
-            total_tokens=answer_data["total_tokens"],
-            eval_prompt_tokens=answer_data["eval_prompt_tokens"],
-            eval_completion_tokens=answer_data["eval_completion_tokens"],
-            eval_total_tokens=answer_data["eval_total_tokens"],
-            openai_cost=answer_data["openai_cost"],
-            timestamp=timezone.now(),
-        )
-        conversation.save()
+        conversation = Conversation(**_conversation_fields(conversation_id, question, answer_data, section, session_id))
+        insert_rows(Conversation, [conversation])
+        logger.info(f"Conversation {conversation_id} saved successfully.")
+    except DatabaseError as e:
+        logger.error(f"Error saving conversation {conversation_id}: {e}")
+        raise
+    except Exception as e:
+        logger.exception(f"Unexpected error while saving conversation {conversation_id}: {e}")
+        raise
+
+
+async def asave_conversation(
+    conversation_id: str, question: str, answer_data: dict, section: str, session_id: str = ""
+) -> None:
+    """
+    Save a conversation from async code.
+    """
+    try:
+        logger.info(f"Saving conversation {conversation_id}")
+        conversation = Conversation(**_conversation_fields(conversation_id, question, answer_data, section, session_id))
+        await sync_to_async(insert_rows)(Conversation, [conversation])
         logger.info(f"Conversation {conversation_id} saved successfully.")
     except DatabaseError as e:
         logger.error(f"Error saving conversation {conversation_id}: {e}")
@@ -42,21 +81,24 @@ def save_conversation(conversation_id: str, question: str, answer_data: dict, se
 
 def save_feedback(conversation_id: str, feedback_score: int) -> None:
     """
-    Save feedback for a conversation.
+    Save feedback for a conversation, through the write-behind buffer when it is enabled.
+
+    Raises ValueError if the conversation does not exist. Only its existence is checked;
+    the conversation itself is not loaded.
     """
     try:
         logger.info(f"Saving feedback for conversation {conversation_id}")
-        conversation = Conversation.objects.get(id=conversation_id)
-        feedback = Feedback.objects.create(
-            conversation=conversation,
-            feedback=feedback_score,
-            timestamp=timezone.now()
-        )
-        feedback.save()
+        if not Conversation.objects.filter(id=conversation_id).exists():
+            logger.error(f"Conversation ID {conversation_id} does not exist.")
+            raise ValueError(f"Conversation ID {conversation_id} does not exist.")
+        feedback = new_feedback(conversation_id, feedback_score)
+        if WRITE_BUFFER_ENABLED:
+            write_buffer.add_feedback(feedback)
+        else:
+            insert_rows(Feedback, [feedback])
         logger.info(f"Feedback for conversation {conversation_id} saved successfully.")
-    except Conversation.DoesNotExist:
-        logger.error(f"Conversation ID {conversation_id} does not exist.")
-        raise ValueError(f"Conversation ID {conversation_id} does not exist.")
+    except ValueError:
+        raise
     except DatabaseError as e:
         logger.error(f"Error saving feedback for conversation {conversation_id}: {e}")
         raise
@@ -65,34 +107,111 @@ def save_feedback(conversation_id: str, feedback_score: int) -> None:
         raise
 
 
-def get_recent_conversations(limit: int = 5, relevance: str = None):
+def flush_conversation(conversation_id: str) -> None:
+    """
+    Make sure feedback buffered in this process for the conversation has reached the database before reading it.
+    """
+    write_buffer.flush_conversation(conversation_id)
+
+
+def get_session_history(session_id: str, limit: int = HISTORY_MAX_TURNS) -> List[Turn]:
     """
-    Retrieve recent conversations from the database.
+    The last `limit` (question, answer) turns of a session, oldest first.
     """
     try:
-        logger.info(f"Fetching recent conversations with relevance: {relevance}")
-        if relevance:
-            conversations = Conversation.objects.filter(relevance=relevance).order_by('-timestamp')[:limit]
-        else:
-            conversations = Conversation.objects.all().order_by('-timestamp')[:limit]
-        logger.info(f"Fetched {len(conversations)} conversations.")
-        return conversations
+        recent = list(
+            Conversation.objects.filter(session_id=session_id)
+            .order_by('-timestamp', '-id')
+            .only('id', 'question', 'answer', 'timestamp')[:limit]
+        )
+        return [(conversation.question, conversation.answer) for conversation in reversed(recent)]
     except DatabaseError as e:
-        logger.error(f"Error fetching recent conversations: {e}")
+        logger.error(f"Error fetching history for session {session_id}: {e}")
         raise
-    except Exception as e:
-        logger.exception(f"Unexpected error while fetching recent conversations: {e}")
+
+
+async def aget_session_history(session_id: str, limit: int = HISTORY_MAX_TURNS) -> List[Turn]:
+    """
+    Fetch a session's history from async code.
+    """
+    return await sync_to_async(get_session_history)(session_id, limit)
+
+
+def encode_cursor(conversation: Conversation) -> str:
+    """
+    Opaque cursor pointing just after a conversation in newest-first order.
+    """
+    payload = json.dumps([conversation.timestamp.isoformat(), conversation.id])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Decode a cursor from encode_cursor, raising ValueError if it is malformed.
+    """
+    try:
+        timestamp, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(timestamp), str(conversation_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def get_conversations_page(
+    limit: int = 20,
+    relevance: Optional[str] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None,
+    session_id: Optional[str] = None,
+) -> Tuple[List[Conversation], Optional[str]]:
+    """
+    Fetch a page of conversations, newest first, using keyset pagination on (timestamp, id).
+
+    `fields` limits the columns loaded; `feedback` adds the conversation's feedback.
+    `session_id` limits the page to one chat session's turns.
+    Returns the page and the cursor for the next one, or None on the last page.
+    """
+    try:
+        logger.info(f"Fetching conversations page with relevance: {relevance}, limit: {limit}")
+        conversations = Conversation.objects.order_by('-timestamp', '-id')
+        if relevance:
+            conversations = conversations.filter(relevance=relevance)
+        if session_id:
+            conversations = conversations.filter(session_id=session_id)
+        if cursor:
+            timestamp, conversation_id = decode_cursor(cursor)
+            # Written as a range on timestamp so the (timestamp, id) indexes can be scanned from the cursor
+            conversations = conversations.filter(timestamp__lte=timestamp).exclude(
+                timestamp=timestamp, id__gte=conversation_id
+            )
+        if fields:
+            columns = {field for field in fields if field != 'feedback'} | {'id', 'timestamp'}
+            conversations = conversations.only(*columns)
+        if not fields or 'feedback' in fields:
+            conversations = conversations.prefetch_related('feedback')
+
+        page = list(conversations[:limit + 1])
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        logger.info(f"Fetched {min(len(page), limit)} conversations.")
+        return page[:limit], next_cursor
+    except DatabaseError as e:
+        logger.error(f"Error fetching conversations page: {e}")
         raise
 
 
 def get_feedback_stats():
     """
-    Get statistics of feedback from the database.
+    Get statistics of feedback from the hourly feedback rollup.
     """
     try:
         logger.info("Fetching feedback stats")
-        thumbs_up = Feedback.objects.filter(feedback=1).count()
-        thumbs_down = Feedback.objects.filter(feedback=-1).count()
+        counts = dict(
+            FeedbackRollup.objects.filter(feedback__in=[1, -1])
+            .values_list("feedback")
+            .annotate(total=Sum("count"))
+            .order_by()
+        )
+        thumbs_up = counts.get(1, 0)
+        thumbs_down = counts.get(-1, 0)
         logger.info(f"Feedback stats fetched: {thumbs_up} thumbs up, {thumbs_down} thumbs down.")
         return {
             "thumbs_up": thumbs_up,
@@ -112,15 +231,45 @@ def clear_conversation(conversation_id: str) -> None:
     """
     try:
         logger.info(f"Clearing conversation {conversation_id}")
-        conversation = Conversation.objects.get(id=conversation_id)
-        conversation.delete()
+        discarded = write_buffer.discard(conversation_id)
+        with transaction.atomic():
+            conversation = Conversation.objects.select_for_update().filter(id=conversation_id).first()
+            deleted = 0
+            if conversation is not None:
+                record_conversations([conversation], sign=-1)
+                record_feedback(conversation.feedback.all(), sign=-1)
+                deleted, _ = Conversation.objects.filter(id=conversation_id).delete()
+        if not deleted:
+            if discarded:
+                logger.warning(f"Dropped buffered feedback for conversation {conversation_id}, which was not stored.")
+            logger.error(f"Conversation ID {conversation_id} does not exist.")
+            raise ValueError(f"Conversation ID {conversation_id} does not exist.")
         logger.info(f"Conversation {conversation_id} cleared successfully.")
-    except Conversation.DoesNotExist:
-        logger.error(f"Conversation ID {conversation_id} does not exist.")
-        raise ValueError(f"Conversation ID {conversation_id} does not exist.")
+    except ValueError:
+        raise
     except DatabaseError as e:
         logger.error(f"Error clearing conversation {conversation_id}: {e}")
         raise
     except Exception as e:
         logger.exception(f"Unexpected error while clearing conversation {conversation_id}: {e}")
         raise
+
+
+def clear_session(session_id: str) -> int:
+    """
+    Clear every turn of a chat session. Returns the number of turns cleared.
+    """
+    logger.info(f"Clearing session {session_id}")
+    conversation_ids = set(Conversation.objects.filter(session_id=session_id).values_list('id', flat=True))
+    cleared = 0
+    for conversation_id in conversation_ids:
+        try:
+            clear_conversation(conversation_id)
+            cleared += 1
+        except ValueError:
+            # Cleared concurrently
+            continue
+    if not cleared:
+        raise ValueError(f"Session {session_id} has no conversations.")
+    logger.info(f"Cleared {cleared} turns of session {session_id}.")
+    return cleared
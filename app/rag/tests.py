@@ -1,3 +1,1551 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
 
-# Create your tests here.
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+import numpy as np
+
+from django.db import DatabaseError, IntegrityError
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from .async_raglogic import _loop_clients, aclose_loop_clients, acondense_query, aget_answer, loop_client
+from .batch import answer_batch
+from .batching import EmbeddingBatcher
+from .cache import SemanticCache
+from .context import (
+    PROMPT_CONTEXT_BUDGET,
+    PROMPT_PASSAGE_MAX_TOKENS,
+    PROMPT_PASSAGE_MIN_TOKENS,
+    assemble_context,
+    context_budget,
+    deduplicate,
+    format_passage,
+)
+from .embedding_store import EmbeddingStore
+from .encoders import (
+    BACKEND_ONNX,
+    BACKEND_SENTENCE_TRANSFORMERS,
+    MODEL_FILE,
+    QUANTIZED_MODEL_FILE,
+    default_onnx_dir,
+    load_encoder,
+)
+from .evaluation import EvaluationQueue, _split_tokens, schedule_evaluation
+from .history import HISTORY_MAX_TURNS, HISTORY_TURN_MAX_TOKENS, format_turn, parse_condensed, select_history
+from .models import Conversation, ConversationRollup, Feedback, FeedbackRollup
+from .persistence import WriteBehindBuffer, insert_rows, new_feedback, update_stored_conversation
+from .raglogic import (
+    FAQS_PATH,
+    MODEL_NAME,
+    NO_TOKENS,
+    ONNX_MODEL_DIR,
+    RELEVANCE_NOT_EVALUATED,
+    RELEVANCE_PENDING,
+    RELEVANCE_UNKNOWN,
+    calculate_openai_cost,
+    condense_query,
+    encode_corpus,
+    encode_texts,
+    reciprocal_rank_fusion,
+)
+from .rollups import _increment, hour_bucket, move_relevance, rebuild_rollups
+from .retention import archive_old_conversations, read_archive
+from .retrieval import BM25Field, InMemoryRetriever, _top_k, tokenize
+from .services import decode_cursor, encode_cursor, get_conversations_page
+from .tokens import count_tokens, truncate_tokens
+
+ONNX_DIR = default_onnx_dir(ONNX_MODEL_DIR, MODEL_NAME)
+GROUND_TRUTH_PATH = os.path.join(os.path.dirname(FAQS_PATH), "ground-truth-data.csv")
+
+
+def _unit(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _parity_texts(limit: int = 500):
+    """
+    FAQ documents plus ground-truth questions, the texts the API actually embeds.
+    """
+    with open(FAQS_PATH, "r") as f:
+        faqs = [faq for faq in json.load(f) if faq.get("question")]
+    questions = []
+    if os.path.exists(GROUND_TRUTH_PATH):
+        with open(GROUND_TRUTH_PATH, newline="") as f:
+            questions = [row["question"] for row in csv.DictReader(f) if row.get("question")]
+    documents = [faq["question"] for faq in faqs] + [faq["question"] + " " + faq["answer"] for faq in faqs]
+    return documents, (questions or [faq["question"] for faq in faqs])[:limit]
+
+
+@unittest.skipUnless(os.path.exists(os.path.join(ONNX_DIR, MODEL_FILE)), "exported ONNX model not found")
+@unittest.skipUnless(os.path.exists(FAQS_PATH), "FAQ data not found")
+class OnnxParityTests(SimpleTestCase):
+    """
+    The exported ONNX encoders must embed like the SentenceTransformer model they replace.
+    Export the model with `python scripts/onnx_encoder.py export` to run these.
+    """
+
+    MIN_MEAN_COSINE = 0.99
+    MIN_COSINE = 0.95
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.documents, cls.queries = _parity_texts()
+        reference = load_encoder(MODEL_NAME, BACKEND_SENTENCE_TRANSFORMERS, ONNX_DIR, False)
+        cls.reference_docs = _unit(reference.encode(cls.documents, batch_size=64))
+        cls.reference_queries = _unit(reference.encode(cls.queries, batch_size=64))
+        cls.reference_top = np.argsort(-(cls.reference_queries @ cls.reference_docs.T), axis=1)[:, :5]
+
+    def assert_parity(self, quantized: bool):
+        encoder = load_encoder(MODEL_NAME, BACKEND_ONNX, ONNX_DIR, quantized)
+        docs = _unit(encoder.encode(self.documents, batch_size=64))
+        queries = _unit(encoder.encode(self.queries, batch_size=64))
+        cosines = np.concatenate([(docs * self.reference_docs).sum(axis=1), (queries * self.reference_queries).sum(axis=1)])
+        self.assertGreaterEqual(cosines.mean(), self.MIN_MEAN_COSINE)
+        self.assertGreaterEqual(cosines.min(), self.MIN_COSINE)
+
+        top = np.argsort(-(queries @ docs.T), axis=1)[:, :5]
+        overlap = np.mean([len(set(a) & set(b)) / 5 for a, b in zip(top, self.reference_top)])
+        self.assertGreaterEqual(overlap, 0.9)
+
+    def test_fp32_matches_sentence_transformers(self):
+        self.assert_parity(quantized=False)
+
+    @unittest.skipUnless(os.path.exists(os.path.join(ONNX_DIR, QUANTIZED_MODEL_FILE)), "quantized model not found")
+    def test_int8_matches_sentence_transformers(self):
+        self.assert_parity(quantized=True)
+
+
+FAQ_HIT = {"id": "a1b2c3d4", "section": "Registration", "question": "What is a TIN?", "answer": "A Tax Identification Number."}
+
+
+def _stream_tokens(*tokens, fail=False):
+    def fake_llm_stream(prompt, model_choice):
+        for token in tokens:
+            yield "token", token
+        if fail:
+            raise RuntimeError("connection reset")
+        usage = {"prompt_tokens": 120, "completion_tokens": len(tokens), "total_tokens": 120 + len(tokens)}
+        yield "done", ("".join(tokens), usage, 0.5)
+    return fake_llm_stream
+
+
+def _parse_sse(body: str):
+    events = []
+    for frame in body.split("\n\n"):
+        if not frame:
+            continue
+        event_line, data_line = frame.split("\n")
+        events.append((event_line[len("event: "):], json.loads(data_line[len("data: "):])))
+    return events
+
+
+@mock.patch("rag.views.schedule_evaluation")
+@mock.patch("rag.raglogic.use_answer_cache", return_value=False)
+@mock.patch("rag.raglogic.retrieve", return_value=([FAQ_HIT], {"search": 0.01}))
+@mock.patch("rag.raglogic.encode_query", return_value=[0.0] * 384)
+class ChatStreamViewTests(TestCase):
+    """
+    SSE framing and persistence of /chats/stream/, with retrieval and the model mocked out.
+    """
+
+    def post(self, message="What is a TIN?"):
+        response = self.client.post(
+            reverse("chat_stream"), {"message": message, "model_choice": "openai/gpt-3.5-turbo"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode()
+        self.assertTrue(body.endswith("\n\n"))
+        return _parse_sse(body)
+
+    def test_frames_retrieval_tokens_then_done(self, *mocks):
+        with mock.patch("rag.raglogic.llm_stream", _stream_tokens("A TIN ", "is a ", "number.")):
+            events = self.post()
+
+        self.assertEqual([event for event, _ in events], ["retrieval", "token", "token", "token", "done"])
+        retrieval = events[0][1]
+        self.assertEqual(retrieval["results"], [{"id": "a1b2c3d4", "section": "Registration", "question": "What is a TIN?"}])
+        self.assertEqual("".join(data["text"] for event, data in events if event == "token"), "A TIN is a number.")
+        done = events[-1][1]
+        self.assertEqual(done["conversation_id"], retrieval["conversation_id"])
+        self.assertEqual(done["session_id"], retrieval["session_id"])
+
+    def test_done_event_carries_usage_and_metadata(self, *mocks):
+        with mock.patch("rag.raglogic.llm_stream", _stream_tokens("A TIN ", "is a ", "number.")):
+            done = self.post()[-1][1]
+
+        expected_cost = calculate_openai_cost(
+            "openai/gpt-3.5-turbo", {"prompt_tokens": 120, "completion_tokens": 3, "total_tokens": 123}
+        )
+        self.assertAlmostEqual(done["cost"], expected_cost)
+        self.assertEqual(done["response_time"], 0.5)
+        self.assertEqual(done["retrieval_latency"], {"search": 0.01})
+        self.assertEqual(done["search_query"], "What is a TIN?")
+        self.assertIn(done["relevance"], (RELEVANCE_PENDING, RELEVANCE_NOT_EVALUATED))
+        for stage in ("history", "retrieve", "prompt", "generate", "save"):
+            self.assertIn(stage, done["stage_latency"])
+        self.assertGreaterEqual(done["elapsed_time"], 0)
+
+    def test_saves_conversation_once_stream_completes(self, *mocks):
+        schedule_evaluation_mock = mocks[-1]
+        with mock.patch("rag.raglogic.llm_stream", _stream_tokens("A TIN ", "is a ", "number.")):
+            done = self.post()[-1][1]
+
+        conversation = Conversation.objects.get(id=done["conversation_id"])
+        self.assertEqual(conversation.session_id, done["session_id"])
+        self.assertEqual(conversation.question, "What is a TIN?")
+        self.assertEqual(conversation.answer, "A TIN is a number.")
+        self.assertEqual((conversation.prompt_tokens, conversation.completion_tokens, conversation.total_tokens), (120, 3, 123))
+        self.assertAlmostEqual(conversation.openai_cost, done["cost"])
+        schedule_evaluation_mock.assert_called_once()
+        self.assertEqual(schedule_evaluation_mock.call_args.args[0], done["conversation_id"])
+
+    def test_error_mid_stream_ends_with_error_event(self, *mocks):
+        schedule_evaluation_mock = mocks[-1]
+        with mock.patch("rag.raglogic.llm_stream", _stream_tokens("A TIN ", fail=True)):
+            events = self.post()
+
+        self.assertEqual([event for event, _ in events], ["retrieval", "token", "error"])
+        self.assertEqual(events[-1][1], {"error": "An error occurred while processing your request."})
+        self.assertFalse(Conversation.objects.exists())
+        schedule_evaluation_mock.assert_not_called()
+
+
+def _vector(*components):
+    return list(components) + [0.0] * (4 - len(components))
+
+
+class SemanticCacheTests(SimpleTestCase):
+    """
+    Exact and semantic lookups, LRU eviction, expiry and invalidation of the answer cache.
+    """
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("rag.cache.time")
+        patcher.start().time.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+
+    def test_exact_hit_after_normalizing_query(self):
+        cache = SemanticCache()
+        cache.store("What is a TIN?", "openai/gpt-4o", "Text", {"answer": "A number."})
+        self.assertEqual(cache.lookup("  what is a   TIN ", "openai/gpt-4o", "Text"), {"answer": "A number."})
+        self.assertIsNone(cache.lookup("What is a TIN?", "openai/gpt-3.5-turbo", "Text"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = SemanticCache(max_entries=2)
+        cache.store("first", "m", "Text", {"answer": 1})
+        cache.store("second", "m", "Text", {"answer": 2})
+        cache.lookup("first", "m", "Text")
+        cache.store("third", "m", "Text", {"answer": 3})
+
+        self.assertIsNone(cache.lookup("second", "m", "Text"))
+        self.assertEqual(cache.lookup("first", "m", "Text"), {"answer": 1})
+        self.assertEqual(cache.lookup("third", "m", "Text"), {"answer": 3})
+        self.assertEqual(cache.evictions, 1)
+
+    def test_evicted_rows_are_reused_for_semantic_lookups(self):
+        cache = SemanticCache(max_entries=2, similarity_threshold=0.9)
+        cache.store("first", "m", "Text", {"answer": 1}, _vector(1.0))
+        cache.store("second", "m", "Text", {"answer": 2}, _vector(0.0, 1.0))
+        cache.store("third", "m", "Text", {"answer": 3}, _vector(0.0, 0.0, 1.0))
+
+        self.assertIsNone(cache.lookup("near first", "m", "Text", _vector(1.0, 0.05)))
+        self.assertEqual(cache.lookup("near third", "m", "Text", _vector(0.05, 0.0, 1.0)), {"answer": 3})
+
+    def test_entries_expire_after_ttl(self):
+        cache = SemanticCache(ttl=60, similarity_threshold=0.9)
+        cache.store("What is a TIN?", "m", "Text", {"answer": "A number."}, _vector(1.0))
+
+        self.now += 59
+        self.assertIsNotNone(cache.lookup("What is a TIN?", "m", "Text"))
+        self.now += 1
+        self.assertIsNone(cache.lookup("What is a TIN?", "m", "Text"))
+        self.assertIsNone(cache.lookup("Define TIN", "m", "Text", _vector(1.0, 0.01)))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_expired_entries_are_swept(self):
+        cache = SemanticCache(ttl=10, sweep_interval=30)
+        cache.store("first", "m", "Text", {"answer": 1})
+        self.now += 20
+        cache.store("second", "m", "Text", {"answer": 2})
+
+        self.now += 15
+        cache.lookup("unrelated", "m", "Text")
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_semantic_hit_requires_similarity_threshold(self):
+        cache = SemanticCache(similarity_threshold=0.95)
+        cache.store("What is a TIN?", "m", "Text", {"answer": "A number."}, _vector(1.0, 0.0))
+
+        # cos = 0.995 and 0.8
+        self.assertEqual(cache.lookup("What's a TIN", "m", "Text", _vector(1.0, 0.1)), {"answer": "A number."})
+        self.assertIsNone(cache.lookup("How do I pay PAYE?", "m", "Text", _vector(0.8, 0.6)))
+        self.assertEqual((cache.semantic_hits, cache.misses), (1, 1))
+
+    def test_semantic_hit_stays_within_model_and_search_type(self):
+        cache = SemanticCache(similarity_threshold=0.9)
+        cache.store("What is a TIN?", "m", "Text", {"answer": "A number."}, _vector(1.0))
+
+        self.assertIsNone(cache.lookup("What's a TIN", "other", "Text", _vector(1.0)))
+        self.assertIsNone(cache.lookup("What's a TIN", "m", "Vector", _vector(1.0)))
+
+    def test_index_version_change_drops_everything(self):
+        version = {"value": "v1"}
+        cache = SemanticCache(version_fn=lambda: version["value"], version_check_interval=0, similarity_threshold=0.9)
+        cache.lookup("warm up", "m", "Text")
+        cache.store("What is a TIN?", "m", "Text", {"answer": "A number."}, _vector(1.0))
+        self.assertIsNotNone(cache.lookup("What is a TIN?", "m", "Text"))
+
+        version["value"] = "v2"
+        self.assertIsNone(cache.lookup("What is a TIN?", "m", "Text"))
+        self.assertIsNone(cache.lookup("What's a TIN", "m", "Text", _vector(1.0)))
+        self.assertEqual(cache.stats()["index_version"], "v2")
+        self.assertEqual(cache.invalidations, 1)
+
+    def test_unchanged_or_unknown_index_version_keeps_entries(self):
+        versions = iter(["v1", "v1", None])
+        cache = SemanticCache(version_fn=lambda: next(versions), version_check_interval=0)
+        cache.lookup("warm up", "m", "Text")
+        cache.store("What is a TIN?", "m", "Text", {"answer": "A number."})
+
+        self.assertIsNotNone(cache.lookup("What is a TIN?", "m", "Text"))
+        self.assertIsNotNone(cache.lookup("What is a TIN?", "m", "Text"))
+        self.assertEqual(cache.invalidations, 0)
+
+
+def _faqs(*ids):
+    return [{"id": faq_id, "question": f"Question {faq_id}"} for faq_id in ids]
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+    """
+    Weighted reciprocal rank fusion of the keyword and KNN result lists.
+    """
+
+    def test_documents_in_both_lists_rank_first(self):
+        fused = reciprocal_rank_fusion({"text": _faqs("a", "b", "c"), "vector": _faqs("d", "c", "e")}, {}, k=5)
+        self.assertEqual([faq["id"] for faq in fused], ["c", "a", "d", "b", "e"])
+
+    def test_rank_constant_trades_top_rank_for_agreement(self):
+        rankings = {"text": _faqs("a", "x", "y", "b"), "vector": _faqs("z", "w", "v", "b")}
+        # a: 1/2 against b: 2/5 with a small constant, 1/61 against 2/64 with the default
+        self.assertEqual(reciprocal_rank_fusion(rankings, {}, k=1, rank_constant=1)[0]["id"], "a")
+        self.assertEqual(reciprocal_rank_fusion(rankings, {}, k=1, rank_constant=60)[0]["id"], "b")
+
+    def test_weights_favour_a_leg(self):
+        rankings = {"text": _faqs("a", "b"), "vector": _faqs("b", "a")}
+        self.assertEqual(reciprocal_rank_fusion(rankings, {"text": 2.0, "vector": 1.0}, k=1)[0]["id"], "a")
+        self.assertEqual(reciprocal_rank_fusion(rankings, {"text": 1.0, "vector": 2.0}, k=1)[0]["id"], "b")
+
+    def test_zero_weight_ignores_a_leg(self):
+        fused = reciprocal_rank_fusion({"text": _faqs("a", "b"), "vector": _faqs("c", "b")}, {"vector": 0.0}, k=2)
+        self.assertEqual([faq["id"] for faq in fused], ["a", "b"])
+
+    def test_truncates_to_k_and_keeps_first_seen_document(self):
+        text = [{"id": "a", "question": "Question a", "leg": "text"}]
+        vector = [{"id": "a", "question": "Question a", "leg": "vector"}] + _faqs("b", "c")
+        fused = reciprocal_rank_fusion({"text": text, "vector": vector}, {}, k=2)
+        self.assertEqual(len(fused), 2)
+        self.assertEqual(fused[0], text[0])
+
+    def test_falls_back_to_question_without_id(self):
+        rankings = {"text": [{"question": "What is a TIN?"}], "vector": [{"question": "Other"}, {"question": "What is a TIN?"}]}
+        fused = reciprocal_rank_fusion(rankings, {}, k=5)
+        self.assertEqual([faq["question"] for faq in fused], ["What is a TIN?", "Other"])
+
+    def test_empty_rankings(self):
+        self.assertEqual(reciprocal_rank_fusion({"text": [], "vector": []}, {}), [])
+
+
+BASE_TIME = datetime(2024, 10, 7, 19, 19, tzinfo=dt_timezone.utc)
+
+
+def _conversation_fields(**fields):
+    return {
+        "question": "What is a TIN?",
+        "answer": "A Tax Identification Number.",
+        "section": "URA FAQs",
+        "model_used": "openai/gpt-3.5-turbo",
+        "response_time": 1.0,
+        "relevance": "RELEVANT",
+        "relevance_explanation": "",
+        "prompt_tokens": 100,
+        "completion_tokens": 20,
+        "total_tokens": 120,
+        "eval_prompt_tokens": 0,
+        "eval_completion_tokens": 0,
+        "eval_total_tokens": 0,
+        "openai_cost": 0.001,
+        **fields,
+    }
+
+
+def _conversation(conversation_id, timestamp=BASE_TIME, **fields):
+    return Conversation.objects.create(id=conversation_id, timestamp=timestamp, **_conversation_fields(**fields))
+
+
+class ConversationCursorTests(SimpleTestCase):
+    """
+    Opaque cursors for keyset pagination.
+    """
+
+    def test_round_trip(self):
+        conversation = Conversation(id="abcd-1234", timestamp=BASE_TIME)
+        self.assertEqual(decode_cursor(encode_cursor(conversation)), (BASE_TIME, "abcd-1234"))
+
+    def test_cursor_is_url_safe(self):
+        conversation = Conversation(id="??>>~~", timestamp=BASE_TIME + timedelta(microseconds=123456))
+        cursor = encode_cursor(conversation)
+        self.assertRegex(cursor, r"^[A-Za-z0-9_=-]+$")
+        self.assertEqual(decode_cursor(cursor), (conversation.timestamp, "??>>~~"))
+
+    def test_malformed_cursor_raises_value_error(self):
+        def encoded(value):
+            return base64.urlsafe_b64encode(value.encode()).decode()
+
+        for cursor in ["not a cursor!", "é", encoded("not json"), encoded("5"), encoded('["2024-10-07T19:19:00", "a", "b"]'), encoded('["yesterday", "a"]')]:
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class ConversationPageTests(TestCase):
+    """
+    Keyset pagination over (timestamp, id), newest first.
+    """
+
+    def page_through(self, limit, **filters):
+        pages, cursor = [], None
+        while True:
+            page, cursor = get_conversations_page(limit=limit, cursor=cursor, **filters)
+            pages.append([conversation.id for conversation in page])
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_every_conversation_once(self):
+        for i in range(7):
+            _conversation(f"c{i}", BASE_TIME + timedelta(minutes=i))
+
+        self.assertEqual(self.page_through(3), [["c6", "c5", "c4"], ["c3", "c2", "c1"], ["c0"]])
+
+    def test_boundary_between_conversations_with_the_same_timestamp(self):
+        for conversation_id in ["a", "b", "c", "d"]:
+            _conversation(conversation_id)
+        _conversation("e", BASE_TIME + timedelta(seconds=1))
+        _conversation("z", BASE_TIME - timedelta(seconds=1))
+
+        # Ties on timestamp are broken by id, descending, so a page can end between them
+        self.assertEqual(self.page_through(2), [["e", "d"], ["c", "b"], ["a", "z"]])
+
+    def test_last_page_has_no_cursor(self):
+        for i in range(4):
+            _conversation(f"c{i}", BASE_TIME + timedelta(minutes=i))
+
+        page, cursor = get_conversations_page(limit=4)
+        self.assertEqual(len(page), 4)
+        self.assertIsNone(cursor)
+
+    def test_filters_apply_after_the_cursor(self):
+        for i in range(6):
+            _conversation(f"c{i}", BASE_TIME + timedelta(minutes=i), relevance="RELEVANT" if i % 2 else "NON_RELEVANT")
+
+        self.assertEqual(self.page_through(2, relevance="RELEVANT"), [["c5", "c3"], ["c1"]])
+
+    def test_view_rejects_malformed_cursor(self):
+        response = self.client.get(reverse("get_conversations"), {"cursor": "not a cursor!"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("cursor", response.json())
+
+
+class RollupTests(TestCase):
+    """
+    Hourly rollups stay in step with the conversations written and re-evaluated.
+    """
+
+    KEY = {"bucket": hour_bucket(BASE_TIME), "model_used": "openai/gpt-3.5-turbo", "relevance": "RELEVANT"}
+
+    def rollup(self, relevance="RELEVANT"):
+        return ConversationRollup.objects.filter(**{**self.KEY, "relevance": relevance}).first()
+
+    def test_increment_creates_missing_bucket(self):
+        _increment(ConversationRollup, self.KEY, {"conversations": 1, "openai_cost_sum": 0.5})
+        rollup = self.rollup()
+        self.assertEqual((rollup.conversations, rollup.openai_cost_sum, rollup.total_tokens_sum), (1, 0.5, 0))
+
+    def test_increment_adds_to_existing_bucket(self):
+        _increment(ConversationRollup, self.KEY, {"conversations": 1, "total_tokens_sum": 100})
+        _increment(ConversationRollup, self.KEY, {"conversations": 2, "total_tokens_sum": 50})
+        _increment(ConversationRollup, self.KEY, {"conversations": -1, "total_tokens_sum": -20})
+        rollup = self.rollup()
+        self.assertEqual((rollup.conversations, rollup.total_tokens_sum), (2, 130))
+        self.assertEqual(ConversationRollup.objects.count(), 1)
+
+    def test_increment_retries_update_when_another_writer_creates_the_bucket(self):
+        ConversationRollup.objects.create(**self.KEY, conversations=3)
+        update = QuerySet.update
+        calls = []
+
+        def update_missing_first(queryset, **kwargs):
+            # The first update runs before the other writer's row is visible
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", autospec=True, side_effect=update_missing_first):
+            _increment(ConversationRollup, self.KEY, {"conversations": 1})
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.rollup().conversations, 4)
+        self.assertEqual(ConversationRollup.objects.count(), 1)
+
+    def test_insert_rows_records_conversations_in_their_hour(self):
+        insert_rows(Conversation, [
+            Conversation(id="a", timestamp=BASE_TIME - timedelta(minutes=15), **_conversation_fields(total_tokens=100)),
+            Conversation(id="b", timestamp=BASE_TIME + timedelta(minutes=40), **_conversation_fields(total_tokens=50)),
+            Conversation(id="c", timestamp=BASE_TIME + timedelta(hours=1), **_conversation_fields(total_tokens=10)),
+        ])
+        self.assertEqual((self.rollup().conversations, self.rollup().total_tokens_sum), (2, 150))
+        self.assertEqual(ConversationRollup.objects.get(bucket=hour_bucket(BASE_TIME) + timedelta(hours=1)).conversations, 1)
+
+    def test_move_relevance_moves_totals_between_buckets(self):
+        conversation = Conversation(id="a", timestamp=BASE_TIME, **_conversation_fields(relevance=RELEVANCE_PENDING))
+        insert_rows(Conversation, [conversation])
+
+        move_relevance(conversation, "RELEVANT")
+
+        self.assertEqual(conversation.relevance, "RELEVANT")
+        pending, relevant = self.rollup(RELEVANCE_PENDING), self.rollup("RELEVANT")
+        self.assertEqual((pending.conversations, pending.total_tokens_sum, pending.openai_cost_sum), (0, 0, 0.0))
+        self.assertEqual((relevant.conversations, relevant.total_tokens_sum), (1, 120))
+        self.assertAlmostEqual(relevant.response_time_sum, 1.0)
+
+    def test_move_relevance_to_same_label_is_a_no_op(self):
+        conversation = Conversation(id="a", timestamp=BASE_TIME, **_conversation_fields())
+        insert_rows(Conversation, [conversation])
+
+        with mock.patch("rag.rollups._increment") as increment:
+            move_relevance(conversation, "RELEVANT")
+        increment.assert_not_called()
+
+    def test_update_stored_conversation_matches_rebuilt_rollups(self):
+        insert_rows(Conversation, [
+            Conversation(id=f"c{i}", timestamp=BASE_TIME + timedelta(minutes=i), **_conversation_fields(relevance=RELEVANCE_PENDING))
+            for i in range(3)
+        ])
+        update_stored_conversation("c0", relevance="RELEVANT", relevance_explanation="On topic.")
+        update_stored_conversation("c1", relevance="NON_RELEVANT", relevance_explanation="Off topic.")
+        self.assertEqual(update_stored_conversation("missing", relevance="RELEVANT"), 0)
+
+        incremental = self.totals()
+        rebuild_rollups()
+        self.assertEqual(self.totals(), incremental)
+        self.assertEqual(incremental[RELEVANCE_PENDING], 1)
+
+    def totals(self):
+        return {
+            rollup.relevance: rollup.conversations
+            for rollup in ConversationRollup.objects.exclude(conversations=0)
+        }
+
+
+class TruncateTokensTests(SimpleTestCase):
+    """
+    Truncated texts, suffix included, stay within their token budget.
+    """
+
+    TEXT = "The Uganda Revenue Authority issues a Tax Identification Number to every registered taxpayer. " * 20
+
+    def test_short_text_is_unchanged(self):
+        self.assertEqual(truncate_tokens("What is a TIN?", 50), "What is a TIN?")
+
+    def test_suffix_counts_towards_the_budget(self):
+        for max_tokens in (2, 3, 5, 10, 50, 200):
+            with self.subTest(max_tokens=max_tokens):
+                truncated = truncate_tokens(self.TEXT, max_tokens)
+                self.assertTrue(truncated.endswith("..."))
+                self.assertLessEqual(count_tokens(truncated), max_tokens)
+
+    def test_budget_too_small_for_suffix_drops_it(self):
+        truncated = truncate_tokens(self.TEXT, 1)
+        self.assertFalse(truncated.endswith("..."))
+        self.assertLessEqual(count_tokens(truncated), 1)
+        self.assertEqual(truncate_tokens(self.TEXT, 0), "")
+
+
+class EmbeddingBatcherTests(SimpleTestCase):
+    """
+    Micro-batching of embedding requests on the batcher's single worker thread.
+    """
+
+    def setUp(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        self.release.wait(5)
+        return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+
+    def batcher(self, encode_fn=None, **kwargs):
+        batcher = EmbeddingBatcher(encode_fn or self.encode, max_wait=0.05, **kwargs)
+        self.addCleanup(batcher.shutdown, 1.0)
+        return batcher
+
+    def test_concurrent_texts_share_a_batch(self):
+        batcher = self.batcher()
+        futures = [batcher.submit(text) for text in ["a", "bb", "a"]]
+        self.assertEqual([future.result(5)[0] for future in futures], [1.0, 2.0, 1.0])
+        self.assertEqual(self.calls, [["a", "bb"]])
+        self.assertEqual(batcher.stats()["items"], 3)
+
+    def test_cancelled_future_does_not_stop_the_batch(self):
+        batcher = self.batcher()
+        self.release.clear()
+        first = batcher.submit("first")
+        while not self.calls:
+            time.sleep(0.001)
+        # Queued behind the running batch; one caller gives up, as a cancelled async request does
+        waiting = [batcher.submit(text) for text in ["b", "cc", "ddd"]]
+        self.assertTrue(waiting[1].cancel())
+        self.release.set()
+
+        self.assertEqual(first.result(5)[0], 5.0)
+        self.assertEqual(waiting[0].result(5)[0], 1.0)
+        self.assertEqual(waiting[2].result(5)[0], 3.0)
+        self.assertTrue(waiting[1].cancelled())
+        self.assertEqual(self.calls[1], ["b", "ddd"])
+        self.assertEqual(batcher.encode("later", timeout=5)[0], 5.0)
+
+    def test_encoder_error_fails_the_batch_only(self):
+        failures = iter([RuntimeError("model crashed")])
+
+        def encode(texts):
+            error = next(failures, None)
+            if error is not None:
+                raise error
+            return self.encode(texts)
+
+        batcher = self.batcher(encode)
+        with self.assertRaises(RuntimeError):
+            batcher.submit("a").result(5)
+        self.assertEqual(batcher.encode("bb", timeout=5)[0], 2.0)
+        self.assertEqual(batcher.stats()["errors"], 1)
+
+    def test_unexpected_failure_keeps_the_worker_alive(self):
+        # Too few vectors for the batch fails it outside the encoder call
+        batcher = self.batcher(lambda texts: np.zeros((0, 1), dtype=np.float32))
+        with self.assertRaises(KeyError):
+            batcher.submit("a").result(5)
+
+        batcher.encode_fn = self.encode
+        self.assertEqual(batcher.encode("bb", timeout=5)[0], 2.0)
+
+    def test_rejects_work_after_shutdown(self):
+        batcher = self.batcher()
+        batcher.shutdown()
+        with self.assertRaises(RuntimeError):
+            batcher.submit("a").result(1)
+
+
+class EmbeddingStoreTests(SimpleTestCase):
+    """
+    Storing, reading back and sharing vectors through the on-disk embedding store.
+    """
+
+    DIM = 4
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.encoded = []
+
+    def store(self):
+        return EmbeddingStore(self.directory, "test-model", dim=self.DIM)
+
+    def encode(self, texts):
+        self.encoded.append(list(texts))
+        return np.array([[len(text), 0, 0, 1] for text in texts], dtype=np.float32)
+
+    def test_put_then_get(self):
+        store = self.store()
+        store.put_many(["a", "bb"], self.encode(["a", "bb"]))
+        vectors = store.get_many(["bb", "missing", "a"])
+        self.assertEqual(vectors[0].tolist(), [2, 0, 0, 1])
+        self.assertIsNone(vectors[1])
+        self.assertEqual(vectors[2].tolist(), [1, 0, 0, 1])
+        self.assertEqual(len(store), 2)
+
+    def test_put_skips_stored_and_repeated_texts(self):
+        store = self.store()
+        store.put_many(["a"], self.encode(["a"]))
+        store.put_many(["a", "bb", "bb"], np.ones((3, self.DIM), dtype=np.float32))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get("a").tolist(), [1, 0, 0, 1])
+        self.assertEqual(os.path.getsize(store.keys_path), 2 * 16)
+
+    def test_encode_only_encodes_missing_texts(self):
+        store = self.store()
+        store.encode(["a", "bb"], self.encode)
+        vectors = store.encode(["bb", "ccc", "a"], self.encode)
+        self.assertEqual(self.encoded, [["a", "bb"], ["ccc"]])
+        self.assertEqual(vectors[:, 0].tolist(), [2, 3, 1])
+
+    def test_encode_without_persist_leaves_store_unchanged(self):
+        store = self.store()
+        store.encode(["a"], self.encode)
+        vectors = store.encode(["a", "what is a tin"], self.encode, persist=False)
+        self.assertEqual(vectors[:, 0].tolist(), [1, 13])
+        self.assertEqual(len(store), 1)
+        self.assertIsNone(self.store().get("what is a tin"))
+
+    def test_reload_sees_rows_appended_by_another_process(self):
+        reader, writer = self.store(), self.store()
+        self.assertIsNone(reader.get("a"))
+        writer.put_many(["a"], self.encode(["a"]))
+        self.assertEqual(reader.get("a").tolist(), [1, 0, 0, 1])
+
+        # Later appends are read from the last known offset, not from the start
+        writer.put_many(["bb", "ccc"], self.encode(["bb", "ccc"]))
+        with mock.patch("rag.embedding_store.np.fromfile", wraps=np.fromfile) as fromfile:
+            self.assertEqual(reader.get("ccc").tolist(), [3, 0, 0, 1])
+        fromfile.assert_called_once()
+        self.assertEqual((fromfile.call_args.kwargs["count"], fromfile.call_args.kwargs["offset"]), (2, 16))
+        self.assertEqual(len(reader), 3)
+
+    def test_unchanged_store_is_not_reread_on_miss(self):
+        store = self.store()
+        store.put_many(["a"], self.encode(["a"]))
+        with mock.patch("rag.embedding_store.np.fromfile") as fromfile:
+            self.assertIsNone(store.get("missing"))
+        fromfile.assert_not_called()
+
+    def test_incomplete_append_is_ignored_and_overwritten(self):
+        store = self.store()
+        store.put_many(["a"], self.encode(["a"]))
+        # Vectors of an append interrupted before its keys were written
+        with open(store.vectors_path, "ab") as vectors_file:
+            vectors_file.write(np.full(self.DIM, 9, dtype=np.float32).tobytes())
+
+        fresh = self.store()
+        self.assertEqual(len(fresh), 1)
+        fresh.put_many(["bb"], self.encode(["bb"]))
+        self.assertEqual(self.store().get("bb").tolist(), [2, 0, 0, 1])
+        self.assertEqual(os.path.getsize(store.vectors_path), 2 * self.DIM * 4)
+
+    def test_query_embeddings_are_not_stored(self):
+        store = self.store()
+        model = mock.Mock(encode=self.encode)
+        with mock.patch("rag.raglogic.get_model", return_value=model), \
+                mock.patch("rag.raglogic.get_embedding_store", return_value=store):
+            encode_corpus(["What is a TIN?"])
+            encode_texts(["what is a tin", "What is a TIN?"])
+        self.assertEqual(self.encoded, [["What is a TIN?"], ["what is a tin"]])
+        self.assertEqual(len(store), 1)
+
+
+RETRIEVER_FAQS = [
+    {"id": "tin", "section": "Registration", "question": "What is a TIN?", "answer": "A Tax Identification Number issued to every taxpayer."},
+    {"id": "paye", "section": "Employment", "question": "How do I pay PAYE?", "answer": "Employers pay PAYE monthly through the web portal."},
+    {"id": "customs", "section": "Customs", "question": "How do I clear imported goods?", "answer": "Lodge a customs declaration and pay the import duty."},
+    {"id": "stamp", "section": "Stamp duty", "question": "Who pays stamp duty?", "answer": "The buyer pays stamp duty on a transfer."},
+]
+
+# Unit vectors along distinct axes, one per FAQ, shared by every vector field
+RETRIEVER_AXES = {faq["id"]: axis for axis, faq in enumerate(RETRIEVER_FAQS)}
+
+
+def _axis_encode(texts):
+    vectors = np.zeros((len(texts), 8), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for faq in RETRIEVER_FAQS:
+            if text.startswith(faq["question"]) or text == faq["answer"]:
+                vectors[row, RETRIEVER_AXES[faq["id"]]] = 1.0
+                break
+        else:
+            vectors[row, 7] = 1.0
+    return vectors
+
+
+def _axis_vector(*weights):
+    return list(weights) + [0.0] * (8 - len(weights))
+
+
+class BM25FieldTests(SimpleTestCase):
+    """
+    BM25 scoring of a single text field.
+    """
+
+    def test_rare_terms_outweigh_common_ones(self):
+        field = BM25Field(["tax return", "tax refund", "tax clearance"])
+        scores = field.scores(["tax", "refund"])
+        self.assertEqual(int(np.argmax(scores)), 1)
+        self.assertGreater(field.scores(["refund"])[1], field.scores(["tax"])[1])
+
+    def test_repeated_terms_and_shorter_documents_score_higher(self):
+        field = BM25Field(["duty duty", "duty", "duty on imported goods and services"])
+        scores = field.scores(["duty"])
+        self.assertGreater(scores[0], scores[1])
+        self.assertGreater(scores[1], scores[2])
+
+    def test_unknown_terms_and_empty_documents_score_zero(self):
+        field = BM25Field(["tax return", None, ""])
+        self.assertEqual(field.scores(["vat"]).tolist(), [0.0, 0.0, 0.0])
+        self.assertEqual(field.scores(["tax"])[1:].tolist(), [0.0, 0.0])
+
+    def test_tokenizer_matches_case_and_punctuation_insensitively(self):
+        self.assertEqual(tokenize("What is a TIN? (e-Tax)"), ["what", "is", "a", "tin", "e", "tax"])
+
+
+class InMemoryRetrieverTests(SimpleTestCase):
+    """
+    Keyword, KNN and hybrid search over FAQs held in process, with a deterministic encoder.
+    """
+
+    def retriever(self, faqs=RETRIEVER_FAQS, **kwargs):
+        return InMemoryRetriever(faqs, _axis_encode, **kwargs)
+
+    def test_text_search_ranks_by_bm25_and_drops_non_matches(self):
+        results = self.retriever().search_text("stamp duty", k=5)
+        self.assertEqual([result["id"] for result in results], ["stamp", "customs"])
+        self.assertEqual(self.retriever().search_text("zzz"), [])
+
+    def test_results_have_elasticsearch_source_fields(self):
+        result = self.retriever().search_text("TIN", k=1)[0]
+        self.assertEqual(result, {field: RETRIEVER_FAQS[0][field] for field in ("answer", "section", "question", "id")})
+
+    def test_knn_search_orders_by_cosine(self):
+        retriever = self.retriever()
+        results = retriever.search_knn("question_vector", _axis_vector(0.2, 0.0, 0.9, 0.4), k=3)
+        self.assertEqual([result["id"] for result in results], ["customs", "stamp", "tin"])
+        ranking = retriever.knn_ranking("question_vector", _axis_vector(0.0, 3.0), k=1)
+        self.assertEqual(ranking[0][0], 1)
+        self.assertAlmostEqual(ranking[0][1], 1.0, places=5)
+
+    def test_hybrid_search_adds_boosted_knn_to_bm25(self):
+        retriever = self.retriever()
+        # The keyword leg alone prefers PAYE; the vector points at the stamp duty FAQ
+        query, vector = "pay", _axis_vector(0.0, 0.0, 0.0, 1.0)
+        self.assertEqual(retriever.search_text(query, k=1)[0]["id"], "paye")
+        self.assertEqual(retriever.search_hybrid("question_answer_vector", query, vector, k=1, knn_boost=5.0)[0]["id"], "stamp")
+        self.assertEqual(retriever.search_hybrid("question_answer_vector", query, vector, k=1, knn_boost=0.0)[0]["id"], "paye")
+
+    def test_top_k_is_stable_and_bounded(self):
+        scores = np.array([0.5, 0.9, 0.5, 0.1], dtype=np.float32)
+        self.assertEqual(_top_k(scores, 3).tolist(), [1, 0, 2])
+        self.assertEqual(_top_k(scores, 10).tolist(), [1, 0, 2, 3])
+        self.assertEqual(_top_k(scores, 0).tolist(), [])
+
+    def test_partial_records_from_file(self):
+        faqs = RETRIEVER_FAQS + [
+            {"id": "no-answer", "section": "Registration", "question": "Can I register online?"},
+            {"id": "no-question", "section": "Registration", "answer": "Registration is free."},
+            {"id": "empty", "section": "Registration", "question": "", "answer": ""},
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(faqs, f)
+        self.addCleanup(os.remove, f.name)
+
+        retriever = InMemoryRetriever.from_file(f.name, _axis_encode)
+        self.assertEqual(len(retriever.faqs), 6)
+        self.assertEqual(retriever.search_text("register online", k=1)[0]["id"], "no-answer")
+        self.assertEqual(retriever.search_text("free", k=1)[0]["id"], "no-question")
+
+    def test_version_follows_content(self):
+        changed = [dict(RETRIEVER_FAQS[0], answer="Changed."), *RETRIEVER_FAQS[1:]]
+        self.assertEqual(self.retriever().version, self.retriever().version)
+        self.assertNotEqual(self.retriever().version, self.retriever(changed).version)
+
+    @unittest.skipUnless(importlib.util.find_spec("hnswlib"), "hnswlib not installed")
+    def test_hnsw_matches_exact_search(self):
+        exact, approximate = self.retriever(), self.retriever(use_hnsw=True)
+        self.assertEqual(set(approximate.hnsw), {"question_vector", "answer_vector", "question_answer_vector"})
+        vector = _axis_vector(0.2, 0.0, 0.9, 0.4)
+        for field in approximate.hnsw:
+            with self.subTest(field=field):
+                self.assertEqual(approximate.search_knn(field, vector, k=3), exact.search_knn(field, vector, k=3))
+                [(doc, cosine)] = approximate.knn_ranking(field, vector, k=1)
+                self.assertAlmostEqual(cosine, exact.knn_ranking(field, vector, k=1)[0][1], places=4)
+
+
+# Kept before the tests patch it out, for the one test that runs the background thread
+_start_flush_thread = WriteBehindBuffer._ensure_started
+
+
+class WriteBehindBufferTests(TestCase):
+    """
+    Buffered feedback writes: flushing, retrying, dropping rejected rows and shutdown.
+
+    The background thread is not started except where a test says so; flushes run on the test thread.
+    """
+
+    def setUp(self):
+        for conversation_id in ("c1", "c2"):
+            _conversation(conversation_id)
+        patcher = mock.patch.object(WriteBehindBuffer, "_ensure_started")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = WriteBehindBuffer(max_size=100, flush_interval=0.01)
+
+    def add(self, *conversation_ids, score=1):
+        for conversation_id in conversation_ids:
+            self.buffer.add_feedback(new_feedback(conversation_id, score))
+
+    def test_flush_writes_feedback_and_rollups(self):
+        self.add("c1", "c2", "c1")
+        self.assertEqual(Feedback.objects.count(), 0)
+        self.assertEqual(self.buffer.flush(), 3)
+
+        self.assertEqual(Feedback.objects.filter(conversation_id="c1").count(), 2)
+        self.assertEqual(FeedbackRollup.objects.get(feedback=1).count, 3)
+        self.assertEqual(self.buffer.stats(), {"pending": 0, "flushed": 3, "failures": 0})
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_database_outage_keeps_rows_for_the_next_flush(self):
+        self.add("c1", "c2")
+        with mock.patch("rag.persistence.insert_rows", side_effect=DatabaseError("connection refused")):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.add("c1")
+        self.assertEqual(self.buffer.stats(), {"pending": 3, "flushed": 0, "failures": 1})
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(Feedback.objects.count(), 3)
+
+    def test_rejected_rows_are_dropped_and_the_rest_written(self):
+        self.add("c1", "c2", "c1")
+
+        def reject_c2(model, rows):
+            if any(row.conversation_id == "c2" for row in rows):
+                raise IntegrityError("foreign key violation")
+            insert_rows(model, rows)
+
+        with mock.patch("rag.persistence.insert_rows", side_effect=reject_c2), \
+                self.assertLogs("rag.persistence", "ERROR") as logs:
+            self.assertEqual(self.buffer.flush(), 2)
+
+        self.assertEqual(list(Feedback.objects.values_list("conversation_id", flat=True)), ["c1", "c1"])
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertIn("conversation c2", logs.output[0])
+
+    def test_discard_drops_only_that_conversations_feedback(self):
+        self.add("c1", "c2", "c1")
+        self.assertTrue(self.buffer.discard("c1"))
+        self.assertFalse(self.buffer.discard("c1"))
+        self.buffer.flush()
+        self.assertEqual(list(Feedback.objects.values_list("conversation_id", flat=True)), ["c2"])
+
+    def test_flush_conversation_writes_only_when_it_has_pending_feedback(self):
+        self.add("c2")
+        self.buffer.flush_conversation("c1")
+        self.assertEqual(self.buffer.pending(), 1)
+
+        self.add("c1")
+        self.buffer.flush_conversation("c1")
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertEqual(Feedback.objects.count(), 2)
+
+    def test_shutdown_retries_until_everything_is_written(self):
+        self.add("c1", "c2")
+        with mock.patch("rag.persistence.insert_rows", side_effect=[DatabaseError("down"), DatabaseError("down"), None]) as insert:
+            self.buffer.shutdown(timeout=5)
+        self.assertEqual(insert.call_count, 3)
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertEqual(self.buffer.stats()["failures"], 2)
+
+    def test_shutdown_gives_up_after_timeout(self):
+        self.add("c1")
+        with mock.patch("rag.persistence.insert_rows", side_effect=DatabaseError("down")), \
+                self.assertLogs("rag.persistence", "ERROR") as logs:
+            self.buffer.shutdown(timeout=0.05)
+        self.assertEqual(self.buffer.pending(), 1)
+        self.assertIn("1 rows unwritten", logs.output[-1])
+
+    def test_background_thread_flushes_when_full(self):
+        buffer = WriteBehindBuffer(max_size=2, flush_interval=3600)
+        buffer.flush = mock.Mock(return_value=2)
+        _start_flush_thread(buffer)
+        buffer.add_feedback(new_feedback("c1", 1))
+        time.sleep(0.05)
+        buffer.flush.assert_not_called()
+
+        buffer.add_feedback(new_feedback("c2", 1))
+        for _ in range(500):
+            if buffer.flush.called:
+                break
+            time.sleep(0.01)
+        buffer.flush.assert_called_once()
+        buffer._stopping.set()
+        buffer._wakeup.set()
+        buffer._thread.join(5)
+
+
+def _judge_reply(*relevances):
+    return json.dumps([{"Relevance": relevance, "Explanation": f"Judged {relevance}"} for relevance in relevances])
+
+
+EVAL_TOKENS = {"prompt_tokens": 101, "completion_tokens": 11, "total_tokens": 112}
+
+
+class EvaluationQueueTests(TestCase):
+    """
+    Batched relevance evaluation with a stubbed judge: batching, parse failures, retries and abandonment.
+    """
+
+    def setUp(self):
+        for conversation_id in ("c1", "c2"):
+            _conversation(conversation_id, relevance=RELEVANCE_PENDING)
+        patcher = mock.patch.object(EvaluationQueue, "_ensure_started")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = EvaluationQueue(batch_size=5, batch_wait=0.01, max_attempts=3, retry_delay=0)
+
+    def drain(self, *conversation_ids):
+        """
+        Submit the conversations, then run the worker loop on the test thread until the queue is empty.
+        """
+        for conversation_id in conversation_ids:
+            self.queue.submit(conversation_id, f"Question {conversation_id}?", f"Answer {conversation_id}.")
+        next_batch = self.queue._next_batch
+
+        def batch_or_stop():
+            if self.queue.pending() == 0:
+                self.queue._stopping.set()
+                return []
+            return next_batch()
+
+        with mock.patch.object(self.queue, "_next_batch", side_effect=batch_or_stop), \
+                mock.patch("rag.evaluation.close_old_connections"):
+            self.queue._run()
+
+    def relevance(self, conversation_id):
+        return Conversation.objects.values_list("relevance", "relevance_explanation").get(id=conversation_id)
+
+    def test_batch_is_judged_in_one_call(self):
+        reply = (_judge_reply("RELEVANT", "PARTLY_RELEVANT"), EVAL_TOKENS, 0.5)
+        with mock.patch("rag.raglogic.llm", return_value=reply) as judge:
+            self.drain("c1", "c2")
+
+        judge.assert_called_once()
+        self.assertIn("Question c2?", judge.call_args.args[0])
+        self.assertEqual(self.relevance("c1"), ("RELEVANT", "Judged RELEVANT"))
+        self.assertEqual(self.relevance("c2"), ("PARTLY_RELEVANT", "Judged PARTLY_RELEVANT"))
+        tokens = Conversation.objects.order_by("id").values_list("eval_prompt_tokens", "eval_completion_tokens", "eval_total_tokens")
+        self.assertEqual(list(tokens), [(51, 6, 56), (50, 5, 56)])
+        self.assertEqual(self.queue.stats(), {"pending": 0, "evaluated": 2, "dropped": 0, "abandoned": 0, "failures": 0})
+
+    def test_unparsable_batch_reply_marks_every_item_unknown_without_retrying(self):
+        # One well-formed verdict and one missing its explanation: the batch cannot be matched up
+        reply = json.dumps([{"Relevance": "RELEVANT", "Explanation": "Fine"}, {"Relevance": "RELEVANT"}])
+        with mock.patch("rag.raglogic.llm", return_value=(reply, EVAL_TOKENS, 0.5)) as judge, \
+                self.assertLogs("rag.raglogic", "ERROR"):
+            self.drain("c1", "c2")
+
+        judge.assert_called_once()
+        for conversation_id in ("c1", "c2"):
+            self.assertEqual(self.relevance(conversation_id), (RELEVANCE_UNKNOWN, "Failed to parse evaluation"))
+        self.assertEqual(self.queue.stats()["evaluated"], 2)
+        self.assertEqual(self.queue.stats()["failures"], 0)
+
+    def test_failed_batch_is_retried(self):
+        reply = (_judge_reply("RELEVANT", "NON_RELEVANT"), EVAL_TOKENS, 0.5)
+        with mock.patch("rag.raglogic.llm", side_effect=[TimeoutError("judge timed out"), reply]) as judge, \
+                self.assertLogs("rag.evaluation", "ERROR"):
+            self.drain("c1", "c2")
+
+        self.assertEqual(judge.call_count, 2)
+        self.assertEqual(self.relevance("c1")[0], "RELEVANT")
+        self.assertEqual(self.relevance("c2")[0], "NON_RELEVANT")
+        self.assertEqual(self.queue.stats()["failures"], 1)
+        self.assertEqual(self.queue.stats()["abandoned"], 0)
+
+    def test_items_are_marked_unknown_once_retries_are_exhausted(self):
+        with mock.patch("rag.raglogic.llm", side_effect=TimeoutError("judge timed out")) as judge, \
+                self.assertLogs("rag.evaluation", "ERROR"):
+            self.drain("c1", "c2")
+
+        self.assertEqual(judge.call_count, 3)
+        for conversation_id in ("c1", "c2"):
+            self.assertEqual(self.relevance(conversation_id), (RELEVANCE_UNKNOWN, "Evaluation failed: judge timed out"))
+        self.assertEqual(self.queue.stats(), {"pending": 0, "evaluated": 0, "dropped": 0, "abandoned": 2, "failures": 3})
+
+    def test_full_queue_marks_the_answer_not_evaluated(self):
+        with mock.patch("rag.evaluation.evaluation_queue", EvaluationQueue(max_queue_size=1)):
+            self.assertTrue(schedule_evaluation("c1", "Question?", {"relevance": RELEVANCE_PENDING, "answer": "Answer."}))
+            with self.assertLogs("rag.evaluation", "WARNING"):
+                self.assertFalse(schedule_evaluation("c2", "Question?", {"relevance": RELEVANCE_PENDING, "answer": "Answer."}))
+        self.assertEqual(self.relevance("c2")[0], RELEVANCE_NOT_EVALUATED)
+        self.assertFalse(schedule_evaluation("c1", "Question?", {"relevance": RELEVANCE_NOT_EVALUATED, "answer": "Answer."}))
+
+
+class SplitTokensTests(SimpleTestCase):
+    """
+    Spreading a batch's token usage across its items.
+    """
+
+    def test_shares_add_up_to_the_batch_total(self):
+        shares = [_split_tokens(EVAL_TOKENS, 3, index) for index in range(3)]
+        self.assertEqual([share["prompt_tokens"] for share in shares], [34, 34, 33])
+        self.assertEqual([share["completion_tokens"] for share in shares], [4, 4, 3])
+        for key, total in EVAL_TOKENS.items():
+            self.assertEqual(sum(share[key] for share in shares), total)
+
+    def test_single_item_gets_everything(self):
+        self.assertEqual(_split_tokens(EVAL_TOKENS, 1, 0), EVAL_TOKENS)
+
+
+OTHER_HIT = {"id": "e5f6a7b8", "section": "Customs", "question": "What is stamp duty?", "answer": "A tax on documents."}
+
+
+def _completion(content, prompt_tokens=100, completion_tokens=5):
+    return mock.Mock(
+        choices=[mock.Mock(message=mock.Mock(content=content))],
+        usage=mock.Mock(
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens
+        ),
+    )
+
+
+async def _search_hits(index, body):
+    # Text and KNN legs rank the two FAQs in opposite orders
+    hits = [OTHER_HIT, FAQ_HIT] if "knn" in body else [FAQ_HIT, OTHER_HIT]
+    return {"hits": {"hits": [{"_source": hit} for hit in hits]}}
+
+
+class StubbedAsyncClientsMixin:
+    """
+    Stub the async Elasticsearch and OpenAI clients, recording every one created.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.es_clients = []
+        self.openai_clients = []
+        self.completions = [_completion("A TIN is a number.")]
+
+        def es_client(*args, **kwargs):
+            client = mock.Mock(search=mock.AsyncMock(side_effect=_search_hits), close=mock.AsyncMock())
+            self.es_clients.append(client)
+            return client
+
+        def openai_client(*args, **kwargs):
+            client = mock.Mock(close=mock.AsyncMock())
+            client.chat.completions.create = mock.AsyncMock(side_effect=self.completions)
+            self.openai_clients.append(client)
+            return client
+
+        for target, value in (
+            ("rag.async_raglogic.AsyncElasticsearch", mock.Mock(side_effect=es_client)),
+            ("rag.async_raglogic.AsyncOpenAI", mock.Mock(side_effect=openai_client)),
+            ("rag.async_raglogic.embedding_batcher", None),
+            ("rag.async_raglogic.encode_query", mock.Mock(return_value=[0.0] * 384)),
+            ("rag.async_raglogic.use_answer_cache", mock.Mock(return_value=False)),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class AsyncPipelineTests(StubbedAsyncClientsMixin, SimpleTestCase):
+    """
+    The async pipeline end to end, with stubbed Elasticsearch and OpenAI clients created per event loop.
+    """
+
+    def run_in_loop(self, coroutine):
+        """
+        Run the coroutine in a fresh event loop, closing that loop's clients as a WSGI request does.
+        """
+        async def run_and_close():
+            try:
+                return await coroutine
+            finally:
+                await aclose_loop_clients()
+
+        return asyncio.run(run_and_close())
+
+    def test_rrf_answer_fuses_both_search_legs(self):
+        result = self.run_in_loop(aget_answer("What is a TIN?", "openai/gpt-3.5-turbo", "rrf"))
+
+        self.assertEqual(result["answer"], "A TIN is a number.")
+        self.assertEqual(result["search_query"], "What is a TIN?")
+        self.assertEqual(set(result["retrieval_latency"]), {"text", "vector"})
+        self.assertEqual((result["prompt_tokens"], result["completion_tokens"]), (100, 5))
+        es, = self.es_clients
+        self.assertEqual(es.search.await_count, 2)
+        prompt = self.openai_clients[0].chat.completions.create.call_args.kwargs["messages"][0]["content"]
+        self.assertIn(FAQ_HIT["answer"], prompt)
+        self.assertIn(OTHER_HIT["answer"], prompt)
+
+    def test_follow_up_is_condensed_before_searching(self):
+        self.completions.insert(0, _completion('"Standalone question: How do I get a TIN?"', 40, 8))
+        result = self.run_in_loop(aget_answer(
+            "How do I get one?", "openai/gpt-3.5-turbo", "text", history=[("What is a TIN?", "A tax number.")]
+        ))
+
+        self.assertEqual(result["search_query"], "How do I get a TIN?")
+        body = self.es_clients[0].search.call_args.kwargs["body"]
+        self.assertEqual(body["query"]["bool"]["must"]["multi_match"]["query"], "How do I get a TIN?")
+        self.assertEqual((result["prompt_tokens"], result["completion_tokens"]), (140, 13))
+
+    def test_condense_failure_searches_with_the_question_as_asked(self):
+        self.completions[:] = [TimeoutError("model timed out")]
+        with self.assertLogs("rag.async_raglogic", "WARNING"):
+            condensed = self.run_in_loop(acondense_query("How do I get one?", [("What is a TIN?", "A tax number.")]))
+        self.assertEqual(condensed, ("How do I get one?", NO_TOKENS))
+        self.assertEqual(self.run_in_loop(acondense_query("What is a TIN?", None)), ("What is a TIN?", NO_TOKENS))
+
+    def test_model_error_returns_an_error_result(self):
+        self.completions[:] = [TimeoutError("model timed out")]
+        with self.assertLogs("rag.async_raglogic", "ERROR"):
+            result = self.run_in_loop(aget_answer("What is a TIN?", "openai/gpt-3.5-turbo", "text"))
+        self.assertEqual(result, {"error": "An error occurred while fetching the answer."})
+
+    def test_clients_are_kept_per_loop_and_closed_with_it(self):
+        async def use_clients():
+            first = loop_client("async_elasticsearch", lambda: mock.Mock(close=mock.AsyncMock()))
+            self.assertIs(loop_client("async_elasticsearch", mock.Mock()), first)
+            return first
+
+        first = self.run_in_loop(use_clients())
+        second = self.run_in_loop(use_clients())
+
+        self.assertIsNot(first, second)
+        first.close.assert_awaited_once()
+        second.close.assert_awaited_once()
+        self.assertEqual(len(_loop_clients), 0)
+
+
+@mock.patch("rag.views.schedule_evaluation")
+class AsyncChatViewTests(StubbedAsyncClientsMixin, TestCase):
+    """
+    /chats/async/ served outside ASGI closes the clients of its per-request event loop.
+    """
+
+    def test_answers_and_closes_clients(self, schedule_evaluation_mock):
+        response = self.client.post(
+            reverse("chat_async"), {"message": "What is a TIN?", "search_type": "rrf"}, content_type="application/json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["answer"], "A TIN is a number.")
+        self.assertTrue(Conversation.objects.filter(id=response.json()["conversation_id"]).exists())
+        schedule_evaluation_mock.assert_called_once()
+        for client in self.es_clients + self.openai_clients:
+            client.close.assert_awaited_once()
+
+
+def _faq(faq_id, section, question, answer):
+    return {"id": faq_id, "section": section, "question": question, "answer": answer}
+
+
+def _words(prefix, count):
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+VAT_ANSWER = (
+    "A business must register for VAT when its taxable supplies exceed the annual threshold set by law, "
+    "and it must then charge VAT on those supplies and file a return for every month of trading."
+)
+
+
+class ContextAssemblyTests(SimpleTestCase):
+    """
+    Deduplication and token budgeting of the FAQ context in the answer prompt.
+    """
+
+    VAT = _faq("v1", "VAT", "When must I register for VAT?", VAT_ANSWER)
+    # The same FAQ republished under another section, and a lightly edited copy of it
+    VAT_COPY = _faq("v2", "Registration", "When must I register for VAT?", VAT_ANSWER)
+    VAT_EDITED = _faq("v3", "Domestic Taxes", "When must I register for VAT?", VAT_ANSWER + " Penalties apply.")
+    TIN = _faq("t1", "Registration", "What is a TIN?", "A Tax Identification Number issued to every registered taxpayer.")
+
+    def test_near_duplicates_are_dropped_keeping_the_best_ranked(self):
+        self.assertEqual(deduplicate([self.VAT, self.TIN, self.VAT_COPY, self.VAT_EDITED]), [self.VAT, self.TIN])
+        self.assertEqual(deduplicate([self.VAT_EDITED, self.VAT]), [self.VAT_EDITED])
+
+    def test_distinct_faqs_on_the_same_topic_are_kept(self):
+        other = _faq("v4", "VAT", "How do I file a VAT return?", "File the return online by the 15th of the following month.")
+        self.assertEqual(deduplicate([self.VAT, other]), [self.VAT, other])
+
+    def test_duplicates_do_not_reach_the_prompt(self):
+        hits = [self.VAT, self.VAT_COPY, self.TIN, self.VAT_EDITED]
+        context, stats = assemble_context(hits, budget=10000)
+
+        self.assertEqual(context, format_passage(self.VAT) + "\n\n" + format_passage(self.TIN))
+        self.assertEqual(stats["passages"], 2)
+        self.assertEqual(stats["duplicates_dropped"], 2)
+        self.assertEqual(stats["passages_truncated"], 0)
+        full_tokens = count_tokens("\n\n".join(format_passage(faq) for faq in hits))
+        self.assertEqual(stats["context_tokens"], count_tokens(context))
+        self.assertEqual(stats["context_tokens_saved"], full_tokens - count_tokens(context))
+        self.assertGreater(stats["context_tokens_saved"], 0)
+
+    def test_nothing_saved_when_every_hit_fits(self):
+        context, stats = assemble_context([self.VAT, self.TIN], budget=10000)
+        self.assertEqual(context, format_passage(self.VAT) + "\n\n" + format_passage(self.TIN))
+        self.assertEqual(stats["context_tokens_saved"], 0)
+
+    def test_long_answers_are_cut_to_the_passage_limit(self):
+        hits = [_faq(f"l{i}", "Customs", f"Long question {i}?", _words(f"w{i}x", 3 * PROMPT_PASSAGE_MAX_TOKENS)) for i in range(2)]
+        context, stats = assemble_context(hits, budget=10000)
+
+        self.assertEqual(stats["passages"], 2)
+        self.assertEqual(stats["passages_truncated"], 2)
+        for passage in context.split("\n\n"):
+            answer = passage.split("answer: ", 1)[1]
+            self.assertLessEqual(count_tokens(answer), PROMPT_PASSAGE_MAX_TOKENS)
+
+    def test_context_stays_within_the_budget(self):
+        hits = [_faq(f"b{i}", "Customs", f"Budget question {i}?", _words(f"b{i}x", 150)) for i in range(10)]
+        for budget in (100, 250, 500, 1000):
+            with self.subTest(budget=budget):
+                context, stats = assemble_context(hits, budget=budget)
+                self.assertLessEqual(count_tokens(context), budget)
+                self.assertLess(stats["passages"], len(hits))
+                self.assertEqual(stats["context_tokens_saved"], count_tokens("\n\n".join(map(format_passage, hits))) - stats["context_tokens"])
+
+    def test_last_passage_is_truncated_only_if_enough_room_is_left(self):
+        first = _faq("f1", "Customs", "First question?", _words("f", 40))
+        second = _faq("f2", "Customs", "Second question?", _words("s", 200))
+        first_tokens = count_tokens(format_passage(first))
+        header_tokens = count_tokens(format_passage({**second, "answer": ""}))
+
+        roomy = first_tokens + 2 + header_tokens + PROMPT_PASSAGE_MIN_TOKENS
+        context, stats = assemble_context([first, second], budget=roomy)
+        self.assertEqual((stats["passages"], stats["passages_truncated"]), (2, 1))
+        self.assertLessEqual(count_tokens(context), roomy)
+
+        context, stats = assemble_context([first, second], budget=roomy - 1)
+        self.assertEqual(context, format_passage(first))
+        self.assertEqual(stats["passages"], 1)
+
+    def test_budget_depends_on_the_model(self):
+        self.assertEqual(context_budget("openai/gpt-4o"), 2500)
+        self.assertEqual(context_budget("openai/gpt-3.5-turbo"), 1500)
+        self.assertEqual(context_budget("ollama/phi3"), PROMPT_CONTEXT_BUDGET)
+        self.assertEqual(context_budget(None), PROMPT_CONTEXT_BUDGET)
+
+
+def _turns(count, answer_words=5):
+    return [(f"Question {i}?", _words(f"a{i}x", answer_words)) for i in range(count)]
+
+
+class SelectHistoryTests(SimpleTestCase):
+    """
+    The sliding window of prior turns kept in the answer prompt.
+    """
+
+    def test_short_session_is_kept_whole(self):
+        turns = _turns(3)
+        self.assertEqual(select_history(turns, budget=10000), turns)
+        self.assertEqual(select_history([], budget=10000), [])
+
+    def test_only_the_most_recent_turns_are_kept(self):
+        turns = _turns(HISTORY_MAX_TURNS + 5)
+        self.assertEqual(select_history(turns, budget=10000), turns[-HISTORY_MAX_TURNS:])
+
+    def test_budget_keeps_the_newest_turns_that_fit(self):
+        turns = _turns(6, answer_words=20)
+        turn_tokens = count_tokens(format_turn(*turns[-1]))
+        selected = select_history(turns, budget=3 * turn_tokens + 1)
+
+        self.assertEqual(selected, turns[-3:])
+        self.assertLessEqual(sum(count_tokens(format_turn(*turn)) for turn in selected), 3 * turn_tokens + 1)
+        self.assertEqual(select_history(turns, budget=turn_tokens - 1), [])
+
+    def test_a_long_answer_is_cut_rather_than_crowding_out_older_turns(self):
+        turns = _turns(3) + [("Tell me everything?", _words("long", 5 * HISTORY_TURN_MAX_TOKENS))]
+        selected = select_history(turns, budget=4 * HISTORY_TURN_MAX_TOKENS)
+
+        self.assertEqual(selected[:3], turns[:3])
+        question, answer = selected[-1]
+        self.assertEqual(question, "Tell me everything?")
+        self.assertLessEqual(count_tokens(answer), HISTORY_TURN_MAX_TOKENS)
+        self.assertTrue(answer.endswith("..."))
+
+
+class ParseCondensedTests(SimpleTestCase):
+    """
+    Cleaning up the condensing model's rewrite of a follow-up question.
+    """
+
+    def test_quotes_and_prefix_are_stripped(self):
+        for output in (
+            "How do I get a TIN?",
+            '"How do I get a TIN?"',
+            '  "How do I get a TIN?"\n',
+            "Standalone question: How do I get a TIN?",
+            'standalone Question:  "How do I get a TIN?"',
+            '"Standalone question: How do I get a TIN?"',
+        ):
+            with self.subTest(output=output):
+                self.assertEqual(parse_condensed("How do I get one?", output), "How do I get a TIN?")
+
+    def test_unusable_output_keeps_the_original_query(self):
+        for output in ("", "   ", '""', "Standalone question:", None):
+            with self.subTest(output=output):
+                self.assertEqual(parse_condensed("How do I get one?", output), "How do I get one?")
+
+    def test_condense_query_falls_back_when_the_model_fails(self):
+        history = [("What is a TIN?", "A Tax Identification Number.")]
+        with mock.patch("rag.raglogic.llm", return_value=('"How do I get a TIN?"', EVAL_TOKENS, 0.1)):
+            self.assertEqual(condense_query("How do I get one?", history), ("How do I get a TIN?", EVAL_TOKENS))
+        with mock.patch("rag.raglogic.llm", side_effect=TimeoutError("model timed out")), \
+                self.assertLogs("rag.raglogic", "WARNING"):
+            self.assertEqual(condense_query("How do I get one?", history), ("How do I get one?", NO_TOKENS))
+        self.assertEqual(condense_query("What is a TIN?", []), ("What is a TIN?", NO_TOKENS))
+
+
+def _utc(*fields):
+    return datetime(*fields, tzinfo=dt_timezone.utc)
+
+
+class RetentionTests(TestCase):
+    """
+    Archiving whole months of conversations older than the retention period.
+    """
+
+    # 30 days before NOW is 2024-03-16, so January and February are archived and March is not
+    NOW = _utc(2024, 4, 15, 12)
+    TIMESTAMPS = {
+        "jan-first": _utc(2024, 1, 1, 0, 0),
+        "jan-last": _utc(2024, 1, 31, 23, 59, 59),
+        # Same timestamp as jan-last, so batches of one page through a tie
+        "jan-tie": _utc(2024, 1, 31, 23, 59, 59),
+        "feb-last": _utc(2024, 2, 29, 23, 59, 59),
+        # Older than the cutoff, but March is not over by then
+        "mar-first": _utc(2024, 3, 1, 0, 0),
+        "mar-recent": _utc(2024, 3, 20, 8, 0),
+    }
+
+    def setUp(self):
+        for conversation_id, timestamp in self.TIMESTAMPS.items():
+            _conversation(conversation_id, timestamp)
+        for conversation_id in ("jan-last", "jan-last", "mar-first"):
+            new_feedback(conversation_id, 1).save()
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+
+    def archive(self, **options):
+        return archive_old_conversations(retention_days=30, archive_dir=self.archive_dir, batch_size=1, now=self.NOW, **options)
+
+    def test_whole_months_before_the_cutoff_are_archived_and_deleted(self):
+        results = self.archive()
+
+        self.assertEqual(
+            [(result["month"], result["conversations"], result["feedback"]) for result in results],
+            [("2024-01", 3, 2), ("2024-02", 1, 0)],
+        )
+        self.assertEqual(set(Conversation.objects.values_list("id", flat=True)), {"mar-first", "mar-recent"})
+        self.assertEqual(list(Feedback.objects.values_list("conversation_id", flat=True)), ["mar-first"])
+
+        conversations_file, feedback_file = results[0]["files"]
+        self.assertEqual([row["id"] for row in read_archive(conversations_file)], ["jan-first", "jan-last", "jan-tie"])
+        self.assertEqual([row["conversation_id"] for row in read_archive(feedback_file)], ["jan-last", "jan-last"])
+        self.assertEqual(self.archive(), [])
+
+    def test_dry_run_changes_nothing(self):
+        results = self.archive(dry_run=True)
+
+        self.assertEqual([(result["month"], result["conversations"]) for result in results], [("2024-01", 3), ("2024-02", 1)])
+        self.assertTrue(all(result["files"] == [] for result in results))
+        self.assertEqual(Conversation.objects.count(), len(self.TIMESTAMPS))
+        self.assertEqual(Feedback.objects.count(), 3)
+        self.assertEqual(os.listdir(self.archive_dir), [])
+
+    def test_longer_retention_keeps_everything(self):
+        self.assertEqual(archive_old_conversations(retention_days=120, archive_dir=self.archive_dir, now=self.NOW), [])
+        self.assertEqual(Conversation.objects.count(), len(self.TIMESTAMPS))
+
+    def test_command_reports_what_it_would_archive(self):
+        output = io.StringIO()
+        call_command("archive_conversations", "--dry-run", "--archive-dir", self.archive_dir, stdout=output)
+        self.assertIn("Would archive 3 conversations and 2 feedback rows for 2024-01", output.getvalue())
+        self.assertEqual(Conversation.objects.count(), len(self.TIMESTAMPS))
+
+
+BATCH_ITEMS = [{"id": f"q{i}", "question": f"Question {i}?"} for i in range(6)]
+
+
+class BatchResumeTests(SimpleTestCase):
+    """
+    Resuming a batch from its checkpoint, with retrieval and the model mocked out.
+    """
+
+    def setUp(self):
+        self.retrieved = []
+        self.failing = {"Question 2?"}
+
+        def retrieve_many(questions, *args):
+            self.retrieved.append(list(questions))
+            return [[FAQ_HIT] for _ in questions]
+
+        def llm_with_backoff(prompt, model_choice, gate):
+            if any(question in prompt for question in self.failing):
+                raise TimeoutError("model timed out")
+            return "A TIN is a number.", EVAL_TOKENS, 0.1
+
+        for target, side_effect in (("rag.batch.retrieve_many", retrieve_many), ("rag.batch.llm_with_backoff", llm_with_backoff)):
+            patcher = mock.patch(target, side_effect=side_effect)
+            self.addCleanup(patcher.stop)
+            setattr(self, target.rsplit(".", 1)[1], patcher.start())
+
+    def run_batch(self, **options):
+        return list(answer_batch(BATCH_ITEMS, "openai/gpt-3.5-turbo", "text", concurrency=2, chunk_size=2, **options))
+
+    def test_skipped_ids_are_neither_retrieved_nor_answered(self):
+        results = self.run_batch(skip_ids={"q1", "q3"})
+
+        self.assertEqual(sorted(result["id"] for result in results), ["q0", "q2", "q4", "q5"])
+        self.assertEqual(self.retrieved, [["Question 0?", "Question 2?"], ["Question 4?", "Question 5?"]])
+        self.assertEqual(self.llm_with_backoff.call_count, 4)
+
+    def test_resume_answers_only_what_the_checkpoint_lacks(self):
+        with self.assertLogs("rag.batch", "ERROR"):
+            first_run = self.run_batch()
+        self.assertEqual(len(first_run), len(BATCH_ITEMS))
+        self.assertEqual([result["id"] for result in first_run if "error" in result], ["q2"])
+
+        # The checkpoint holds the ids answered without error, as scripts/batch_answer.py keeps them
+        checkpoint = {result["id"] for result in first_run if "error" not in result}
+        self.failing.clear()
+        self.retrieved.clear()
+        self.llm_with_backoff.reset_mock()
+        second_run = self.run_batch(skip_ids=checkpoint)
+
+        self.assertEqual([(result["id"], result["answer"]) for result in second_run], [("q2", "A TIN is a number.")])
+        self.assertEqual(self.retrieved, [["Question 2?"]])
+        self.llm_with_backoff.assert_called_once()
+
+    def test_everything_checkpointed_does_nothing(self):
+        self.assertEqual(self.run_batch(skip_ids={item["id"] for item in BATCH_ITEMS}), [])
+        self.retrieve_many.assert_not_called()
+
+    def test_view_skips_ids_already_received(self):
+        response = self.client.post(
+            reverse("chat_batch"),
+            {"questions": [item["question"] for item in BATCH_ITEMS[:4]], "search_type": "text", "skip_ids": ["0", "2"]},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(sorted(line["id"] for line in lines), ["1", "3"])
+        self.assertEqual(self.retrieved, [["Question 1?", "Question 3?"]])
@@ -0,0 +1,90 @@
+import logging
+import threading
+
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Rough characters per token for English text, used when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+DEFAULT_ENCODING = "cl100k_base"
+# Encodings by model name prefix, checked in order; the first match wins
+MODEL_ENCODINGS = (
+    ("openai/gpt-4o", "o200k_base"),
+    ("openai/gpt-4", "cl100k_base"),
+    ("openai/gpt-3.5", "cl100k_base"),
+)
+
+_encodings: Dict[str, object] = {}
+_encoding_lock = threading.Lock()
+
+
+def encoding_name(model_choice: Optional[str] = None) -> str:
+    """
+    Name of the tiktoken encoding used by a model choice such as "openai/gpt-4o".
+    """
+    for prefix, name in MODEL_ENCODINGS:
+        if model_choice and model_choice.startswith(prefix):
+            return name
+    return DEFAULT_ENCODING
+
+
+def get_encoding(model_choice: Optional[str] = None):
+    """
+    Return the tiktoken encoding for a model, or None if tiktoken cannot be loaded.
+    """
+    name = encoding_name(model_choice)
+    if name in _encodings:
+        return _encodings[name]
+    with _encoding_lock:
+        if name not in _encodings:
+            try:
+                import tiktoken
+
+                _encodings[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                logger.warning(f"tiktoken encoding {name} is unavailable ({e}); estimating token counts from text length.")
+                _encodings[name] = None
+    return _encodings[name]
+
+
+def count_tokens(text: str, model_choice: Optional[str] = None) -> int:
+    """
+    Count the tokens in a text, exactly with tiktoken or approximately without it.
+    """
+    if not text:
+        return 0
+    encoding = get_encoding(model_choice)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model_choice: Optional[str] = None, suffix: str = "...") -> str:
+    """
+    Cut a text down to at most `max_tokens` tokens, suffix included, marking the cut with `suffix`.
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model_choice) <= max_tokens:
+        return text
+    budget = max_tokens - count_tokens(suffix, model_choice)
+    if budget <= 0:
+        # No room for the marker as well as any text
+        budget, suffix = max_tokens, ""
+    encoding = get_encoding(model_choice)
+    while True:
+        if encoding is None:
+            cut = text[:budget * CHARS_PER_TOKEN]
+        else:
+            cut = encoding.decode(encoding.encode(text, disallowed_special=())[:budget])
+        # Prefer ending on a word boundary
+        boundary = cut.rfind(" ")
+        if boundary > len(cut) // 2:
+            cut = cut[:boundary]
+        truncated = cut.rstrip() + suffix
+        # The suffix can merge with the cut into extra tokens; give back one more if it does
+        if budget <= 1 or count_tokens(truncated, model_choice) <= max_tokens:
+            return truncated
+        budget -= 1
@@ -1,9 +1,12 @@
 from django.urls import path
-from .views import ChatView, ClearChatHistoryView, RecentConversationsView, FeedbackView, FeedbackStatsView,ConversationDetailView
+from .views import AsyncChatView, BatchChatView, ChatView, ChatStreamView, ClearChatHistoryView, RecentConversationsView, FeedbackView, FeedbackStatsView,ConversationDetailView
 
 
 urlpatterns = [
     path('', ChatView.as_view(), name='chat'),
+    path('async/', AsyncChatView.as_view(), name='chat_async'),
+    path('stream/', ChatStreamView.as_view(), name='chat_stream'),
+    path('batch/', BatchChatView.as_view(), name='chat_batch'),
     path('conversations', RecentConversationsView.as_view(), name='get_conversations'),
     path('conversations/<str:id>', ConversationDetailView.as_view(), name='conversation_detail'),
     path('feedback/', FeedbackView.as_view(), name='feedback'),
@@ -1,3 +1,4 @@
+import json
 import logging
 import time
 import uuid
@@ -11,13 +12,30 @@ from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework_swagger.views import get_swagger_view
 from django.shortcuts import get_object_or_404
-from .serializers import ChatbotSerializer, FeedbackSerializer, FeedbackStatsSerializer, ConversationSerializer,FeedbackSubmissionSerializer
-
-from .raglogic import get_answer
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from .serializers import SEARCH_OPTION_FIELDS, BatchChatSerializer, ChatbotSerializer, ConversationPageQuerySerializer, FeedbackSerializer, FeedbackStatsSerializer, ConversationSerializer,FeedbackSubmissionSerializer
+
+from .raglogic import get_answer, stream_answer
+from .async_raglogic import aclose_loop_clients, aget_answer
+from .batch import BATCH_CONCURRENCY, answer_batch
+from .evaluation import schedule_evaluation
+from .health import readiness
+from .metrics import REQUEST_SECONDS, StageTimer, record_error, render_metrics
 from .services import (
+    aget_session_history,
+    asave_conversation,
     clear_conversation,
+    clear_session,
+    flush_conversation,
+    get_conversations_page,
     get_feedback_stats,
-    get_recent_conversations,
+    get_session_history,
     save_conversation,
     save_feedback,
 )
@@ -31,6 +49,29 @@ urlpatterns = [
     re_path(r'^$', schema_view)
 ]
 
+def _search_options(validated_data: dict) -> dict:
+    return {field: validated_data[field] for field in SEARCH_OPTION_FIELDS if field in validated_data}
+
+
+def _chat_session(request, validated_data: dict):
+    """
+    The chat session to append this turn to and its prior turns.
+
+    Uses the session_id from the payload, else the one in the client's session, else starts a new session.
+    """
+    session_id = validated_data.get("session_id") or request.session.get("session_id")
+    if not session_id:
+        return str(uuid.uuid4()), []
+    return session_id, get_session_history(session_id)
+
+
+async def _achat_session(request, validated_data: dict):
+    session_id = validated_data.get("session_id") or await request.session.aget("session_id")
+    if not session_id:
+        return str(uuid.uuid4()), []
+    return session_id, await aget_session_history(session_id)
+
+
 class ChatView(APIView):
     """
     Main API View for handling user input and returning chatbot responses.
@@ -43,10 +84,14 @@ class ChatView(APIView):
                 examples={
                     "application/json": {
                         "conversation_id": "abcd-1234-efgh-5678",
+                        "session_id": "ijkl-9012-mnop-3456",
                         "answer": "This is the chatbot's response.",
                         "relevance": "RELEVANT",
                         "response_time": 0.5,
                         "cost": 0.02,
+                        "retrieval_latency": {"text": 0.01, "vector": 0.02},
+                        "search_query": "How do I register for a TIN?",
+                        "stage_latency": {"history": 0.002, "embed": 0.01, "retrieve": 0.03, "prompt": 0.001, "generate": 0.9, "save": 0.0001},
                         "elapsed_time": 1.0
                     }
                 }
@@ -81,45 +126,291 @@ class ChatView(APIView):
 
             logger.info(f"Received chatbot request with model: {model_choice} and search type: {search_type}")
 
-            # Generate a conversation ID if not provided
+            # Each message is a new turn in the chat session
             conversation_id = str(uuid.uuid4())
             request.session["conversation_id"] = conversation_id
 
             start_time = time.time()
+            timer = StageTimer()
 
             try:
-                logger.info(f"Generating answer for conversation {conversation_id}")
-                response = get_answer(user_input, model_choice=model_choice, search_type=search_type)
+                with timer.stage("history"):
+                    session_id, history = _chat_session(request, serializer.validated_data)
+                request.session["session_id"] = session_id
+                logger.info(f"Generating answer for conversation {conversation_id} in session {session_id}")
+                response = get_answer(
+                    user_input, model_choice=model_choice, search_type=search_type,
+                    search_options=_search_options(serializer.validated_data), history=history
+                )
+                response["stage_latency"] = {**timer.as_dict(), **response.get("stage_latency", {})}
                 logger.info(response)
 
                 answer = response.get("answer", "No answer provided.")
                 relevance = response.get("relevance", "N/A")
                 response_time = response.get("response_time", "N/A")
                 cost = response.get("openai_cost", "N/A")
-                elapsed_time = time.time() - start_time
 
                 # Save the conversation
-                save_conversation(conversation_id, user_input, response, "URA FAQs")
+                with timer.stage("save"):
+                    save_conversation(conversation_id, user_input, response, "URA FAQs", session_id)
                 logger.info(f"Conversation {conversation_id} saved successfully.")
+                schedule_evaluation(conversation_id, user_input, response)
+                elapsed_time = time.time() - start_time
+                REQUEST_SECONDS.labels(endpoint="chat").observe(elapsed_time)
 
                 return Response({
                     "conversation_id": conversation_id,
+                    "session_id": session_id,
                     "answer": answer,
                     "relevance": relevance,
                     "response_time": response_time,
                     "cost": cost,
+                    "retrieval_latency": response.get("retrieval_latency", {}),
+                    "search_query": response.get("search_query", user_input),
+                    "stage_latency": {**response["stage_latency"], **timer.as_dict()},
                     "elapsed_time": elapsed_time
                 }, status=status.HTTP_200_OK)
             except Exception as e:
+                record_error("request")
                 logger.exception(f"Error occurred while processing chatbot request for conversation {conversation_id}: {e}")
                 return Response({"error": "An error occurred while processing your request."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+async def _aiterate(iterator):
+    # Each item is produced in the request's sync thread; closing the generator early
+    # (client disconnect) closes the underlying iterator there too
+    sentinel = object()
+    try:
+        while True:
+            item = await sync_to_async(next)(iterator, sentinel)
+            if item is sentinel:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await sync_to_async(close)()
+
+
+def _streaming_content(request, iterator):
+    """
+    Content for a StreamingHttpResponse that is sent chunk by chunk under ASGI too.
+
+    Django's ASGI handler collects a sync iterator into a list before sending it, so there
+    the iterator is wrapped in an async one that pulls each chunk as it is produced.
+    """
+    if isinstance(getattr(request, "_request", request), ASGIRequest):
+        return _aiterate(iter(iterator))
+    return iterator
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ChatStreamView(APIView):
+    """
+    Server-sent-events variant of ChatView.
+
+    Emits a `retrieval` event with the FAQs used as context, a `token` event for each piece
+    of the answer as the model generates it, and a final `done` event once the conversation
+    has been saved.
+    """
+
+    @swagger_auto_schema(
+        request_body=ChatbotSerializer,
+        responses={
+            200: openapi.Response(description="text/event-stream of retrieval, token and done events"),
+            400: "Bad Request - Invalid input",
+        }
+    )
+    def post(self, request):
+        serializer = ChatbotSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        user_input = serializer.validated_data.get("message")
+        model_choice = serializer.validated_data.get("model_choice", "openai/gpt-3.5-turbo")
+        search_type = serializer.validated_data.get("search_type", "hybrid")
+
+        logger.info(f"Received streaming chatbot request with model: {model_choice} and search type: {search_type}")
+
+        conversation_id = str(uuid.uuid4())
+        request.session["conversation_id"] = conversation_id
+        start_time = time.time()
+        timer = StageTimer()
+        with timer.stage("history"):
+            session_id, history = _chat_session(request, serializer.validated_data)
+        request.session["session_id"] = session_id
+
+        events = self._events(
+            conversation_id, session_id, history, user_input, model_choice, search_type,
+            _search_options(serializer.validated_data), start_time, timer
+        )
+        response = StreamingHttpResponse(_streaming_content(request, events), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def _events(
+        self, conversation_id, session_id, history, user_input, model_choice, search_type, search_options,
+        start_time, timer
+    ):
+        try:
+            events = stream_answer(
+                user_input, model_choice=model_choice, search_type=search_type, search_options=search_options,
+                history=history
+            )
+            for event, payload in events:
+                if event == "retrieval":
+                    yield _sse("retrieval", {"conversation_id": conversation_id, "session_id": session_id, "results": payload})
+                elif event == "token":
+                    yield _sse("token", {"text": payload})
+                else:
+                    payload["stage_latency"] = {**timer.as_dict(), **payload.get("stage_latency", {})}
+                    with timer.stage("save"):
+                        save_conversation(conversation_id, user_input, payload, "URA FAQs", session_id)
+                    logger.info(f"Conversation {conversation_id} saved successfully.")
+                    schedule_evaluation(conversation_id, user_input, payload)
+                    elapsed_time = time.time() - start_time
+                    REQUEST_SECONDS.labels(endpoint="stream").observe(elapsed_time)
+
+                    yield _sse("done", {
+                        "conversation_id": conversation_id,
+                        "session_id": session_id,
+                        "relevance": payload.get("relevance", "N/A"),
+                        "response_time": payload.get("response_time", "N/A"),
+                        "cost": payload.get("openai_cost", "N/A"),
+                        "retrieval_latency": payload.get("retrieval_latency", {}),
+                        "search_query": payload.get("search_query", user_input),
+                        "stage_latency": {**payload["stage_latency"], **timer.as_dict()},
+                        "elapsed_time": elapsed_time
+                    })
+        except Exception as e:
+            record_error("request")
+            logger.exception(f"Error occurred while streaming chatbot response for conversation {conversation_id}: {e}")
+            yield _sse("error", {"error": "An error occurred while processing your request."})
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncChatView(View):
+    """
+    Async variant of ChatView for ASGI deployments.
+
+    Elasticsearch, OpenAI and database I/O are awaited, so a single worker can keep many
+    chats in flight. It accepts the same payload as ChatView.
+    """
+
+    async def post(self, request):
+        try:
+            payload = json.loads(request.body or b"{}")
+        except json.JSONDecodeError:
+            return JsonResponse({"error": "Request body must be valid JSON."}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = ChatbotSerializer(data=payload)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        user_input = serializer.validated_data.get("message")
+        model_choice = serializer.validated_data.get("model_choice", "openai/gpt-3.5-turbo")
+        search_type = serializer.validated_data.get("search_type", "hybrid")
+
+        logger.info(f"Received async chatbot request with model: {model_choice} and search type: {search_type}")
+
+        conversation_id = str(uuid.uuid4())
+        await request.session.aset("conversation_id", conversation_id)
+
+        start_time = time.time()
+        timer = StageTimer()
+
+        try:
+            with timer.stage("history"):
+                session_id, history = await _achat_session(request, serializer.validated_data)
+            await request.session.aset("session_id", session_id)
+            logger.info(f"Generating answer for conversation {conversation_id} in session {session_id}")
+            response = await aget_answer(
+                user_input, model_choice=model_choice, search_type=search_type,
+                search_options=_search_options(serializer.validated_data), history=history
+            )
+            response["stage_latency"] = {**timer.as_dict(), **response.get("stage_latency", {})}
+
+            with timer.stage("save"):
+                await asave_conversation(conversation_id, user_input, response, "URA FAQs", session_id)
+            logger.info(f"Conversation {conversation_id} saved successfully.")
+            await sync_to_async(schedule_evaluation)(conversation_id, user_input, response)
+            elapsed_time = time.time() - start_time
+            REQUEST_SECONDS.labels(endpoint="async").observe(elapsed_time)
+
+            return JsonResponse({
+                "conversation_id": conversation_id,
+                "session_id": session_id,
+                "answer": response.get("answer", "No answer provided."),
+                "relevance": response.get("relevance", "N/A"),
+                "response_time": response.get("response_time", "N/A"),
+                "cost": response.get("openai_cost", "N/A"),
+                "retrieval_latency": response.get("retrieval_latency", {}),
+                "search_query": response.get("search_query", user_input),
+                "stage_latency": {**response["stage_latency"], **timer.as_dict()},
+                "elapsed_time": elapsed_time
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            record_error("request")
+            logger.exception(f"Error occurred while processing chatbot request for conversation {conversation_id}: {e}")
+            return JsonResponse({"error": "An error occurred while processing your request."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            # Outside ASGI this view runs in an event loop of its own that ends with the request
+            if not isinstance(request, ASGIRequest):
+                await aclose_loop_clients()
+
+
+class BatchChatView(APIView):
+    """
+    Answer a list of questions in one request, streaming one JSON line per answer.
+
+    Questions are embedded and retrieved in chunks with Elasticsearch multi-search, and LLM
+    calls run with bounded concurrency, backing off when the API rate-limits. Answers stream
+    back as `application/x-ndjson` in completion order, each tagged with its question id;
+    a question that fails gets an `error` field instead of an answer. To resume an
+    interrupted request, send the ids already received in `skip_ids`. Batch answers are not
+    saved as conversations.
+    """
+
+    @swagger_auto_schema(
+        request_body=BatchChatSerializer,
+        responses={
+            200: openapi.Response(description="application/x-ndjson stream with one result per question"),
+            400: "Bad Request - Invalid input",
+        }
+    )
+    def post(self, request):
+        serializer = BatchChatSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        questions = serializer.validated_data["questions"]
+        model_choice = serializer.validated_data.get("model_choice", "openai/gpt-3.5-turbo")
+        search_type = serializer.validated_data.get("search_type", "hybrid")
+        logger.info(f"Received batch of {len(questions)} questions with model: {model_choice} and search type: {search_type}")
+
+        results = answer_batch(
+            questions,
+            model_choice=model_choice,
+            search_type=search_type,
+            search_options=_search_options(serializer.validated_data),
+            concurrency=serializer.validated_data.get("concurrency", BATCH_CONCURRENCY),
+            skip_ids=set(serializer.validated_data.get("skip_ids", [])),
+        )
+        lines = (json.dumps(result) + "\n" for result in results)
+        response = StreamingHttpResponse(_streaming_content(request, lines), content_type="application/x-ndjson")
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
 class ClearChatHistoryView(APIView):
     """
-    API View to clear the chat history for the current conversation.
+    API View to clear the chat history for the current chat session.
     """
 
     @swagger_auto_schema(
@@ -130,17 +421,23 @@ class ClearChatHistoryView(APIView):
         }
     )
     def post(self, request):
+        session_id = request.session.get("session_id", None)
         conversation_id = request.session.get("conversation_id", None)
-        logger.info(f"Attempting to clear chat history for conversation {conversation_id}")
+        logger.info(f"Attempting to clear chat history for session {session_id}, conversation {conversation_id}")
 
-        if conversation_id:
+        if session_id or conversation_id:
             try:
-                clear_conversation(conversation_id)
+                if session_id:
+                    clear_session(session_id)
+                else:
+                    clear_conversation(conversation_id)
+                # The next message starts a new session
+                request.session.pop("session_id", None)
                 request.session["conversation_id"] = str(uuid.uuid4())  # Reset conversation ID
-                logger.info(f"Chat history cleared successfully for conversation {conversation_id}.")
+                logger.info(f"Chat history cleared successfully for session {session_id}, conversation {conversation_id}.")
                 return Response({"message": "Chat history cleared successfully."}, status=status.HTTP_200_OK)
             except Exception as e:
-                logger.exception(f"Error occurred while clearing chat history for conversation {conversation_id}: {e}")
+                logger.exception(f"Error occurred while clearing chat history for session {session_id}: {e}")
                 return Response({"error": "An error occurred while clearing the chat history."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         logger.warning("No conversation ID found in the session.")
@@ -153,6 +450,7 @@ class ConversationDetailView(APIView):
 
     def get(self, request, id):
         logger.info(f"Fetching conversation with ID: {id}")
+        flush_conversation(id)
         conversation = get_object_or_404(Conversation.objects.prefetch_related('feedback'), id=id)
         serializer = ConversationSerializer(conversation)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -160,30 +458,65 @@ class ConversationDetailView(APIView):
 
 class RecentConversationsView(APIView):
     """
-    API View to fetch recent conversations.
+    API View to page through conversations, newest first.
+
+    Query parameters: `limit` (1-100, default 20), `cursor` (the `next_cursor` of the previous
+    page), `relevance` (omit or "All" for every conversation), `session_id` (one chat session's
+    turns) and `fields` (comma-separated projection, e.g. `id,timestamp,relevance`).
     """
 
     @swagger_auto_schema(
+        query_serializer=ConversationPageQuerySerializer,
         responses={
-            200: ConversationSerializer(many=True),
+            200: openapi.Response(
+                description="A page of conversations and the cursor for the next page",
+                examples={
+                    "application/json": {
+                        "results": [{"id": "abcd-1234-efgh-5678", "timestamp": "2024-10-07T19:19:00Z", "relevance": "RELEVANT"}],
+                        "next_cursor": "WyIyMDI0LTEwLTA3VDE5OjE5OjAwKzAwOjAwIiwgImFiY2QtMTIzNC1lZmdoLTU2NzgiXQ==",
+                        "next": "http://localhost:8000/chats/conversations?cursor=WyIy..."
+                    }
+                }
+            ),
+            400: "Invalid query parameters",
             500: "Internal Server Error",
         }
     )
     def get(self, request):
-        relevance_filter = request.query_params.get("relevance", None)
+        query = ConversationPageQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        relevance_filter = query.validated_data.get("relevance")
+        fields = query.validated_data.get("fields")
         logger.info(f"Fetching recent conversations with relevance filter: {relevance_filter}")
 
         try:
-            recent_conversations = get_recent_conversations(
-                limit=20, relevance=relevance_filter if relevance_filter != "All" else None
-                ).prefetch_related('feedback')
-            logger.info(f"Successfully fetched recent conversations.")
-            serializer = ConversationSerializer(recent_conversations, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            conversations, next_cursor = get_conversations_page(
+                limit=query.validated_data["limit"],
+                relevance=relevance_filter if relevance_filter != "All" else None,
+                cursor=query.validated_data.get("cursor"),
+                fields=fields,
+                session_id=query.validated_data.get("session_id"),
+            )
+        except ValueError as e:
+            return Response({"cursor": [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.exception(f"Error occurred while fetching recent conversations: {e}")
             return Response({"error": "An error occurred while fetching recent conversations."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        logger.info(f"Successfully fetched recent conversations.")
+        next_url = None
+        if next_cursor:
+            params = request.query_params.copy()
+            params["cursor"] = next_cursor
+            next_url = request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+        return Response({
+            "results": ConversationSerializer(conversations, many=True, fields=fields).data,
+            "next_cursor": next_cursor,
+            "next": next_url,
+        }, status=status.HTTP_200_OK)
+
 
 class FeedbackView(APIView):
     """
@@ -195,6 +528,7 @@ class FeedbackView(APIView):
         responses={
             200: "Feedback saved successfully.",
             400: "Invalid request data.",
+            404: "Conversation not found.",
             500: "Failed to save feedback.",
         }
     )
@@ -211,6 +545,8 @@ class FeedbackView(APIView):
                 save_feedback(conversation_id, feedback)
                 logger.info(f"Feedback saved successfully for conversation {conversation_id}.")
                 return Response({"message": "Feedback saved successfully."}, status=status.HTTP_200_OK)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
             except Exception as e:
                 logger.exception(f"Error occurred while saving feedback for conversation {conversation_id}: {e}")
                 return Response({"error": "Failed to save feedback."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -240,3 +576,37 @@ class FeedbackStatsView(APIView):
         except Exception as e:
             logger.exception(f"Error occurred while fetching feedback statistics: {e}")
             return Response({"error": "An error occurred while fetching feedback statistics."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MetricsView(View):
+    """
+    Prometheus metrics: per-stage latency histograms, token and cost counters, error counts
+    and the stats of the answer cache, embedding batcher, write buffer and evaluation queue.
+    """
+
+    def get(self, request):
+        return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
+
+
+class LivenessView(View):
+    """
+    Liveness probe: the worker is up and serving requests. Checks no dependencies, so an
+    outage of Postgres or Elasticsearch does not get healthy workers restarted.
+    """
+
+    def get(self, request):
+        return JsonResponse({"status": "alive"})
+
+
+class ReadinessView(View):
+    """
+    Readiness probe: the database answers, the search index (or in-memory retriever) is
+    available and the embedding model is loaded. Returns 503 until all of them pass.
+    """
+
+    def get(self, request):
+        ready, checks = readiness()
+        return JsonResponse(
+            {"status": "ready" if ready else "not ready", "checks": checks},
+            status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
@@ -0,0 +1,108 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from rag.batch import BATCH_CHUNK_SIZE, BATCH_CONCURRENCY, answer_batch
+
+# Answer a file of questions offline and write one JSON line per answer, e.g.
+#   python scripts/batch_answer.py data/ground-truth-data.csv answers.jsonl --search-type rrf
+# Input is CSV (a `question` column and an optional `id` column), JSONL ({"id", "question"})
+# or plain text with one question per line. The output file is the checkpoint: re-running the
+# same command skips every id already answered and retries the ones that failed.
+
+
+def read_questions(path):
+    items = []
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for position, row in enumerate(csv.DictReader(f)):
+                if row.get("question", "").strip():
+                    items.append({"id": str(row.get("id") or position), "question": row["question"]})
+    elif path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for position, line in enumerate(f):
+                if line.strip():
+                    row = json.loads(line)
+                    items.append({"id": str(row.get("id", position)), "question": row["question"]})
+    else:
+        with open(path, encoding="utf-8") as f:
+            items = [{"id": str(position), "question": line.strip()} for position, line in enumerate(f) if line.strip()]
+
+    seen = set()
+    for item in items:
+        if item["id"] in seen:
+            sys.exit(f"Duplicate question id {item['id']} in {path}")
+        seen.add(item["id"])
+    return items
+
+
+# Ids already answered without error in an earlier run
+def answered_ids(path):
+    answered = set()
+    if not os.path.exists(path):
+        return answered
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by the interruption
+                continue
+            if "error" not in result:
+                answered.add(str(result["id"]))
+    return answered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a batch of questions and write the answers as JSONL.")
+    parser.add_argument("input", help="Questions as .csv, .jsonl or plain text.")
+    parser.add_argument("output", help="JSONL file the answers are appended to; also the resume checkpoint.")
+    parser.add_argument("--model", default="openai/gpt-4o-mini")
+    parser.add_argument("--search-type", default="hybrid", choices=["text", "vector", "hybrid", "rrf"])
+    parser.add_argument("--k", type=int, default=None, help="FAQs used as context (rrf only).")
+    parser.add_argument("--num-candidates", type=int, default=None, help="KNN candidate pool (rrf only).")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Concurrent LLM calls.")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE,
+                        help="Questions embedded and retrieved per multi-search request.")
+    parser.add_argument("--restart", action="store_true", help="Ignore and overwrite an existing output file.")
+    args = parser.parse_args()
+
+    items = read_questions(args.input)
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = answered_ids(args.output)
+    remaining = sum(1 for item in items if item["id"] not in done)
+    print(f"{len(items)} questions, {len(items) - remaining} already answered, {remaining} to go.")
+
+    search_options = {
+        name: value for name, value in (("k", args.k), ("num_candidates", args.num_candidates)) if value is not None
+    }
+    start = time.perf_counter()
+    failed = 0
+    with open(args.output, "a", encoding="utf-8") as out, tqdm(total=remaining) as progress:
+        results = answer_batch(
+            items, args.model, args.search_type, search_options=search_options,
+            concurrency=args.concurrency, chunk_size=args.chunk_size, skip_ids=done,
+        )
+        for result in results:
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            failed += "error" in result
+            progress.update(1)
+
+    elapsed = time.perf_counter() - start
+    print(f"Answered {remaining - failed} questions in {elapsed:.1f}s "
+          f"({remaining / elapsed if elapsed else 0:.1f}/s), {failed} failed.")
+    if failed:
+        print("Run the same command again to retry the failed questions.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+import numpy as np
+
+# Start the API against the stubs first, e.g.
+#   python scripts/stub_servers.py --openai-latency 0.5 --es-latency 0.02 --jitter 0.3
+#   ELASTIC_URL=http://127.0.0.1:9201 OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=stub \
+#   ANSWER_CACHE_ENABLED=false uvicorn app.asgi:application --app-dir app --port 8000
+# then run scenarios at several concurrency levels:
+#   python scripts/loadtest.py --scenarios chat chat-async --concurrency 1 10 50 100
+#   python scripts/loadtest.py --scenarios mixed --duration 60 --concurrency 20 --json results.json
+# Each virtual user sends its next request as soon as the previous one completes.
+
+QUESTIONS = [
+    "What is a TIN?",
+    "How do I register for a TIN?",
+    "How do I pay PAYE?",
+    "When is the income tax return due?",
+    "How do I clear imported goods?",
+    "What is stamp duty?",
+    "How do I apply for a tax clearance certificate?",
+    "How do I transfer ownership of a motor vehicle?",
+]
+
+# Share of requests per scenario in the "mixed" scenario
+DEFAULT_MIX = {"chat": 2, "feedback": 2, "stats": 2, "history": 3, "conversation": 1}
+
+SCENARIOS = ["chat", "chat-async", "chat-stream", "feedback", "stats", "history", "conversation", "mixed"]
+
+
+class LoadTest:
+    """
+    Runs scenarios against one API and keeps the conversation ids that feedback and lookups need.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, args, rng: random.Random):
+        self.client = client
+        self.args = args
+        self.rng = rng
+        self.conversation_ids = []
+        self.counter = 0
+
+    def _chat_payload(self):
+        self.counter += 1
+        question = self.rng.choice(QUESTIONS)
+        if not self.args.cacheable:
+            # A unique message per request keeps the answer cache from serving it
+            question = f"{question} (load test {self.counter})"
+        return {"message": question, "model_choice": self.args.model, "search_type": self.args.search_type}
+
+    async def chat(self, path="/chats/"):
+        # Every chat starts its own session, so prompts do not grow with a shared history
+        self.client.cookies.clear()
+        response = await self.client.post(path, json=self._chat_payload())
+        if response.status_code == 200:
+            self.conversation_ids.append(response.json()["conversation_id"])
+        return response.status_code
+
+    async def chat_async(self):
+        return await self.chat("/chats/async/")
+
+    async def chat_stream(self):
+        self.client.cookies.clear()
+        async with self.client.stream("POST", "/chats/stream/", json=self._chat_payload()) as response:
+            body = (await response.aread()).decode()
+        if response.status_code == 200 and "event: error" in body:
+            return "stream error"
+        return response.status_code
+
+    async def feedback(self):
+        payload = {"conversation_id": self.rng.choice(self.conversation_ids), "feedback": self.rng.choice([1, -1])}
+        return (await self.client.post("/chats/feedback/", json=payload)).status_code
+
+    async def stats(self):
+        return (await self.client.get("/chats/feedback/stats/")).status_code
+
+    async def history(self):
+        params = {"limit": 20}
+        if self.rng.random() < 0.5:
+            params["relevance"] = self.rng.choice(["RELEVANT", "PARTLY_RELEVANT", "NON_RELEVANT"])
+        return (await self.client.get("/chats/conversations", params=params)).status_code
+
+    async def conversation(self):
+        return (await self.client.get(f"/chats/conversations/{self.rng.choice(self.conversation_ids)}")).status_code
+
+    def pick(self, scenario):
+        if scenario == "mixed":
+            names, weights = zip(*self.args.mix.items())
+            scenario = self.rng.choices(names, weights)[0]
+        return scenario, getattr(self, scenario.replace("-", "_"))
+
+    async def seed(self, count):
+        """
+        Create the conversations that feedback and conversation lookups refer to.
+        """
+        semaphore = asyncio.Semaphore(10)
+
+        async def one():
+            async with semaphore:
+                await self.chat()
+
+        await asyncio.gather(*(one() for _ in range(count)))
+        if not self.conversation_ids:
+            raise SystemExit("Could not create any conversations to seed the feedback and history scenarios.")
+
+
+async def run_level(load_test: LoadTest, scenario: str, concurrency: int, requests: int, duration: float):
+    """
+    Run a scenario with `concurrency` virtual users, for `requests` requests or `duration` seconds.
+    """
+    samples = []  # (scenario, seconds, error or None)
+    issued = 0
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def user():
+        nonlocal issued
+        while (deadline is None and issued < requests) or (deadline is not None and time.perf_counter() < deadline):
+            issued += 1
+            name, call = load_test.pick(scenario)
+            start = time.perf_counter()
+            try:
+                result = await call()
+                error = None if result == 200 else str(result)
+            except httpx.HTTPError as e:
+                error = type(e).__name__
+            samples.append((name, time.perf_counter() - start, error))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return summarize(samples, time.perf_counter() - start)
+
+
+def summarize(samples, elapsed):
+    latencies = np.array([seconds for _, seconds, error in samples if error is None])
+    errors = {}
+    for _, _, error in samples:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    by_scenario = {}
+    for name, _, _ in samples:
+        by_scenario[name] = by_scenario.get(name, 0) + 1
+    return {
+        "requests": len(samples),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+        "p95": float(np.percentile(latencies, 95)) if latencies.size else 0.0,
+        "p99": float(np.percentile(latencies, 99)) if latencies.size else 0.0,
+        "max": float(latencies.max()) if latencies.size else 0.0,
+        "error_rate": sum(errors.values()) / len(samples) if samples else 0.0,
+        "errors": errors,
+        "scenarios": by_scenario,
+    }
+
+
+async def main_async(args):
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    results = []
+    async with httpx.AsyncClient(base_url=args.base_url.rstrip("/"), timeout=args.timeout, limits=limits) as client:
+        load_test = LoadTest(client, args, rng)
+        if {"feedback", "conversation", "mixed"} & set(args.scenarios):
+            await load_test.seed(args.seed_conversations)
+
+        print(f"{'scenario':<12} {'conc':>5} {'reqs':>6} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'err %':>7}")
+        for concurrency in args.concurrency:
+            for scenario in args.scenarios:
+                if args.warmup:
+                    await run_level(load_test, scenario, concurrency, args.warmup, 0)
+                requests = max(args.requests, concurrency)
+                summary = await run_level(load_test, scenario, concurrency, requests, args.duration)
+                results.append({"scenario": scenario, "concurrency": concurrency, **summary})
+                print(
+                    f"{scenario:<12} {concurrency:>5} {summary['requests']:>6} {summary['throughput']:>8.2f} "
+                    f"{summary['p50']:>8.3f} {summary['p95']:>8.3f} {summary['p99']:>8.3f} "
+                    f"{summary['error_rate']:>6.1%}"
+                )
+                if summary["errors"]:
+                    print(f"{'':<12} errors: {summary['errors']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": {key: value for key, value in vars(args).items() if key != "json"}, "results": results}, f, indent=2)
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r} in mix")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat, feedback, stats and history endpoints.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=["chat", "chat-async"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100], help="Virtual users per level.")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario and concurrency level.")
+    parser.add_argument("--duration", type=float, default=0, help="Run each level for this many seconds instead.")
+    parser.add_argument("--warmup", type=int, default=0, help="Unmeasured requests before each level.")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Weights for the mixed scenario, e.g. chat=1,history=4,stats=1.")
+    parser.add_argument("--seed-conversations", type=int, default=20,
+                        help="Conversations created up front for the feedback and conversation scenarios.")
+    parser.add_argument("--model", default="openai/gpt-4o-mini")
+    parser.add_argument("--search-type", default="text", choices=["text", "vector", "hybrid", "rrf"])
+    parser.add_argument("--cacheable", action="store_true", help="Repeat questions so the answer cache can serve them.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for questions and the scenario mix.")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file.")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
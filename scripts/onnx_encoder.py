@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from rag.encoders import (
+    BACKEND_ONNX,
+    BACKEND_SENTENCE_TRANSFORMERS,
+    default_onnx_dir,
+    export_onnx,
+    load_encoder,
+)
+
+# Export and benchmark the ONNX encoder backend, e.g.
+#   python scripts/onnx_encoder.py export
+#   python scripts/onnx_encoder.py benchmark --json
+# Export needs torch and sentence-transformers; serving with EMBEDDING_BACKEND=onnx does not.
+# Parity with the SentenceTransformer vectors is checked by OnnxParityTests in app/rag/tests.py.
+
+MODEL_NAME = os.getenv("MODEL_NAME", "multi-qa-MiniLM-L6-cos-v1")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "data/onnx")
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+FAQS_PATH = os.path.join(DATA_DIR, 'faqs-with-ids.json')
+GROUND_TRUTH_PATH = os.path.join(DATA_DIR, 'ground-truth-data.csv')
+
+# Encoders compared by benchmark: (label, backend, quantized)
+VARIANTS = [
+    ("sentence-transformers", BACKEND_SENTENCE_TRANSFORMERS, False),
+    ("onnx-fp32", BACKEND_ONNX, False),
+    ("onnx-int8", BACKEND_ONNX, True),
+]
+
+
+# FAQ documents plus ground-truth questions, the texts the API actually embeds
+def load_texts(limit):
+    with open(FAQS_PATH, 'r') as f:
+        faqs = [faq for faq in json.load(f) if faq.get('question')]
+    questions = []
+    if os.path.exists(GROUND_TRUTH_PATH):
+        questions = pd.read_csv(GROUND_TRUTH_PATH)['question'].dropna().tolist()
+    documents = [faq['question'] for faq in faqs] + [faq['question'] + ' ' + faq['answer'] for faq in faqs]
+    return documents, (questions or [faq['question'] for faq in faqs])[:limit]
+
+
+def load_variant(backend, quantized, onnx_dir):
+    return load_encoder(MODEL_NAME, backend, onnx_dir, quantized)
+
+
+# Load one variant in this process and time single-query latency and batch throughput
+def benchmark_worker(args):
+    label, backend, quantized = next(variant for variant in VARIANTS if variant[0] == args.variant)
+    _, queries = load_texts(args.queries)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    start = time.perf_counter()
+    encoder = load_variant(backend, quantized, args.onnx_dir)
+    encoder.encode(queries[:1])
+    load_time = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        encoder.encode([query])
+        latencies.append(time.perf_counter() - start)
+
+    texts = (queries * (args.batch_texts // max(1, len(queries)) + 1))[:args.batch_texts]
+    start = time.perf_counter()
+    encoder.encode(texts, batch_size=args.batch_size)
+    throughput = len(texts) / (time.perf_counter() - start)
+
+    latencies.sort()
+    print(json.dumps({
+        "variant": label,
+        "load_seconds": load_time,
+        "latency_p50_ms": statistics.median(latencies) * 1000,
+        "latency_p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+        "throughput_texts_per_s": throughput,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_model_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - rss_before,
+    }))
+
+
+# Run each variant in a fresh interpreter so RSS and load time are not shared between them
+def benchmark(args):
+    results = []
+    for label, backend, quantized in VARIANTS:
+        command = [
+            sys.executable, os.path.abspath(__file__), "--onnx-dir", args.onnx_dir,
+            "benchmark-worker", label, "--queries", str(args.queries),
+            "--batch-texts", str(args.batch_texts), "--batch-size", str(args.batch_size),
+        ]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"Skipping {label}: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'}")
+            continue
+        results.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'variant':>22} {'load s':>8} {'p50 ms':>8} {'p95 ms':>8} {'texts/s':>9} {'RSS MB':>8}")
+    for row in results:
+        print(
+            f"{row['variant']:>22} {row['load_seconds']:>8.2f} {row['latency_p50_ms']:>8.2f} "
+            f"{row['latency_p95_ms']:>8.2f} {row['throughput_texts_per_s']:>9.1f} {row['rss_mb']:>8.0f}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export and benchmark the ONNX embedding backend.")
+    parser.add_argument("--onnx-dir", default=None, help="Exported model directory (default: ONNX_MODEL_DIR/<model>).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export the model to ONNX and quantize it to int8.")
+    export.add_argument("--no-quantize", action="store_true")
+
+    for name in ("benchmark", "benchmark-worker"):
+        bench = commands.add_parser(name, help="Latency, throughput and RSS per encoder." if name == "benchmark" else None)
+        if name == "benchmark-worker":
+            bench.add_argument("variant", choices=[label for label, _, _ in VARIANTS])
+        bench.add_argument("--queries", type=int, default=200, help="Single-query encodes to time.")
+        bench.add_argument("--batch-texts", type=int, default=1024, help="Texts encoded for the throughput run.")
+        bench.add_argument("--batch-size", type=int, default=32)
+        bench.add_argument("--json", action="store_true", help="Print results as JSON.")
+
+    args = parser.parse_args()
+    args.onnx_dir = args.onnx_dir or default_onnx_dir(ONNX_MODEL_DIR, MODEL_NAME)
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.command == "export":
+        config = export_onnx(MODEL_NAME, args.onnx_dir, quantize=not args.no_quantize)
+        print(json.dumps(config, indent=2))
+    elif args.command == "benchmark":
+        benchmark(args)
+    else:
+        benchmark_worker(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,36 @@
+import argparse
+import copy
+import hashlib
 import json
+import os
+import sys
+import time
+from collections import Counter
 import pandas as pd
 from tqdm.auto import tqdm
-from sentence_transformers import SentenceTransformer
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
+
+# Share the embedding store and encoder backends with the Django app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from rag.embedding_store import EmbeddingStore
+from rag.encoders import BACKEND_SENTENCE_TRANSFORMERS, default_onnx_dir, encoder_id, load_encoder
 
 # Configuration
-MODEL_NAME = "multi-qa-MiniLM-L6-cos-v1"
-ES_URL = 'http://localhost:9200'
-INDEX_NAME = "ura_faqs"
+MODEL_NAME = os.getenv("MODEL_NAME", "multi-qa-MiniLM-L6-cos-v1")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", BACKEND_SENTENCE_TRANSFORMERS)
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "data/onnx")
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "true").lower() == "true"
+# Identifies the vectors' encoder; a backend switch changes it and forces a full rebuild
+ENCODER_ID = encoder_id(MODEL_NAME, EMBEDDING_BACKEND, ONNX_QUANTIZED)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "data/embeddings")
+ES_URL = os.getenv("ELASTIC_URL", 'http://localhost:9200')
+INDEX_NAME = os.getenv("INDEX_NAME", "ura_faqs")
+FAQS_PATH = '../data/faqs-with-ids.json'
+ENCODE_BATCH_SIZE = 128
+BULK_CHUNK_SIZE = 500
+BULK_THREADS = 4
+KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "2"))
+WARMUP_QUERIES = ["What is a TIN?", "How do I pay PAYE?", "How do I clear imported goods?"]
 INDEX_SETTINGS = {
     "settings": {
         "number_of_shards": 1,
@@ -15,6 +38,8 @@ INDEX_SETTINGS = {
     },
     "mappings": {
         "properties": {
+            "id": {"type": "keyword"},
+            "content_hash": {"type": "keyword"},
             "question": {"type": "text"},
             "answer": {"type": "text"},
             "section": {"type": "text"},
@@ -45,21 +70,72 @@ def load_faqs(filepath):
     with open(filepath, 'r') as f:
         return json.load(f)
 
-# Initialize SentenceTransformer model
+# Every FAQ needs its own id: documents are indexed and incrementally synced by it.
+# notebooks/ground_truth.ipynb derives the ids from each FAQ's section and question
+def validate_faq_ids(faqs, filepath=FAQS_PATH):
+    missing = [position for position, faq in enumerate(faqs) if not faq.get('id')]
+    counts = Counter(faq['id'] for faq in faqs if faq.get('id'))
+    duplicates = sorted(faq_id for faq_id, count in counts.items() if count > 1)
+    problems = []
+    if missing:
+        problems.append(f"{len(missing)} FAQs have no id (first at position {missing[0]})")
+    if duplicates:
+        problems.append(f"{len(duplicates)} ids are shared by several FAQs ({', '.join(duplicates[:10])})")
+    if problems:
+        raise ValueError(f"Invalid FAQ ids in {filepath}: {'; '.join(problems)}. Regenerate them with notebooks/ground_truth.ipynb.")
+    return faqs
+
+# Stable hash of the fields that determine a FAQ's document and vectors
+def content_hash(faq, model_name=ENCODER_ID):
+    payload = json.dumps([faq['question'], faq['answer'], faq['section'], model_name], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Attach content hashes to the FAQs
+def hash_faqs(faqs, model_name=ENCODER_ID):
+    for faq in faqs:
+        faq['content_hash'] = content_hash(faq, model_name)
+    return faqs
+
+# Single version string for the whole corpus, stored in the index mapping's _meta
+# The API's answer cache watches it to notice in-place updates
+def content_version(hashes):
+    return hashlib.sha256("".join(sorted(hashes)).encode('utf-8')).hexdigest()[:16]
+
+# Initialize the embedding model with the configured backend
 def initialize_model(model_name):
-    return SentenceTransformer(model_name)
+    return load_encoder(model_name, EMBEDDING_BACKEND, default_onnx_dir(ONNX_MODEL_DIR, model_name), ONNX_QUANTIZED)
+
+# Encoder that only loads the model on first use and serves previously seen texts from the embedding store
+class FaqEncoder:
+    def __init__(self, model_name, store=None):
+        self.model_name = model_name
+        self.store = store
+        self._model = None
+
+    def _encode_with_model(self, texts, **kwargs):
+        if self._model is None:
+            self._model = initialize_model(self.model_name)
+        return self._model.encode(texts, **kwargs)
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self.encode([texts], **kwargs)[0]
+        if self.store is None:
+            return self._encode_with_model(texts, **kwargs)
+        return self.store.encode(texts, lambda missing: self._encode_with_model(missing, **kwargs))
 
 # Vectorize FAQ data (with concatenated question + answer for question_answer_vector)
-def vectorize_faqs(faqs, model):
-    for faq in tqdm(faqs, desc="Vectorizing FAQs"):
-        question = faq['question']
-        answer = faq['answer']
-        qa = question + ' ' + answer
-
-        # Generate vectors for question, answer, and concatenated question + answer
-        faq['question_vector'] = model.encode(question)
-        faq['answer_vector'] = model.encode(answer)
-        faq['question_answer_vector'] = model.encode(qa)
+# Each field is encoded for the whole corpus at once so the model runs on large batches
+def vectorize_faqs(faqs, model, batch_size=ENCODE_BATCH_SIZE):
+    questions = [faq['question'] for faq in faqs]
+    answers = [faq['answer'] for faq in faqs]
+    qas = [question + ' ' + answer for question, answer in zip(questions, answers)]
+
+    # Generate vectors for question, answer, and concatenated question + answer
+    for field, texts in (("question_vector", questions), ("answer_vector", answers), ("question_answer_vector", qas)):
+        vectors = model.encode(texts, batch_size=batch_size, show_progress_bar=True, convert_to_numpy=True)
+        for faq, vector in zip(faqs, vectors):
+            faq[field] = vector.tolist()
     return faqs
 
 # Initialize Elasticsearch
@@ -74,10 +150,158 @@ def create_index(es_client, index_name, settings):
     es_client.indices.delete(index=index_name, ignore_unavailable=True)
     es_client.indices.create(index=index_name, body=settings)
 
-# Index FAQs to Elasticsearch
-def index_faqs(es_client, faqs, index_name):
-    for faq in tqdm(faqs, desc="Indexing FAQs"):
-        es_client.index(index=index_name, document=faq)
+# Versioned index name for a new build behind the alias, e.g. ura_faqs_v20241007191900
+def versioned_index_name(alias):
+    return f"{alias}_v{time.strftime('%Y%m%d%H%M%S', time.gmtime())}"
+
+# All versioned indices built for the alias, newest first
+def list_versions(es_client, alias):
+    indices = es_client.indices.get(index=f"{alias}_v*", expand_wildcards="open")
+    return sorted(indices.keys(), reverse=True)
+
+# Indices the alias currently points to
+def current_indices(es_client, alias):
+    if not es_client.indices.exists_alias(name=alias):
+        return []
+    return list(es_client.indices.get_alias(name=alias).keys())
+
+# Warm a freshly built index so the first live queries don't pay for segment and graph loading
+def warm_index(es_client, index_name, model):
+    es_client.indices.refresh(index=index_name)
+    es_client.indices.forcemerge(index=index_name, max_num_segments=1)
+    for question in WARMUP_QUERIES:
+        vector = model.encode(question).tolist()
+        for field in ("question_vector", "answer_vector", "question_answer_vector"):
+            elastic_search_hybrid(es_client, field, question, vector, index_name=index_name)
+
+# Atomically point the alias at a new index
+# A legacy concrete index with the alias's name is removed in the same request
+def swap_alias(es_client, alias, new_index):
+    actions = [{"add": {"index": new_index, "alias": alias}}]
+    for index in current_indices(es_client, alias):
+        if index != new_index:
+            actions.append({"remove": {"index": index, "alias": alias}})
+    if es_client.indices.exists(index=alias) and not es_client.indices.exists_alias(name=alias):
+        actions.append({"remove_index": {"index": alias}})
+    es_client.indices.update_aliases(actions=actions)
+    print(f"Alias {alias} now points to {new_index}")
+
+# Delete old versions, keeping the live index plus `keep` previous ones for rollback
+def prune_versions(es_client, alias, keep):
+    live = set(current_indices(es_client, alias))
+    previous = [index for index in list_versions(es_client, alias) if index not in live]
+    for index in previous[keep:]:
+        es_client.indices.delete(index=index)
+        print(f"Deleted old index version {index}")
+
+# Point the alias back at the newest version older than the live one
+def rollback(es_client, alias):
+    live = current_indices(es_client, alias)
+    if not live:
+        raise ValueError(f"Alias {alias} does not point to any index.")
+    older = [index for index in list_versions(es_client, alias) if index < min(live)]
+    if not older:
+        raise ValueError(f"No previous version of {alias} to roll back to.")
+    swap_alias(es_client, alias, older[0])
+
+# Index settings for a new build, with the corpus version recorded in the mapping
+def index_settings_for(faqs):
+    settings = copy.deepcopy(INDEX_SETTINGS)
+    settings["mappings"]["_meta"] = {
+        "content_version": content_version(faq['content_hash'] for faq in faqs),
+        "model_name": ENCODER_ID,
+    }
+    return settings
+
+# Document id to content hash for everything already in the index
+def existing_hashes(es_client, index_name):
+    return {
+        hit["_id"]: hit["_source"].get("content_hash")
+        for hit in helpers.scan(es_client, index=index_name, query={"query": {"match_all": {}}}, _source=["content_hash"])
+    }
+
+# Whether the live index can be updated in place rather than rebuilt
+def supports_incremental(es_client, index_name):
+    mappings = es_client.indices.get_mapping(index=index_name)[index_name]["mappings"]
+    meta = mappings.get("_meta", {})
+    return "content_hash" in mappings.get("properties", {}) and meta.get("model_name") == ENCODER_ID
+
+# Work out which FAQs changed and which documents vanished since the last run
+def diff_faqs(faqs, existing):
+    current_ids = {faq['id'] for faq in faqs}
+    changed = [faq for faq in faqs if existing.get(faq['id']) != faq['content_hash']]
+    vanished = [doc_id for doc_id in existing if doc_id not in current_ids]
+    return changed, vanished
+
+# Embed and upsert changed FAQs, delete vanished ones, and bump the corpus version
+def sync_index(es_client, faqs, index_name, model, batch_size=ENCODE_BATCH_SIZE, chunk_size=BULK_CHUNK_SIZE, thread_count=BULK_THREADS):
+    changed, vanished = diff_faqs(faqs, existing_hashes(es_client, index_name))
+    print(f"Incremental sync: {len(changed)} changed, {len(vanished)} vanished, {len(faqs) - len(changed)} unchanged")
+
+    if changed:
+        start = time.perf_counter()
+        vectorize_faqs(changed, model, batch_size=batch_size)
+        report_rate("Vectorized", len(changed), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        indexed = index_faqs(es_client, changed, index_name, chunk_size=chunk_size, thread_count=thread_count)
+        report_rate("Upserted", indexed, time.perf_counter() - start)
+
+    if vanished:
+        deleted, errors = helpers.bulk(
+            es_client,
+            ({"_op_type": "delete", "_index": index_name, "_id": doc_id} for doc_id in vanished),
+            chunk_size=chunk_size,
+            raise_on_error=False,
+        )
+        print(f"Deleted {deleted} vanished documents")
+        es_client.indices.refresh(index=index_name)
+
+    if changed or vanished:
+        es_client.indices.put_mapping(index=index_name, meta={
+            "content_version": content_version(faq['content_hash'] for faq in faqs),
+            "model_name": ENCODER_ID,
+        })
+    return changed, vanished
+
+# Build bulk index actions, using the FAQ id as the document id
+def bulk_actions(faqs, index_name):
+    for faq in faqs:
+        yield {"_index": index_name, "_id": faq['id'], "_source": faq}
+
+# Index FAQs to Elasticsearch with parallel bulk requests
+# Refresh is disabled while loading and restored afterwards
+def index_faqs(es_client, faqs, index_name, chunk_size=BULK_CHUNK_SIZE, thread_count=BULK_THREADS):
+    settings = es_client.indices.get_settings(index=index_name, name="index.refresh_interval")
+    refresh_interval = settings[index_name]["settings"].get("index", {}).get("refresh_interval")
+
+    es_client.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": "-1"}})
+    indexed = 0
+    try:
+        for ok, info in tqdm(
+            helpers.parallel_bulk(
+                es_client,
+                bulk_actions(faqs, index_name),
+                chunk_size=chunk_size,
+                thread_count=thread_count,
+                raise_on_error=False,
+            ),
+            total=len(faqs),
+            desc="Indexing FAQs",
+        ):
+            if ok:
+                indexed += 1
+            else:
+                print(f"Failed to index document: {info}")
+    finally:
+        es_client.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": refresh_interval}})
+        es_client.indices.refresh(index=index_name)
+    return indexed
+
+# Report throughput for a pipeline stage
+def report_rate(stage, count, elapsed):
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    print(f"{stage}: {count} docs in {elapsed:.2f}s ({rate:.1f} docs/sec)")
 
 # Perform hybrid search (KNN + Keyword)
 def elastic_search_hybrid(es_client, field, query, query_vector, index_name="ura_faqs"):
@@ -118,19 +342,62 @@ def faq_question(es_client, model, question):
     question_vector = model.encode(question)
     return elastic_search_hybrid(es_client, "question_answer_vector", question, question_vector, index_name=INDEX_NAME)
 
+# Parse command line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="Vectorize and index the URA FAQs into Elasticsearch.")
+    parser.add_argument("--faqs", default=FAQS_PATH, help="Path to the FAQs JSON file.")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE, help="Texts per encoder batch.")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE, help="Documents per bulk request.")
+    parser.add_argument("--threads", type=int, default=BULK_THREADS, help="Parallel bulk indexing threads.")
+    parser.add_argument("--keep", type=int, default=KEEP_VERSIONS, help="Previous index versions kept for rollback.")
+    parser.add_argument("--rollback", action="store_true", help="Point the alias back at the previous version and exit.")
+    parser.add_argument("--full", action="store_true", help="Rebuild a new index version even if the live one can be updated in place.")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="Encode every text instead of reusing the on-disk embedding store.")
+    return parser.parse_args()
+
 # Main function
 def main():
-    # Load and Vectorize FAQs
-    faqs = load_faqs('../data/faqs-with-ids.json')
-    model = initialize_model(MODEL_NAME)
-    faqs = vectorize_faqs(faqs, model)
+    args = parse_args()
+    started = time.perf_counter()
+
+    if args.rollback:
+        rollback(initialize_es(ES_URL), INDEX_NAME)
+        return
+
+    # Load, check and hash FAQs
+    faqs = hash_faqs(validate_faq_ids(load_faqs(args.faqs), args.faqs))
+    store = None if args.no_embedding_cache else EmbeddingStore(EMBEDDING_CACHE_DIR, ENCODER_ID)
+    model = FaqEncoder(MODEL_NAME, store)
 
     # Initialize Elasticsearch
     es_client = initialize_es(ES_URL)
 
-    # Create index and index FAQs
-    create_index(es_client, INDEX_NAME, INDEX_SETTINGS)
-    index_faqs(es_client, faqs, INDEX_NAME)
+    # Update the live index in place when only some FAQs changed
+    live = current_indices(es_client, INDEX_NAME)
+    if not args.full and len(live) == 1 and supports_incremental(es_client, live[0]):
+        sync_index(
+            es_client, faqs, live[0], model,
+            batch_size=args.batch_size, chunk_size=args.chunk_size, thread_count=args.threads,
+        )
+        report_rate("Total", len(faqs), time.perf_counter() - started)
+        return
+
+    # Otherwise vectorize everything into a new index version, warm it and swap the alias over to it
+    start = time.perf_counter()
+    faqs = vectorize_faqs(faqs, model, batch_size=args.batch_size)
+    report_rate("Vectorized", len(faqs), time.perf_counter() - start)
+
+    new_index = versioned_index_name(INDEX_NAME)
+    create_index(es_client, new_index, index_settings_for(faqs))
+    start = time.perf_counter()
+    indexed = index_faqs(es_client, faqs, new_index, chunk_size=args.chunk_size, thread_count=args.threads)
+    report_rate("Indexed", indexed, time.perf_counter() - start)
+    if indexed < len(faqs):
+        raise ValueError(f"Only {indexed} of {len(faqs)} FAQs were indexed into {new_index}; keeping the current alias.")
+    warm_index(es_client, new_index, model)
+    swap_alias(es_client, INDEX_NAME, new_index)
+    prune_versions(es_client, INDEX_NAME, args.keep)
+    report_rate("Total", indexed, time.perf_counter() - started)
 
     # Search for a FAQ
     result = faq_question(es_client, model, "What is a TIN?")
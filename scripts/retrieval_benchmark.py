@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Measures retrieval quality and speed over the ground-truth questions, e.g.
+#   python scripts/retrieval_benchmark.py --backend memory --output bench.json
+#   python scripts/retrieval_benchmark.py --backend elasticsearch --limit 500 --baseline bench.json
+# Every search type is run with every vector field it uses. A question is a hit when the FAQ it
+# was generated from (the `document` column) is among the top-k results.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+GROUND_TRUTH_PATH = os.path.join(DATA_DIR, 'ground-truth-data.csv')
+VECTOR_FIELDS = ["question_vector", "answer_vector", "question_answer_vector"]
+SEARCH_TYPES = ["text", "vector", "hybrid", "rrf"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark hit rate, MRR, latency and QPS of each search type.")
+    parser.add_argument("--ground-truth", default=GROUND_TRUTH_PATH, help="CSV with question and document columns.")
+    parser.add_argument("--backend", choices=["memory", "elasticsearch"],
+                        default=os.getenv("RETRIEVAL_BACKEND", "elasticsearch"))
+    parser.add_argument("--index", default=None, help="Elasticsearch index or alias (default: INDEX_NAME).")
+    parser.add_argument("--search-types", nargs="+", choices=SEARCH_TYPES, default=SEARCH_TYPES)
+    parser.add_argument("--fields", nargs="+", choices=VECTOR_FIELDS, default=VECTOR_FIELDS)
+    parser.add_argument("--k", type=int, default=5, help="Results per query; hit rate and MRR are @k.")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N questions.")
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed queries run before each configuration.")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", default=None, help="Earlier --output file to compare against.")
+    return parser.parse_args()
+
+
+args = parse_args()
+# The backend is read when raglogic is imported
+os.environ["RETRIEVAL_BACKEND"] = args.backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from rag import raglogic  # noqa: E402
+
+
+def search_functions(backend, index_name, k):
+    """
+    One search callable per configuration, taking (question, vector) and returning ranked FAQ sources.
+    """
+    configurations = {}
+    if backend == "memory":
+        retriever = raglogic.get_memory_retriever()
+        configurations["text"] = lambda question, vector: retriever.search_text(question, k)
+        for field in VECTOR_FIELDS:
+            configurations[f"vector:{field}"] = lambda question, vector, field=field: retriever.search_knn(field, vector, k)
+            configurations[f"hybrid:{field}"] = (
+                lambda question, vector, field=field: retriever.search_hybrid(field, question, vector, k)
+            )
+    else:
+        configurations["text"] = lambda question, vector: raglogic.elastic_search_text(question, index_name, k)
+        for field in VECTOR_FIELDS:
+            configurations[f"vector:{field}"] = (
+                lambda question, vector, field=field: raglogic.elastic_search_knn(field, vector, index_name, k)
+            )
+            configurations[f"hybrid:{field}"] = (
+                lambda question, vector, field=field: raglogic.elastic_search_hybrid(field, question, vector, index_name)
+            )
+    for field in VECTOR_FIELDS:
+        configurations[f"rrf:{field}"] = lambda question, vector, field=field: raglogic.hybrid_search_rrf(
+            question, vector, field=field, k=k, index_name=index_name
+        )[0]
+    return configurations
+
+
+def evaluate(search, questions, vectors, documents, k, warmup):
+    """
+    Run every question through one search configuration and summarize quality and latency.
+    """
+    for position in range(min(warmup, len(questions))):
+        search(questions[position], vectors[position])
+
+    latencies, reciprocal_ranks, empty = [], [], 0
+    start = time.perf_counter()
+    for question, vector, document in zip(questions, vectors, documents):
+        query_start = time.perf_counter()
+        results = search(question, vector)
+        latencies.append(time.perf_counter() - query_start)
+
+        ids = [result.get("id") for result in results[:k]]
+        empty += not ids
+        reciprocal_ranks.append(1.0 / (ids.index(document) + 1) if document in ids else 0.0)
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "queries": len(questions),
+        "hit_rate": float(np.mean([rank > 0 for rank in reciprocal_ranks])),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+        "qps": len(questions) / elapsed if elapsed else 0.0,
+        "empty_results": empty,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, baseline):
+    print(f"{'configuration':>30} {'hit rate':>9} {'MRR':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'QPS':>8}")
+    for name, row in results.items():
+        print(
+            f"{name:>30} {row['hit_rate']:>9.3f} {row['mrr']:>7.3f} {row['latency_p50_ms']:>8.2f} "
+            f"{row['latency_p95_ms']:>8.2f} {row['latency_p99_ms']:>8.2f} {row['qps']:>8.1f}"
+        )
+        if baseline and name in baseline:
+            before = baseline[name]
+            print(
+                f"{'vs baseline':>30} {row['hit_rate'] - before['hit_rate']:>+9.3f} {row['mrr'] - before['mrr']:>+7.3f} "
+                f"{row['latency_p50_ms'] - before['latency_p50_ms']:>+8.2f} "
+                f"{row['latency_p95_ms'] - before['latency_p95_ms']:>+8.2f} "
+                f"{row['latency_p99_ms'] - before['latency_p99_ms']:>+8.2f} {row['qps'] - before['qps']:>+8.1f}"
+            )
+
+
+def main():
+    ground_truth = pd.read_csv(args.ground_truth).dropna(subset=["question", "document"])
+    if args.limit:
+        ground_truth = ground_truth.head(args.limit)
+    questions = ground_truth["question"].tolist()
+    documents = ground_truth["document"].astype(str).tolist()
+    index_name = args.index or raglogic.INDEX_NAME
+
+    vectors = [None] * len(questions)
+    embedding = {}
+    if any(search_type != "text" for search_type in args.search_types):
+        raglogic.get_model()
+        start = time.perf_counter()
+        vectors = [vector.tolist() for vector in raglogic.encode_texts(questions)]
+        elapsed = time.perf_counter() - start
+        embedding = {"seconds": elapsed, "texts_per_second": len(questions) / elapsed if elapsed else 0.0}
+
+    results = {}
+    for name, search in search_functions(args.backend, index_name, args.k).items():
+        search_type, _, field = name.partition(":")
+        if search_type not in args.search_types or (field and field not in args.fields):
+            continue
+        print(f"Running {name} over {len(questions)} questions...", file=sys.stderr)
+        results[name] = evaluate(search, questions, vectors, documents, args.k, args.warmup)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "backend": args.backend,
+            "index": index_name if args.backend == "elasticsearch" else raglogic.FAQS_PATH,
+            "encoder": raglogic.ENCODER_ID,
+            "ground_truth": os.path.basename(args.ground_truth),
+            "queries": len(questions),
+            "k": args.k,
+            "embedding": embedding,
+        },
+        "results": results,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+    print_table(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
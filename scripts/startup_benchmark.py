@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures cold start in fresh interpreters, e.g.
+#   python scripts/startup_benchmark.py --runs 5 --import-budget 2.0
+# Exits with status 1 when a median exceeds its budget, so it can gate CI.
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+# Run in each child process; prints one JSON line of phase timings
+CHILD = """
+import json, os, resource, sys, time
+timings = {}
+
+start = time.perf_counter()
+import django
+django.setup()
+import app.urls
+timings["import"] = time.perf_counter() - start
+
+if "--preload" in sys.argv:
+    from rag import raglogic
+    start = time.perf_counter()
+    raglogic.preload()
+    timings["preload"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    raglogic.encode_query("How do I register for a TIN?")
+    timings["first_encode"] = time.perf_counter() - start
+
+timings["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(timings))
+"""
+
+
+def run_once(preload: bool) -> dict:
+    """
+    Start a fresh interpreter, time Django setup plus the URLconf import and, optionally, preloading.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE="app.settings", RAG_PRELOAD="false")
+    command = [sys.executable, "-c", CHILD] + (["--preload"] if preload else [])
+    result = subprocess.run(command, cwd=APP_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark child failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time and model preload for the API.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=2.0,
+                        help="Maximum median seconds for django.setup() plus importing the URLconf.")
+    parser.add_argument("--preload-budget", type=float, default=None,
+                        help="Maximum median seconds for preloading the embedding model.")
+    parser.add_argument("--skip-preload", action="store_true", help="Only measure the import phase.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    runs = [run_once(preload=not args.skip_preload) for _ in range(args.runs)]
+    summary = {
+        phase: {
+            "median": statistics.median(run[phase] for run in runs),
+            "max": max(run[phase] for run in runs),
+        }
+        for phase in runs[0]
+    }
+
+    budgets = {"import": args.import_budget, "preload": args.preload_budget}
+    failures = [
+        f"{phase} median {summary[phase]['median']:.3f}s exceeds budget {budget:.3f}s"
+        for phase, budget in budgets.items()
+        if budget is not None and phase in summary and summary[phase]["median"] > budget
+    ]
+
+    if args.json:
+        print(json.dumps({"runs": args.runs, "summary": summary, "failures": failures}, indent=2))
+    else:
+        print(f"{'phase':>14} {'median':>10} {'max':>10}")
+        for phase, values in summary.items():
+            unit = "MB" if phase.endswith("_mb") else "s"
+            print(f"{phase:>14} {values['median']:>9.3f}{unit} {values['max']:>9.3f}{unit}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Canned FAQ returned by the fake Elasticsearch for every search
+STUB_FAQ = {
+    "id": "stub0001",
+    "section": "Domestic Taxes FAQs",
+    "question": "What is a TIN?",
+    "answer": "A Taxpayer Identification Number (TIN) is a unique number issued by URA to every taxpayer.",
+}
+
+STUB_ANSWER = "A TIN is a unique Taxpayer Identification Number issued by URA."
+STUB_EVALUATION = json.dumps({"Relevance": "RELEVANT", "Explanation": "Stub evaluation."})
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    jitter = 0.0
+    token_latency = 0.0
+    rate_limit_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _wait(self):
+        # Exponentially distributed extra delay, averaging `jitter` times the base latency, gives a long tail
+        extra = random.expovariate(1 / (self.latency * self.jitter)) if self.latency and self.jitter else 0.0
+        time.sleep(self.latency + extra)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class OpenAIStubHandler(_StubHandler):
+    """
+    Minimal stand-in for the OpenAI chat completions endpoint, including `stream=True`.
+
+    A `rate_limit_rate` fraction of requests is rejected with 429 and a Retry-After header.
+    """
+
+    def do_POST(self):
+        request = self._read_json()
+        if self.rate_limit_rate and random.random() < self.rate_limit_rate:
+            self._send_json(
+                {"error": {"message": "Rate limit reached (stub).", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"Retry-After": "0.05"},
+            )
+            return
+        self._wait()
+
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        if "expert evaluator" not in prompt:
+            content = STUB_ANSWER
+        elif "items for evaluation" in prompt:
+            content = json.dumps([json.loads(STUB_EVALUATION)] * prompt.count("Generated Answer:"))
+        else:
+            content = STUB_EVALUATION
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = max(1, len(content) // 4)
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if request.get("stream"):
+            self._stream(request, content, usage)
+            return
+
+        self._send_json({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _stream(self, request, content, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(choices, chunk_usage=None):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": choices,
+                "usage": chunk_usage,
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        words = content.split(" ")
+        for position, word in enumerate(words):
+            text = word if position == 0 else " " + word
+            send([{"index": 0, "delta": {"role": "assistant", "content": text}, "finish_reason": None}])
+            time.sleep(self.token_latency)
+        send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if request.get("stream_options", {}).get("include_usage"):
+            send([], usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class ElasticsearchStubHandler(_StubHandler):
+    """
+    Minimal stand-in for the Elasticsearch search, multi-search, settings and mapping APIs.
+    """
+
+    def _send_es(self, payload):
+        self._send_json(payload, headers={"X-Elastic-Product": "Elasticsearch"})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        index = self.path.strip("/").split("/")[0] or "ura_faqs"
+        if "_settings" in self.path:
+            self._send_es({index: {"settings": {"index": {"uuid": "stub-index"}}}})
+        elif "_mapping" in self.path:
+            self._send_es({index: {"mappings": {"_meta": {"content_version": "stub"}}}})
+        else:
+            self._send_es({"version": {"number": "8.15.1"}, "tagline": "You Know, for Search"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        self._wait()
+        hits = [{"_index": "ura_faqs", "_id": STUB_FAQ["id"], "_score": 1.0, "_source": STUB_FAQ}] * 5
+        response = {
+            "took": int(self.latency * 1000),
+            "timed_out": False,
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "max_score": 1.0, "hits": hits},
+        }
+        if "_msearch" in self.path:
+            # NDJSON body: one header line and one body line per search
+            searches = len([line for line in body.splitlines() if line.strip()]) // 2
+            self._send_es({"took": response["took"], "responses": [dict(response, status=200)] * searches})
+            return
+        self._send_es(response)
+
+
+def start_stub(
+    handler, port: int, latency: float, token_latency: float = 0.0, rate_limit_rate: float = 0.0, jitter: float = 0.0
+) -> ThreadingHTTPServer:
+    """
+    Start a stub server on a background thread and return it.
+    """
+    handler_class = type(handler.__name__, (handler,), {
+        "latency": latency, "jitter": jitter, "token_latency": token_latency, "rate_limit_rate": rate_limit_rate,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local stub servers for OpenAI and Elasticsearch.")
+    parser.add_argument("--openai-port", type=int, default=8100)
+    parser.add_argument("--es-port", type=int, default=9201)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds of simulated latency per call.")
+    parser.add_argument("--openai-latency", type=float, default=None, help="OpenAI latency (default: --latency).")
+    parser.add_argument("--es-latency", type=float, default=None, help="Elasticsearch latency (default: --latency).")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Mean random extra latency as a fraction of the base latency, e.g. 0.5.")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="Seconds between streamed tokens.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="Fraction of OpenAI requests rejected with 429 Too Many Requests.")
+    args = parser.parse_args()
+
+    openai_latency = args.latency if args.openai_latency is None else args.openai_latency
+    es_latency = args.latency if args.es_latency is None else args.es_latency
+    start_stub(OpenAIStubHandler, args.openai_port, openai_latency, args.token_latency, args.rate_limit_rate, args.jitter)
+    start_stub(ElasticsearchStubHandler, args.es_port, es_latency, jitter=args.jitter)
+    print(f"OpenAI stub:        OPENAI_BASE_URL=http://127.0.0.1:{args.openai_port}/v1")
+    print(f"Elasticsearch stub: ELASTIC_URL=http://127.0.0.1:{args.es_port}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
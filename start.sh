@@ -1,21 +1,64 @@
 #!/bin/sh
+# Usage: start.sh [web|migrate|scrape|index|dev]
+#   web      serve the API with gunicorn and uvicorn workers (default)
+#   migrate  apply database migrations and collect static files, then exit
+#   scrape   download the data files and scrape the FAQs, then exit
+#   index    build the Elasticsearch index from the FAQs, then exit
+#   dev      run every job above, then the Django development server
+set -e
 
 export $(grep -v '^#' .env | xargs)
 
-# download files from azure blob storage into the data folder
-python /scripts/azure_downloader.py
+# prometheus_client writes its per-process files here as soon as the app is imported,
+# which every mode does (migrate loads the rag app too), not only gunicorn
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
 
-# Run the scraper script
-python scrapper_script.py
+migrate() {
+    # Apply database migrations
+    python /app/manage.py migrate
 
-# Apply database migrations
-python /app/manage.py migrate
+    # Collect static files (optional, typically used in production)
+    python /app/manage.py collectstatic --noinput
+}
 
-# Collect static files (optional, typically used in production)
-python /app/manage.py collectstatic --noinput
+scrape() {
+    # download files from azure blob storage into the data folder
+    python /scripts/azure_downloader.py
 
-# Create indexes in elastic search
-python /scripts/rag.py
+    # Run the scraper script
+    python scrapper_script.py
+}
 
-# Start the Django development server
-exec python /app/manage.py runserver 0.0.0.0:8000
+index() {
+    # Create indexes in elastic search
+    python /scripts/rag.py
+}
+
+case "${1:-web}" in
+    web)
+        cd /app
+        exec gunicorn app.asgi:application --config /app/gunicorn.conf.py
+        ;;
+    migrate)
+        migrate
+        ;;
+    scrape)
+        scrape
+        ;;
+    index)
+        index
+        ;;
+    dev)
+        scrape
+        migrate
+        index
+        # Start the Django development server
+        exec python /app/manage.py runserver 0.0.0.0:8000
+        ;;
+    *)
+        echo "Unknown command: $1 (expected web, migrate, scrape, index or dev)" >&2
+        exit 2
+        ;;
+esac